@@ -3,12 +3,13 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils.module_loading import import_string
 from urllib.parse import urljoin
-import requests
 import json
 
 import sys
 import logging
 
+from observation_portal.common.upstream import client_apps_client
+
 logger = logging.getLogger()
 
 
@@ -27,7 +28,7 @@ class Command(BaseCommand):
         for user in users:
             try:
                 data = import_string(settings.SERIALIZERS['accounts']['User'])(user).data
-                response = requests.post(url, data=json.dumps(data), headers=header)
+                response = client_apps_client.post(url, data=json.dumps(data), headers=header)
                 response.raise_for_status()
             except Exception:
                 logger.error("Failed to update client user details, please run this command again", exc_info=1)
@@ -10,7 +10,7 @@ from django.contrib.auth.models import User
 from oauth2_provider.models import AccessToken, Application
 from rest_framework.authtoken.models import Token
 
-from observation_portal.proposals.models import Proposal
+from observation_portal.proposals.models import Proposal, TimeUsedByUser
 
 logger = logging.getLogger()
 
@@ -32,14 +32,7 @@ class Profile(models.Model):
     def time_used_in_proposal(self, proposal):
         if not proposal.current_semester:
             return 0
-        requestgroups = self.user.requestgroup_set.filter(
-            proposal=proposal, created__gte=proposal.current_semester.start, state__in=['PENDING', 'COMPLETED']
-        ).prefetch_related('requests')
-        return sum(
-            request.duration for request_group in requestgroups for request in request_group.requests.filter(
-                state__in=['PENDING', 'COMPLETED']
-            )
-        )
+        return TimeUsedByUser.get_time_used(self.user, proposal, proposal.current_semester)
 
     @property
     def archive_bearer_token(self):
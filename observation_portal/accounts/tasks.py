@@ -3,11 +3,13 @@ from django.utils import timezone
 from django.core.mail import send_mail as django_send_mail
 from django.core.mail import send_mass_mail as django_send_mass_mail
 from django.contrib.auth.models import User
+from django.db.models.functions import Lower
 from django.conf import settings
 from oauth2_provider.models import AccessToken
 from urllib.parse import urljoin
 import logging
-import requests
+
+from observation_portal.common.upstream import client_apps_client
 
 
 logger = logging.getLogger(__name__)
@@ -23,7 +25,7 @@ def update_or_create_client_applications_user(user_json):
         url = urljoin(base_url, '/authprofile/addupdateuser/')
         logger.info(f"Updating user details at {url}")
         header = {'Authorization': f"Server {settings.OAUTH_SERVER_KEY}"}
-        response = requests.post(url, data=user_json, headers=header)
+        response = client_apps_client.post(url, data=user_json, headers=header)
         response.raise_for_status()
 
 
@@ -33,14 +35,22 @@ def expire_access_tokens():
     AccessToken.objects.filter(expires__lt=timezone.now()).delete()
 
 
+def usernames_by_email(email_addresses):
+    """Look up the usernames for a set of email addresses, ignoring case, with a single query"""
+    usernames = {}
+    users = User.objects.annotate(email_lower=Lower('email')).filter(
+        email_lower__in={email_address.lower() for email_address in email_addresses}
+    ).values_list('email_lower', 'username')
+    for email_address, username in users:
+        usernames.setdefault(email_address, set()).add(username)
+    return usernames
+
+
 @dramatiq.actor()
 def send_mail(*args, **kwargs):
     # Add logging for emails - args[0] is subject and args[3] is recipients
-    usernames = set()
-    for email_address in args[3]:
-        usernames = usernames.union(
-            set(User.objects.filter(email__iexact=email_address).values_list('username', flat=True))
-        )
+    usernames_for_emails = usernames_by_email(args[3])
+    usernames = set().union(*[usernames_for_emails.get(email_address.lower(), set()) for email_address in args[3]])
     logger.info(f"Sending email to {','.join(usernames)} with subject {args[0]}")
     django_send_mail(*args, **kwargs)
 
@@ -48,11 +58,12 @@ def send_mail(*args, **kwargs):
 @dramatiq.actor()
 def send_mass_mail(emails):
     # Add logging for emails sent out
+    usernames_for_emails = usernames_by_email(
+        email_address for email_tuple in emails for email_address in email_tuple[3]
+    )
     for email_tuple in emails:
-        usernames = set()
-        for email_address in email_tuple[3]:
-            usernames = usernames.union(
-                set(User.objects.filter(email__iexact=email_address).values_list('username', flat=True))
-            )
+        usernames = set().union(
+            *[usernames_for_emails.get(email_address.lower(), set()) for email_address in email_tuple[3]]
+        )
         logger.info(f"Sending email to {','.join(usernames)} with subject {email_tuple[0]}")
     django_send_mass_mail(emails)
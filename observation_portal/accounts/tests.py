@@ -17,6 +17,7 @@ from rest_framework import status
 
 from observation_portal.accounts.test_utils import blend_user
 from observation_portal.accounts.models import Profile
+from observation_portal.common.upstream import reset_upstream_clients
 from observation_portal.proposals.models import Proposal, Membership, TimeAllocation, Semester
 
 
@@ -256,6 +257,7 @@ class TestProfileAPI(APITestCase):
 class TestClientUserUpdates(DramatiqTestCase):
     def setUp(self):
         super().setUp()
+        reset_upstream_clients()
         self.user = blend_user()
         self.api_token = self.user.profile.api_token.key  # This triggers creating the api_token if it doesn't exist
         self.profile = self.user.profile
@@ -0,0 +1,146 @@
+"""
+change_notifications.py - Redis pub/sub notifications that let clients long-poll for changes to the last scheduled and
+last changed times instead of polling for them, and the per site versions of the schedule
+"""
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+import redis
+from dateutil.parser import parse
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'observation_portal_changed:'
+
+SCHEDULE_VERSION_CACHE_KEY = 'observation_portal_schedule_version'
+
+_redis_client = None
+
+
+def _get_redis_client():
+    global _redis_client
+    if not settings.NOTIFICATIONS_REDIS_URL:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.NOTIFICATIONS_REDIS_URL)
+    return _redis_client
+
+
+def _publish(cache_key):
+    client = _get_redis_client()
+    if client is None:
+        return
+    try:
+        client.publish(CHANNEL_PREFIX + cache_key, 1)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f'Could not publish change to {cache_key}: {repr(e)}')
+
+
+def notify_change(cache_key):
+    """Wake up the clients waiting on a change to the value stored in cache_key, once the current transaction is
+    committed so they can see the changed data"""
+    if settings.NOTIFICATIONS_REDIS_URL:
+        transaction.on_commit(lambda: _publish(cache_key))
+
+
+def get_change_times(cache_keys):
+    """Return the change times stored in the cache keys. A key that was never set is given a fixed baseline of a week
+    ago the first time it is read, so a client passing that time back as `since` waits for a change instead of being
+    answered straight away with a time that moves forward on every call."""
+    change_times = cache.get_many(cache_keys)
+    missing_keys = [cache_key for cache_key in cache_keys if cache_key not in change_times]
+    if missing_keys:
+        baseline = timezone.now() - timedelta(days=7)
+        for cache_key in missing_keys:
+            cache.add(cache_key, baseline, None)
+        change_times.update(cache.get_many(missing_keys))
+        for cache_key in missing_keys:
+            change_times.setdefault(cache_key, baseline)
+    return change_times
+
+
+def bump_schedule_versions(sites):
+    """Give the schedules of the sites a new version. The version is set again once the current transaction is
+    committed, so a schedule read before the commit is not kept under the new version."""
+    sites = set(sites)
+    if not sites:
+        return
+
+    def set_versions():
+        cache.set_many({f'{SCHEDULE_VERSION_CACHE_KEY}_{site}': uuid.uuid4().hex for site in sites}, None)
+
+    set_versions()
+    transaction.on_commit(set_versions)
+
+
+def get_schedule_version(site):
+    """Return the current version of the schedule of a site. A site without a version is given one, and a new one is
+    returned each time if the cache does not keep it, so an unknown version never matches."""
+    cache_key = f'{SCHEDULE_VERSION_CACHE_KEY}_{site}'
+    cache.add(cache_key, uuid.uuid4().hex, None)
+    return cache.get(cache_key) or uuid.uuid4().hex
+
+
+def get_long_poll_parameters(request):
+    """Return the time the client last saw a change and how many seconds it is willing to wait for the next one.
+    Clients that do not pass `since` are answered straight away."""
+    since = request.query_params.get('since')
+    if not since:
+        return None, 0
+    try:
+        since = parse(since)
+        wait = float(request.query_params.get('wait', settings.LONG_POLL_MAX_WAIT))
+    except (ValueError, OverflowError):
+        raise ValidationError({'since': 'since must be a datetime and wait a number of seconds'})
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.utc)
+    return since, max(0, min(wait, settings.LONG_POLL_MAX_WAIT))
+
+
+class ChangeSubscription(object):
+    """Subscribe to changes of the given cache keys. Subscribing before reading the current values means a change made
+    in between is not missed."""
+    def __init__(self, cache_keys):
+        self.channels = [CHANNEL_PREFIX + cache_key for cache_key in cache_keys]
+        self.pubsub = None
+
+    def __enter__(self):
+        client = _get_redis_client()
+        if client is not None:
+            try:
+                self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+                self.pubsub.subscribe(*self.channels)
+            except redis.exceptions.RedisError as e:
+                logger.warning(f'Could not subscribe to changes: {repr(e)}')
+                self.pubsub = None
+        return self
+
+    def __exit__(self, *args):
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except redis.exceptions.RedisError:
+                pass
+
+    def wait(self, timeout):
+        """Block until one of the keys changes or the timeout passes. Returns whether there was a change."""
+        if self.pubsub is None:
+            return False
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                if self.pubsub.get_message(timeout=remaining) is not None:
+                    return True
+        except redis.exceptions.RedisError as e:
+            logger.warning(f'Lost subscription to changes: {repr(e)}')
+            return False
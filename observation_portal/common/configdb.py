@@ -9,6 +9,7 @@ from django.utils.translation import gettext as _
 from django.conf import settings
 
 from observation_portal.common.utils import cache_function
+from observation_portal.common.upstream import configdb_client
 
 logger = logging.getLogger(__name__)
 
@@ -47,7 +48,7 @@ class ConfigDB(object):
             'persists then please contact support.'
         ))
         try:
-            r = requests.get(settings.CONFIGDB_URL + f'/{resource}/')
+            r = configdb_client.get(settings.CONFIGDB_URL + f'/{resource}/', serve_stale=True)
             r.raise_for_status()
         except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
             msg = f'{e.__class__.__name__}: {error_message}'
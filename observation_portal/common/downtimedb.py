@@ -4,28 +4,69 @@ from django.utils.translation import gettext as _
 from django.conf import settings
 from django.utils import timezone
 import logging
+import uuid
+from contextlib import contextmanager
 from time_intervals.intervals import Intervals
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from observation_portal.common.upstream import downtimedb_client
 
 logger = logging.getLogger(__name__)
 
 DOWNTIMEDB_ERROR_MSG = _(("DowntimeDB connection is currently down, cannot update downtime information. "
                           "Using the last known value."))
 DOWNTIME_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+DOWNTIME_CACHE_DURATION = 900
+# Downtimes that ended longer ago than this are not fetched or kept
+DOWNTIME_LOOKBACK = timedelta(days=30)
+# Incremental syncs cannot see deletions, so all downtimes are fetched again as often as the intervals used to be
+# refreshed. Incremental syncs only pick up downtimes submitted through the portal in between.
+DOWNTIME_FULL_SYNC_INTERVAL = timedelta(seconds=DOWNTIME_CACHE_DURATION)
+# Incremental syncs overlap the previous one a little to tolerate clock skew with downtimedb
+DOWNTIME_SYNC_OVERLAP = timedelta(minutes=1)
+DOWNTIME_SYNC_STATE_KEY = 'downtime_sync_state'
+# Only one worker at a time may update the sync state. A crashed worker's lock expires after the timeout.
+DOWNTIME_SYNC_LOCK_KEY = 'downtime_sync_state.lock'
+DOWNTIME_SYNC_LOCK_TIMEOUT = 60
+DOWNTIME_INTERVALS_KEY = 'downtime_intervals'
+DOWNTIME_INTERVALS_VERSION_KEY = 'downtime_intervals.version'
+DOWNTIME_INTERVALS_FRESH_KEY = 'downtime_intervals.fresh'
 
 
 class DowntimeDBException(Exception):
     pass
 
 
+class DowntimeSyncInProgress(DowntimeDBException):
+    pass
+
+
+@contextmanager
+def sync_state_lock():
+    ''' Holds the lock on the shared sync state. If another worker holds it, this gives up right away rather than
+    waiting inside a web request, and the existing state is used while that worker brings it up to date.
+    '''
+    if not caches['default'].add(DOWNTIME_SYNC_LOCK_KEY, True, DOWNTIME_SYNC_LOCK_TIMEOUT):
+        raise DowntimeSyncInProgress('Another worker is syncing downtimes')
+    try:
+        yield
+    finally:
+        caches['default'].delete(DOWNTIME_SYNC_LOCK_KEY)
+
+
 class DowntimeDB(object):
     @staticmethod
-    def _get_downtime_data():
-        ''' Gets all the data from downtimedb
+    def _get_downtime_data(end_after=None, modified_after=None):
+        ''' Gets the data from downtimedb, optionally restricted to downtimes ending or modified after a time
         :return: list of dictionaries of downtime periods in time order (default)
         '''
+        params = {'limit': 10000}
+        if end_after is not None:
+            params['end_after'] = end_after.strftime(DOWNTIME_DATE_FORMAT)
+        if modified_after is not None:
+            params['modified_after'] = modified_after.strftime(DOWNTIME_DATE_FORMAT)
         try:
-            r = requests.get(settings.DOWNTIMEDB_URL + 'api/?limit=10000')
+            r = downtimedb_client.get(settings.DOWNTIMEDB_URL + 'api/', params=params)
             r.raise_for_status()
         except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
             msg = "{}: {}".format(e.__class__.__name__, DOWNTIMEDB_ERROR_MSG)
@@ -34,21 +75,35 @@ class DowntimeDB(object):
         return r.json()['results']
 
     @staticmethod
-    def _order_downtime_by_resource_and_instrument_type(raw_downtime_intervals):
-        ''' Puts the raw downtime interval sets into a dictionary by resource and then by instrument_type or "all"
+    def _parse_downtime(interval):
+        ''' Parses a raw downtime into its resource, instrument_type or "all", and its start and end times
+        '''
+        return {
+            'id': interval.get('id'),
+            'resource': '.'.join([interval['telescope'], interval['enclosure'], interval['site']]),
+            'instrument_type': interval['instrument_type'] if interval['instrument_type'] else 'all',
+            'start': datetime.strptime(interval['start'], DOWNTIME_DATE_FORMAT).replace(tzinfo=timezone.utc),
+            'end': datetime.strptime(interval['end'], DOWNTIME_DATE_FORMAT).replace(tzinfo=timezone.utc)
+        }
+
+    @staticmethod
+    def _downtime_key(downtime):
+        ''' Downtimes are identified by their id, falling back on their contents if they do not have one
+        '''
+        if downtime['id'] is not None:
+            return downtime['id']
+        return (downtime['resource'], downtime['instrument_type'], downtime['start'], downtime['end'])
+
+    @staticmethod
+    def _order_downtime_by_resource_and_instrument_type(downtimes):
+        ''' Puts the parsed downtimes into a dictionary by resource and then by instrument_type or "all"
         '''
         downtime_intervals = {}
-        for interval in raw_downtime_intervals:
-            resource = '.'.join([interval['telescope'], interval['enclosure'], interval['site']])
-            if resource not in downtime_intervals:
-                downtime_intervals[resource] = {}
-            instrument_type = interval['instrument_type'] if interval['instrument_type'] else 'all'
-            if instrument_type not in downtime_intervals[resource]:
-                downtime_intervals[resource][instrument_type] = []
-            start = datetime.strptime(interval['start'], DOWNTIME_DATE_FORMAT).replace(tzinfo=timezone.utc)
-            end = datetime.strptime(interval['end'], DOWNTIME_DATE_FORMAT).replace(tzinfo=timezone.utc)
-            downtime_intervals[resource][instrument_type].append({'type': 'start', 'time': start})
-            downtime_intervals[resource][instrument_type].append({'type': 'end', 'time': end})
+        for downtime in downtimes:
+            resource_intervals = downtime_intervals.setdefault(downtime['resource'], {})
+            intervals = resource_intervals.setdefault(downtime['instrument_type'], [])
+            intervals.append({'type': 'start', 'time': downtime['start']})
+            intervals.append({'type': 'end', 'time': downtime['end']})
 
         for resource in downtime_intervals:
             for instrument_type, intervals in downtime_intervals[resource].items():
@@ -56,17 +111,74 @@ class DowntimeDB(object):
 
         return downtime_intervals
 
+    @staticmethod
+    def _sync_downtimes():
+        ''' Brings the shared set of parsed downtimes up to date with downtimedb. Only downtimes modified since the
+            last sync are fetched, except for a periodic full sync which picks up downtimes deleted outside of the
+            portal. Downtimes that ended before the lookback cutoff are dropped.
+        '''
+        now = timezone.now()
+        cutoff = now - DOWNTIME_LOOKBACK
+        sync_state = caches['default'].get(DOWNTIME_SYNC_STATE_KEY)
+        if sync_state is None or sync_state['last_full_sync'] < now - DOWNTIME_FULL_SYNC_INTERVAL:
+            data = DowntimeDB._get_downtime_data(end_after=cutoff)
+            downtimes = {}
+            sync_state = {'last_full_sync': now}
+        else:
+            data = DowntimeDB._get_downtime_data(
+                end_after=cutoff, modified_after=sync_state['last_sync'] - DOWNTIME_SYNC_OVERLAP
+            )
+            downtimes = {
+                key: downtime for key, downtime in sync_state['downtimes'].items() if downtime['end'] >= cutoff
+            }
+        for interval in data:
+            downtime = DowntimeDB._parse_downtime(interval)
+            downtimes[DowntimeDB._downtime_key(downtime)] = downtime
+        sync_state['downtimes'] = downtimes
+        sync_state['last_sync'] = now
+        caches['default'].set(DOWNTIME_SYNC_STATE_KEY, sync_state, None)
+        return sync_state
+
+    @staticmethod
+    def _store_downtime_intervals(sync_state):
+        ''' Builds the downtime intervals from the synced downtimes and shares them with every worker through the
+            default cache, stamped with a new version.
+        '''
+        downtime_intervals = {
+            'version': uuid.uuid4().hex,
+            'intervals': DowntimeDB._order_downtime_by_resource_and_instrument_type(sync_state['downtimes'].values())
+        }
+        caches['default'].set(DOWNTIME_INTERVALS_KEY, downtime_intervals, None)
+        caches['default'].set(DOWNTIME_INTERVALS_VERSION_KEY, downtime_intervals['version'], None)
+        caches['default'].set(DOWNTIME_INTERVALS_FRESH_KEY, True, DOWNTIME_CACHE_DURATION)
+        caches['locmem'].set(DOWNTIME_INTERVALS_KEY, downtime_intervals)
+        return downtime_intervals['intervals']
+
+    @staticmethod
+    def _get_shared_downtime_intervals():
+        ''' Returns the last stored downtime intervals, only reloading them from the shared cache when another
+            worker has stored a newer version.
+        '''
+        version = caches['default'].get(DOWNTIME_INTERVALS_VERSION_KEY)
+        downtime_intervals = caches['locmem'].get(DOWNTIME_INTERVALS_KEY)
+        if downtime_intervals is None or downtime_intervals['version'] != version:
+            downtime_intervals = caches['default'].get(DOWNTIME_INTERVALS_KEY)
+            if downtime_intervals is None:
+                return {}
+            caches['locmem'].set(DOWNTIME_INTERVALS_KEY, downtime_intervals)
+        return downtime_intervals['intervals']
+
     @staticmethod
     def refresh_downtime_intervals():
         ''' Refreshes the cached intervals of downtimes - necessary after submitting downtimes so they
             can be used right away.
         '''
         try:
-            data = DowntimeDB._get_downtime_data()
-            downtime_intervals = DowntimeDB._order_downtime_by_resource_and_instrument_type(data)
-            caches['locmem'].set('downtime_intervals', downtime_intervals, 900)
-            caches['locmem'].set('downtime_intervals.no_expire', downtime_intervals)
-            return downtime_intervals
+            with sync_state_lock():
+                sync_state = DowntimeDB._sync_downtimes()
+                return DowntimeDB._store_downtime_intervals(sync_state)
+        except DowntimeSyncInProgress as e:
+            logger.info(repr(e))
         except DowntimeDBException as e:
             logger.warning(repr(e))
         return None
@@ -76,14 +188,26 @@ class DowntimeDB(object):
         ''' Returns dictionary of IntervalSets of downtime intervals per telescope resource and per instrument_type or "all".
             Caches the data and will attempt to update the cache every 15 minutes, but fallback on using previous downtime list otherwise.
         '''
-        downtime_intervals = caches['locmem'].get('downtime_intervals', {})
-        if not downtime_intervals:
+        if not caches['default'].get(DOWNTIME_INTERVALS_FRESH_KEY):
             # If the cache has expired, attempt to update the downtime intervals
             downtime_intervals = DowntimeDB.refresh_downtime_intervals()
-            if downtime_intervals is None:
-                downtime_intervals = caches['locmem'].get('downtime_intervals.no_expire', {})
+            if downtime_intervals is not None:
+                return downtime_intervals
 
-        return downtime_intervals
+        return DowntimeDB._get_shared_downtime_intervals()
+
+    @staticmethod
+    def _forget_downtime(downtime_id):
+        ''' Removes a deleted downtime from the synced downtimes so it stops applying before the next full sync
+        '''
+        try:
+            with sync_state_lock():
+                sync_state = caches['default'].get(DOWNTIME_SYNC_STATE_KEY)
+                if sync_state is not None and sync_state['downtimes'].pop(downtime_id, None) is not None:
+                    caches['default'].set(DOWNTIME_SYNC_STATE_KEY, sync_state, None)
+        except DowntimeDBException as e:
+            # The next full sync drops it instead
+            logger.warning(repr(e))
 
     @staticmethod
     def create_downtime_interval(headers, downtime):
@@ -91,7 +215,7 @@ class DowntimeDB(object):
             Returns the created downtime block and raises a DowntimeDBException on error.
         '''
         try:
-            r = requests.post(settings.DOWNTIMEDB_URL + 'api/', json=downtime, headers=headers)
+            r = downtimedb_client.post(settings.DOWNTIMEDB_URL + 'api/', json=downtime, headers=headers)
             r.raise_for_status()
             DowntimeDB.refresh_downtime_intervals()
             return r.json()
@@ -108,14 +232,15 @@ class DowntimeDB(object):
         try:
             url = settings.DOWNTIMEDB_URL + "api/"
             get_url = url + f"?site={site}&enclosure={enclosure}&telescope={telescope}&reason_exact={observation_id}"
-            r = requests.get(get_url, headers=headers)
+            r = downtimedb_client.get(get_url, headers=headers)
             results = r.json()
             if results.get('count') != 1:
                 logger.error(f"Trying to get downtimes for observation {observation_id} had {results.get('count')} results. This should never happen!")
             else:
                 downtime_id = results.get('results')[0].get('id')
-                r = requests.delete(url + f"{downtime_id}/", headers=headers)
+                r = downtimedb_client.delete(url + f"{downtime_id}/", headers=headers)
                 r.raise_for_status()
+                DowntimeDB._forget_downtime(downtime_id)
                 DowntimeDB.refresh_downtime_intervals()
                 return True
         except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
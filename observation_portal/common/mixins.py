@@ -9,7 +9,11 @@ class ListAsDictMixin(object):
         queryset = self.filter_queryset(self.get_queryset())
 
         page = self.paginate_queryset(queryset)
-        json_models = [model.as_dict() for model in page]
+        # Models that can serialize many instances at once share work between them
+        if hasattr(queryset.model, 'as_dicts'):
+            json_models = queryset.model.as_dicts(page)
+        else:
+            json_models = [model.as_dict() for model in page]
         return self.get_paginated_response(json_models)
 
 
@@ -0,0 +1,98 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class LimitOffsetOrCursorPagination(LimitOffsetPagination):
+    """ Limit/offset pagination by default. Passing `pagination=cursor` switches to keyset pagination on the
+        (ordering field, id) of the results, which stays fast however deep the pages go. The `next` link of a cursor page
+        carries the `cursor` to continue from, and `count=false` skips counting the total number of results.
+    """
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = request.query_params.get(self.mode_query_param) == 'cursor'
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            self.limit = self.default_limit
+        self.ordering_field, self.descending = self.get_keyset_ordering(queryset)
+        self.count = None
+        if request.query_params.get(self.count_query_param, 'true').lower() != 'false':
+            self.count = self.get_count(queryset)
+
+        id_ordering = '-id' if self.descending else 'id'
+        if self.ordering_field == 'id':
+            queryset = queryset.order_by(id_ordering)
+        else:
+            queryset = queryset.order_by(f"{'-' if self.descending else ''}{self.ordering_field}", id_ordering)
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(*cursor))
+
+        results = list(queryset[:self.limit + 1])
+        self.has_next = len(results) > self.limit
+        self.page = results[:self.limit]
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        response_data = OrderedDict()
+        if self.count is not None:
+            response_data['count'] = self.count
+        response_data['next'] = self.get_next_cursor_link()
+        response_data['previous'] = None
+        response_data['results'] = data
+        return Response(response_data)
+
+    def get_keyset_ordering(self, queryset):
+        order_by = [field for field in queryset.query.order_by if field.lstrip('-') != 'id']
+        if not order_by:
+            order_by = queryset.query.order_by or ['-id']
+        ordering = order_by[0]
+        field_name = ordering.lstrip('-')
+        if '__' in field_name:
+            raise ValidationError({self.mode_query_param: f'Cursor pagination does not support ordering by {field_name}'})
+        return field_name, ordering.startswith('-')
+
+    def get_keyset_filter(self, value, id):
+        lookup = 'lt' if self.descending else 'gt'
+        if self.ordering_field == 'id':
+            return Q(**{f'id__{lookup}': id})
+        return Q(**{f'{self.ordering_field}__{lookup}': value}) | Q(**{self.ordering_field: value, f'id__{lookup}': id})
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            field = model._meta.get_field(self.ordering_field)
+            return field.to_python(cursor['value']), int(cursor['id'])
+        except (ValueError, TypeError, KeyError, FieldDoesNotExist, DjangoValidationError):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+
+    def encode_cursor(self, instance):
+        value = getattr(instance, self.ordering_field)
+        cursor = {'value': value.isoformat() if hasattr(value, 'isoformat') else value, 'id': instance.id}
+        return urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+    def get_next_cursor_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
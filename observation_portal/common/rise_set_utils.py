@@ -103,7 +103,7 @@ def get_rise_set_intervals_by_site(request: dict, only_schedulable: bool = False
     return intervals_by_site
 
 
-def get_filtered_rise_set_intervals_by_site(request_dict, site='', is_staff=False):
+def get_filtered_rise_set_intervals_by_site(request_dict, site='', is_staff=False, downtime_intervals=None):
     intervals = {}
     site = site if site else request_dict['location'].get('site', '')
     only_schedulable = not (is_staff and ConfigDB.is_location_fully_set(request_dict.get('location', {})))
@@ -121,7 +121,9 @@ def get_filtered_rise_set_intervals_by_site(request_dict, site='', is_staff=Fals
     intervalsets_by_telescope = intervals_by_site_to_intervalsets_by_telescope(
         intervals_by_site, telescope_details.keys()
     )
-    filtered_intervalsets_by_telescope = filter_out_downtime_from_intervalsets(intervalsets_by_telescope, request_dict['configurations'][0]['instrument_type'])
+    filtered_intervalsets_by_telescope = filter_out_downtime_from_intervalsets(
+        intervalsets_by_telescope, request_dict['configurations'][0]['instrument_type'], downtime_intervals
+    )
     filtered_intervals_by_site = intervalsets_by_telescope_to_intervals_by_site(filtered_intervalsets_by_telescope)
     return filtered_intervals_by_site
 
@@ -164,16 +166,19 @@ def intervals_by_site_to_intervalsets_by_telescope(intervals_by_site: dict, tele
     return intervalsets_by_telescope
 
 
-def filter_out_downtime_from_intervalsets(intervalsets_by_telescope: dict, instrument_type: str) -> dict:
+def filter_out_downtime_from_intervalsets(intervalsets_by_telescope: dict, instrument_type: str,
+                                          downtime_intervals: dict = None) -> dict:
     """Remove downtime intervals.
 
     Parameters:
         intervalsets_by_telescope: rise_set intervals by telescope
         instrument_type: The configuration's instrument_type (for downtime filtering by instrument_type)
+        downtime_intervals: Downtime intervals already fetched from the DowntimeDB, fetched here if not given
     Returns:
         rise_set intervals by telescope with downtimes filtered out
     """
-    downtime_intervals = DowntimeDB.get_downtime_intervals()
+    if downtime_intervals is None:
+        downtime_intervals = DowntimeDB.get_downtime_intervals()
     filtered_intervalsets_by_telescope = {}
     for telescope in intervalsets_by_telescope.keys():
         filtered_intervalsets_by_telescope[telescope] = intervalsets_by_telescope[telescope]
@@ -4,20 +4,21 @@ from math import floor, isclose, ceil
 from django.conf import settings
 from django.core.cache import cache
 from django.db import transaction
-from django.db.models import F
+from django.db.models import F, Max, OuterRef, Subquery
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
 from observation_portal.observations.models import Observation
-from observation_portal.proposals.models import TimeAllocation
+from observation_portal.proposals.models import TimeAllocation, TimeUsedByUser
 from observation_portal.observations.time_accounting import refund_observation_time
 from observation_portal.proposals.notifications import \
     requestgroup_notifications, request_notifications
 from observation_portal.requestgroups.models import Request, RequestGroup, Location
 from observation_portal.requestgroups.request_utils import \
     exposure_completion_percentage
-from observation_portal.requestgroups.duration_utils import \
-    get_requestgroup_duration, get_request_duration_by_instrument_type
+from observation_portal.requestgroups.duration_utils import get_request_duration_by_instrument_type
+from observation_portal.requestgroups.submission import SubmissionContext
+from observation_portal.common.change_notifications import bump_schedule_versions, notify_change
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +34,9 @@ TERMINAL_REQUEST_STATES = ['COMPLETED', 'CANCELED', 'WINDOW_EXPIRED', 'FAILURE_L
 
 TERMINAL_OBSERVATION_STATES = ['CANCELED', 'ABORTED', 'FAILED', 'COMPLETED', 'NOT_ATTEMPTED', 'BAD_DATA']
 
+# Number of expired requests whose states are changed in each transaction
+EXPIRATION_BATCH_SIZE = 1000
+
 
 class InvalidStateChange(Exception):
     """Raised when an illegal state change is attempted"""
@@ -57,20 +61,26 @@ def valid_request_state_change(old_state, new_state, obj):
 def on_configuration_status_state_change(instance):
     # Configuration Status state has changed, so do the necessary updates to the corresponding Observation,
     # Request, and RequestGroup
-    if instance.observation.state not in TERMINAL_OBSERVATION_STATES:
-        update_observation_state(instance.observation)
+    on_observation_configuration_statuses_change(instance.observation)
+
+
+def on_observation_configuration_statuses_change(observation):
+    """Propagate the current states of the configuration statuses of an observation to the observation, its request and
+    its request group"""
+    if observation.state not in TERMINAL_OBSERVATION_STATES:
+        update_observation_state(observation)
 
-    if instance.observation.request.request_group.observation_type in RequestGroup.NON_SCHEDULED_TYPES:
+    if observation.request.request_group.observation_type in RequestGroup.NON_SCHEDULED_TYPES:
         request_group_is_expired = False
     else:
-        request_group_is_expired = instance.observation.request.request_group.max_window_time < timezone.now()
+        request_group_is_expired = observation.request.request_group.max_window_time < timezone.now()
 
     update_request_state(
-        instance.observation.request,
-        instance.observation.configuration_statuses.all(),
+        observation.request,
+        observation.configuration_statuses.all(),
         request_group_is_expired
     )
-    update_request_group_state(instance.observation.request.request_group)
+    update_request_group_state(observation.request.request_group)
 
 
 def on_request_state_change(old_request_state, new_request):
@@ -80,10 +90,14 @@ def on_request_state_change(old_request_state, new_request):
     try:
         telescope_class = new_request.location.telescope_class
         cache.set(f"observation_portal_last_change_time_{telescope_class}", now, None)
+        notify_change(f"observation_portal_last_change_time_{telescope_class}")
     except Location.DoesNotExist:
         pass
     cache.set('observation_portal_last_change_time_all', now, None)
+    notify_change('observation_portal_last_change_time_all')
+    bump_schedule_versions(Observation.objects.filter(request=new_request).values_list('site', flat=True).distinct())
     valid_request_state_change(old_request_state, new_request.state, new_request)
+    update_time_used_for_request(old_request_state, new_request)
     # Must be a valid transition, so do ipp time accounting here if it is a normal type observation
     if new_request.request_group.observation_type == RequestGroup.NORMAL:
         if new_request.state == 'COMPLETED':
@@ -111,7 +125,11 @@ def on_request_state_change(old_request_state, new_request):
 def on_requestgroup_state_change(old_requestgroup_state, new_requestgroup):
     if old_requestgroup_state == new_requestgroup.state:
         return
+    bump_schedule_versions(
+        Observation.objects.filter(request__request_group=new_requestgroup).values_list('site', flat=True).distinct()
+    )
     valid_request_state_change(old_requestgroup_state, new_requestgroup.state, new_requestgroup)
+    update_time_used_for_requestgroup(old_requestgroup_state, new_requestgroup)
     # Pending child requests of a requestgroup in a terminal state other than complete should update their state also
     if new_requestgroup.state in ['CANCELED', 'WINDOW_EXPIRED']:
         for request in new_requestgroup.requests.filter(state__exact='PENDING'):
@@ -119,6 +137,27 @@ def on_requestgroup_state_change(old_requestgroup_state, new_requestgroup):
             request.save()
 
 
+def update_time_used_for_request(old_request_state, new_request):
+    """Add or remove the duration of a request from the time used by its submitter when it starts or stops counting"""
+    request_group_counted = new_request.request_group.state in TimeUsedByUser.TIME_USED_STATES
+    was_counted = request_group_counted and old_request_state in TimeUsedByUser.TIME_USED_STATES
+    is_counted = request_group_counted and new_request.state in TimeUsedByUser.TIME_USED_STATES
+    if was_counted != is_counted:
+        TimeUsedByUser.add_time_used(new_request.request_group, new_request.duration if is_counted else -new_request.duration)
+
+
+def update_time_used_for_requestgroup(old_requestgroup_state, new_requestgroup):
+    """Add or remove the durations of the counted requests of a requestgroup from the time used by its submitter when
+    the requestgroup starts or stops counting"""
+    was_counted = old_requestgroup_state in TimeUsedByUser.TIME_USED_STATES
+    is_counted = new_requestgroup.state in TimeUsedByUser.TIME_USED_STATES
+    if was_counted != is_counted:
+        duration = sum(
+            request.duration for request in new_requestgroup.requests.filter(state__in=TimeUsedByUser.TIME_USED_STATES)
+        )
+        TimeUsedByUser.add_time_used(new_requestgroup, duration if is_counted else -duration)
+
+
 def update_observation_state(observation):
     observation_state = get_observation_state(observation.configuration_statuses.all())
     now = timezone.now()
@@ -126,15 +165,18 @@ def update_observation_state(observation):
     if observation_state:
         with transaction.atomic():
             Observation.objects.filter(pk=observation.id).update(state=observation_state, modified=now)
+        bump_schedule_versions([observation.site])
 
     if observation_state in ['FAILED', 'ABORTED', 'NOT_ATTEMPTED']:
         # If the observation has failed, trigger a reschedule
         try:
             telescope_class = observation.request.location.telescope_class
             cache.set(f"observation_portal_last_change_time_{telescope_class}", now, None)
+            notify_change(f"observation_portal_last_change_time_{telescope_class}")
         except Location.DoesNotExist:
             pass
         cache.set('observation_portal_last_change_time_all', now, None)
+        notify_change('observation_portal_last_change_time_all')
 
 
 def set_observation_state_to_bad_data(observation, set_configuration_statuses=True):
@@ -148,7 +190,7 @@ def set_observation_state_to_bad_data(observation, set_configuration_statuses=Tr
     with transaction.atomic():
         observation.state = 'BAD_DATA'
         if set_configuration_statuses:
-            observation.configuration_statuses.update(state='BAD_DATA')
+            observation.configuration_statuses.update(state='BAD_DATA', modified=now)
         observation.save()
         # If the request was marked as completed but still has time remaining in its windows, set it back to PENDING
         if observation.request.state == 'COMPLETED' and observation.request.max_window_time > now:
@@ -156,6 +198,7 @@ def set_observation_state_to_bad_data(observation, set_configuration_statuses=Tr
             observation.request.save()
             observation.request.request_group.state = 'PENDING'
             observation.request.request_group.save()
+    bump_schedule_versions([observation.site])
     ipp_value = observation.request.request_group.ipp_value
     # If ipp_time is < 1.0, then it was already credited to the proposal on request completion so we should remove it here
     if ipp_value < 1.0:
@@ -186,19 +229,17 @@ def get_observation_state(configuration_statuses):
     return None
 
 
-def validate_ipp(request_group_dict, total_duration_dict):
+def validate_ipp(request_group_dict, submission=None):
     ipp_value = request_group_dict['ipp_value'] - 1
     if ipp_value <= 0:
         return
 
+    if submission is None:
+        submission = SubmissionContext(request_group_dict)
     time_allocations_dict = {
-        tak: TimeAllocation.objects.get(
-            semester__id=tak.semester,
-            instrument_types__contains=[tak.instrument_type],
-            proposal__id=request_group_dict['proposal']
-        ).ipp_time_available for tak in total_duration_dict.keys()
+        tak: submission.get_time_allocation(tak).ipp_time_available for tak in submission.total_duration_by_tak.keys()
     }
-    for tak, duration in total_duration_dict.items():
+    for tak, duration in submission.total_duration_by_tak.items():
         duration_hours = duration / 3600
         if time_allocations_dict[tak] < (duration_hours * ipp_value):
             max_ipp_allowable = (time_allocations_dict[tak] / duration_hours) + 1
@@ -212,24 +253,20 @@ def validate_ipp(request_group_dict, total_duration_dict):
         time_allocations_dict[tak] -= (duration_hours * ipp_value)
 
 
-def debit_ipp_time(request_group):
+def debit_ipp_time(request_group, submission=None):
+    """Debit the ipp time of a newly created request_group. The submission it was validated with is reused if given, so
+    its durations and TimeAllocations are not computed again."""
     ipp_value = request_group.ipp_value - 1
     if ipp_value <= 0:
         return
     try:
-        requestgroup_duration_by_tak = get_requestgroup_duration(request_group.as_dict())
-        time_allocations_dict = {
-            tak: request_group.proposal.timeallocation_set.get(
-                semester__id=tak.semester,
-                instrument_types__contains=[tak.instrument_type]
-            ) for tak in requestgroup_duration_by_tak.keys()
-        }
-
-        for tak, duration in requestgroup_duration_by_tak.items():
+        if submission is None:
+            submission = SubmissionContext(request_group.as_dict())
+        for tak, duration in submission.duration_by_tak.items():
             duration_hours = ceil(duration) / 3600
             ipp_difference = ipp_value * duration_hours
             with transaction.atomic():
-                TimeAllocation.objects.select_for_update().filter(id=time_allocations_dict[tak].id).update(
+                TimeAllocation.objects.select_for_update().filter(id=submission.get_time_allocation(tak).id).update(
                     ipp_time_available=F('ipp_time_available') - ipp_difference)
     except Exception as e:
         logger.warning(_(
@@ -346,40 +383,70 @@ def aggregate_request_states(request_group):
     raise AggregateStateException(f'Unable to Aggregate States: {request_states}')
 
 
+def get_expired_request_ids(now):
+    """Return the ids of the PENDING requests of non-terminal request groups that have expired. Scheduled requests expire
+    when their last window has ended, and non-scheduled requests when their observation has ended."""
+    pending_requests = Request.objects.filter(state='PENDING').exclude(request_group__state__in=TERMINAL_REQUEST_STATES)
+    scheduled_request_ids = pending_requests.exclude(
+        request_group__observation_type__in=RequestGroup.NON_SCHEDULED_TYPES
+    ).annotate(max_window_end=Max('windows__end')).filter(max_window_end__lt=now).values_list('id', flat=True)
+    non_scheduled_request_ids = pending_requests.filter(
+        request_group__observation_type__in=RequestGroup.NON_SCHEDULED_TYPES
+    ).annotate(observation_end=Subquery(
+        Observation.objects.filter(request=OuterRef('pk')).order_by('id').values('end')[:1]
+    )).filter(observation_end__lt=now).values_list('id', flat=True)
+    return list(scheduled_request_ids) + list(non_scheduled_request_ids)
+
+
+def on_requests_window_expired(requests):
+    """Apply the side effects of on_request_state_change to a batch of requests that went from PENDING to
+    WINDOW_EXPIRED, setting the last change times once for the whole batch"""
+    now = timezone.now()
+    telescope_classes = set()
+    expired_durations = {}
+    for request in requests:
+        try:
+            telescope_classes.add(request.location.telescope_class)
+        except Location.DoesNotExist:
+            pass
+        if request.request_group.state in TimeUsedByUser.TIME_USED_STATES:
+            expired_durations.setdefault(request.request_group, 0)
+            expired_durations[request.request_group] += request.duration
+        # Expiring does not use ipp, so any ipp debited on submission is credited back to the proposal
+        if request.request_group.observation_type == RequestGroup.NORMAL and request.request_group.ipp_value >= 1.0:
+            modify_ipp_time_from_request(request.request_group.ipp_value, request, 'credit')
+    for request_group, duration in expired_durations.items():
+        TimeUsedByUser.add_time_used(request_group, -duration)
+    for telescope_class in telescope_classes:
+        cache.set(f"observation_portal_last_change_time_{telescope_class}", now, None)
+        notify_change(f"observation_portal_last_change_time_{telescope_class}")
+    cache.set('observation_portal_last_change_time_all', now, None)
+    notify_change('observation_portal_last_change_time_all')
+    bump_schedule_versions(Observation.objects.filter(request__in=requests).values_list('site', flat=True).distinct())
+
+
 def update_request_states_for_window_expiration():
     """Update the state of all requests and request_groups to WINDOW_EXPIRED if their last window has passed.
     Return True if any states changed, else False."""
     now = timezone.now()
+    expired_request_ids = get_expired_request_ids(now)
     any_states_changed = False
-    for request_group in RequestGroup.objects.exclude(state__in=TERMINAL_REQUEST_STATES):
-        request_states_changed = False
-        if request_group.observation_type not in RequestGroup.NON_SCHEDULED_TYPES:
-            for request in request_group.requests.filter(state='PENDING').prefetch_related('windows'):
-                request_state_changed = False
-                if request.max_window_time < now:
-                    logger.info(f'Expiring request {request.id}', extra={'tags': {'request_num': request.id}})
-                    with transaction.atomic():
-                        if Request.objects.select_for_update().filter(pk=request.id, state='PENDING').update(
-                                state='WINDOW_EXPIRED', modified=timezone.now()):
-                            any_states_changed = True
-                            request_states_changed = True
-                            request_state_changed = True
-                    if request_state_changed:
-                        on_request_state_change('PENDING', Request.objects.get(pk=request.id))
-        else:
-            for request in request_group.requests.all().prefetch_related('observation_set'):
-                request_state_changed = False
-                if request.observation_set.first().end < now:
-                    logger.info(f'Expiring Non-scheduled request {request.id}', extra={'tags': {'request_num': request.id}})
-                    with transaction.atomic():
-                        if Request.objects.select_for_update().filter(pk=request.id, state='PENDING').update(
-                                state='WINDOW_EXPIRED', modified=timezone.now()):
-                            any_states_changed = True
-                            request_states_changed = True
-                            request_state_changed = True
-                    if request_state_changed:
-                        on_request_state_change('PENDING', Request.objects.get(pk=request.id))
-        if request_states_changed:
+    for i in range(0, len(expired_request_ids), EXPIRATION_BATCH_SIZE):
+        batch_ids = expired_request_ids[i:i + EXPIRATION_BATCH_SIZE]
+        with transaction.atomic():
+            # Lock the requests that are still PENDING so only the ones transitioned here get their side effects
+            batch_ids = list(Request.objects.select_for_update().filter(
+                pk__in=batch_ids, state='PENDING'
+            ).values_list('id', flat=True))
+            Request.objects.filter(pk__in=batch_ids).update(state='WINDOW_EXPIRED', modified=timezone.now())
+        if not batch_ids:
+            continue
+        any_states_changed = True
+        requests = list(Request.objects.filter(pk__in=batch_ids).select_related('location', 'request_group__proposal'))
+        for request in requests:
+            logger.info(f'Expiring request {request.id}', extra={'tags': {'request_num': request.id}})
+        on_requests_window_expired(requests)
+        for request_group in RequestGroup.objects.filter(pk__in={request.request_group_id for request in requests}):
             update_request_group_state(request_group)
     return any_states_changed
 
@@ -1,10 +1,11 @@
 from django.conf import settings
 from opensearchpy import OpenSearch, ConnectionError
-from datetime import timedelta
+from datetime import datetime, timedelta
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.utils import timezone
 from copy import deepcopy
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 import logging
 from dateutil.parser import parse
 
@@ -14,6 +15,7 @@ from observation_portal.common.rise_set_utils import get_site_rise_set_intervals
 logger = logging.getLogger(__name__)
 
 ES_STRING_FORMATTER = "%Y-%m-%d %H:%M:%S"
+TELESCOPE_AVAILABILITY_CACHE_DURATION = 86400 * 30
 
 
 class OpenSearchException(Exception):
@@ -55,14 +57,7 @@ class TelescopeStates(object):
         self.event_data = self._get_os_data(sites, telescopes)
 
     def _get_available_telescopes(self, location_dict=None):
-        telescope_to_instruments = configdb.get_instrument_types_per_telescope(location=location_dict,
-                                                                               only_schedulable=self.only_schedulable)
-        if not self.instrument_types:
-            available_telescopes = telescope_to_instruments.keys()
-        else:
-            available_telescopes = [tk for tk, insts in telescope_to_instruments.items() if
-                                    any(inst in insts for inst in self.instrument_types)]
-        return available_telescopes
+        return get_available_telescopes(self.instrument_types, location_dict, self.only_schedulable)
 
     def _get_os_data(self, sites, telescopes):
         event_data = []
@@ -200,6 +195,17 @@ class TelescopeStates(object):
         return "NOT_AVAILABLE", "Unknown"
 
 
+def get_available_telescopes(instrument_types=None, location_dict=None, only_schedulable=True):
+    telescope_to_instruments = configdb.get_instrument_types_per_telescope(location=location_dict,
+                                                                           only_schedulable=only_schedulable)
+    if not instrument_types:
+        available_telescopes = telescope_to_instruments.keys()
+    else:
+        available_telescopes = [tk for tk, insts in telescope_to_instruments.items() if
+                                any(inst in insts for inst in instrument_types)]
+    return available_telescopes
+
+
 def filter_telescope_states_by_intervals(telescope_states, sites_intervals, start, end):
     filtered_states = {}
     for telescope_key, events in telescope_states.items():
@@ -242,8 +248,14 @@ def filter_telescope_states_by_intervals(telescope_states, sites_intervals, star
     return filtered_states
 
 
-def get_telescope_availability_per_day(start, end, telescopes=None, sites=None, instrument_types=None):
-    telescope_states = TelescopeStates(start, end, telescopes, sites, instrument_types).get()
+def _telescope_availability_cache_key(telescope_key, day):
+    return f'telescope_availability_{telescope_key}_{day.isoformat()}'
+
+
+def _compute_telescope_availability_per_day(start, end, telescopes=None, sites=None, instrument_types=None):
+    """Return the availability of each telescope per night, and whether the telescope states could be queried"""
+    telescope_states_query = TelescopeStates(start, end, telescopes, sites, instrument_types)
+    telescope_states = telescope_states_query.get()
     # go through each telescopes list of states, grouping it up by observing night at the site
     rise_set_intervals = {}
     for telescope_key, events in telescope_states.items():
@@ -281,26 +293,91 @@ def get_telescope_availability_per_day(start, end, telescopes=None, sites=None,
             telescope_availability[telescope_key].append([current_day, (
                 time_available.total_seconds() / time_total.total_seconds())])
 
-    return telescope_availability
+    return telescope_availability, telescope_states_query.es is not None
+
+
+def get_telescope_availability_per_day(start, end, telescopes=None, sites=None, instrument_types=None):
+    """Get the nightly fraction of time each telescope was available for scheduling between start and end
+
+    Nights are keyed by the date of their first state within the night. Availability of nights that are fully
+    contained within start and end and that are already over never changes, so those are cached per telescope
+    and night, and only the remaining nights are computed from the telescope states. Nights without any states
+    are not cached, since they are also what is seen when the telescope states could not be queried.
+    """
+    # A night keyed by day D starts on D, so it is complete once D + 2 days has been reached, and it is not
+    # clipped by the start time as long as D is after the start day.
+    first_cacheable_day = start.date() + timedelta(days=1)
+    last_cacheable_day = min(end, timezone.now()).date() - timedelta(days=2)
+    cacheable_days = []
+    day = first_cacheable_day
+    while day <= last_cacheable_day:
+        cacheable_days.append(day)
+        day += timedelta(days=1)
+
+    telescope_keys = [
+        tk for tk in get_available_telescopes(instrument_types)
+        if (not sites or tk.site in sites) and (not telescopes or tk.telescope in telescopes)
+    ]
+    cached_availability = cache.get_many([
+        _telescope_availability_cache_key(tk, day) for tk in telescope_keys for day in cacheable_days
+    ])
+    # Everything before the first night missing from the cache for any telescope can be served from the cache
+    live_day = first_cacheable_day
+    for day in cacheable_days:
+        if any(_telescope_availability_cache_key(tk, day) not in cached_availability for tk in telescope_keys):
+            break
+        live_day = day + timedelta(days=1)
+
+    telescope_availability = defaultdict(list)
+    live_start = start
+    if live_day > first_cacheable_day:
+        for telescope_key in telescope_keys:
+            for day in cacheable_days:
+                if day >= live_day:
+                    break
+                telescope_availability[telescope_key].append(
+                    cached_availability[_telescope_availability_cache_key(telescope_key, day)]
+                )
+        # Start computing a day early so the night before the first live night is grouped the same way it
+        # would be with the full range of telescope states
+        live_start = max(
+            start, datetime.combine(live_day - timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+        )
+
+    live_availability, states_queried = _compute_telescope_availability_per_day(
+        live_start, end, telescopes, sites, instrument_types
+    )
+    to_cache = {}
+    for telescope_key, availabilities in live_availability.items():
+        telescope_availability[telescope_key].extend(
+            availability for availability in availabilities if live_start == start or availability[0] >= live_day
+        )
+        for availability in availabilities:
+            if availability[0] >= live_day and availability[0] in cacheable_days:
+                to_cache[_telescope_availability_cache_key(telescope_key, availability[0])] = availability
+    if to_cache and states_queried:
+        cache.set_many(to_cache, TELESCOPE_AVAILABILITY_CACHE_DURATION)
+
+    return dict(telescope_availability)
 
 
 def combine_telescope_availabilities_by_site_and_class(telescope_availabilities):
-    combined_keys = {TelescopeKey(tk.site, '', '', tk.telescope_class) for tk in telescope_availabilities.keys()}
+    availabilities_by_key = defaultdict(list)
+    for telescope_key, availabilities in telescope_availabilities.items():
+        availabilities_by_key[TelescopeKey(telescope_key.site, '', '', telescope_key.telescope_class)].append(availabilities)
+
     combined_availabilities = {}
-    for key in combined_keys:
-        num_groups = 0
+    for key, grouped_availabilities in availabilities_by_key.items():
         total_availability = []
-        for telescope_key, availabilities in telescope_availabilities.items():
-            if telescope_key.site == key.site and telescope_key.telescope_class == key.telescope_class:
-                num_groups += 1
-                if not total_availability:
-                    total_availability = availabilities
-                else:
-                    for i, availability in enumerate(availabilities):
-                        total_availability[i][1] += availability[1]
+        for availabilities in grouped_availabilities:
+            if not total_availability:
+                total_availability = [[day, availability] for day, availability in availabilities]
+            else:
+                for i, (_, availability) in enumerate(availabilities):
+                    total_availability[i][1] += availability
 
         for i, availability in enumerate(total_availability):
-            total_availability[i][1] /= num_groups
+            total_availability[i][1] /= len(grouped_availabilities)
         combined_availabilities[key] = total_availability
 
     return combined_availabilities
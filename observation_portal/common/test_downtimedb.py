@@ -0,0 +1,86 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import TestCase
+from django.utils import timezone
+
+from observation_portal.common.downtimedb import (
+    DowntimeDB, DOWNTIME_DATE_FORMAT, DOWNTIME_SYNC_LOCK_KEY, DOWNTIME_INTERVALS_FRESH_KEY
+)
+
+
+def make_downtime(downtime_id, start, end, telescope='1m0a', instrument_type=''):
+    return {'id': downtime_id,
+            'start': start.strftime(DOWNTIME_DATE_FORMAT),
+            'end': end.strftime(DOWNTIME_DATE_FORMAT),
+            'site': 'tst',
+            'enclosure': 'doma',
+            'telescope': telescope,
+            'instrument_type': instrument_type,
+            'reason': 'Whatever'}
+
+
+class TestDowntimeDB(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.shared_cache = caches.create_connection('testlocmem')
+        self.shared_cache.clear()
+        self.caches_patcher = patch(
+            'observation_portal.common.downtimedb.caches', {'default': self.shared_cache, 'locmem': self.shared_cache}
+        )
+        self.caches_patcher.start()
+        self.downtime_data_patcher = patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data')
+        self.mock_downtime_data = self.downtime_data_patcher.start()
+        self.now = timezone.now().replace(microsecond=0)
+
+    def tearDown(self):
+        super().tearDown()
+        self.caches_patcher.stop()
+        self.downtime_data_patcher.stop()
+
+    def test_refresh_only_fetches_modified_downtimes_after_first_sync(self):
+        self.mock_downtime_data.return_value = [make_downtime(1, self.now, self.now + timedelta(hours=1))]
+        DowntimeDB.refresh_downtime_intervals()
+        self.assertNotIn('modified_after', self.mock_downtime_data.call_args.kwargs)
+
+        self.mock_downtime_data.return_value = [
+            make_downtime(2, self.now + timedelta(hours=2), self.now + timedelta(hours=3), telescope='1m0b')
+        ]
+        downtime_intervals = DowntimeDB.refresh_downtime_intervals()
+        self.assertIn('modified_after', self.mock_downtime_data.call_args.kwargs)
+        self.assertIn('1m0a.doma.tst', downtime_intervals)
+        self.assertIn('1m0b.doma.tst', downtime_intervals)
+
+    def test_forgotten_downtime_is_removed_on_refresh(self):
+        self.mock_downtime_data.return_value = [
+            make_downtime(1, self.now, self.now + timedelta(hours=1)),
+            make_downtime(2, self.now, self.now + timedelta(hours=1), telescope='1m0b')
+        ]
+        DowntimeDB.refresh_downtime_intervals()
+        self.mock_downtime_data.return_value = []
+        DowntimeDB._forget_downtime(2)
+        downtime_intervals = DowntimeDB.refresh_downtime_intervals()
+        self.assertIn('1m0a.doma.tst', downtime_intervals)
+        self.assertNotIn('1m0b.doma.tst', downtime_intervals)
+
+    def test_downtime_intervals_are_served_from_shared_cache_while_fresh(self):
+        self.mock_downtime_data.return_value = [make_downtime(1, self.now, self.now + timedelta(hours=1))]
+        DowntimeDB.get_downtime_intervals()
+        downtime_intervals = DowntimeDB.get_downtime_intervals()
+        self.assertEqual(self.mock_downtime_data.call_count, 1)
+        self.assertIn('1m0a.doma.tst', downtime_intervals)
+
+    def test_refresh_is_skipped_while_another_worker_is_syncing(self):
+        self.shared_cache.add(DOWNTIME_SYNC_LOCK_KEY, True, 60)
+        self.assertIsNone(DowntimeDB.refresh_downtime_intervals())
+        self.mock_downtime_data.assert_not_called()
+
+    def test_existing_downtime_intervals_are_served_while_another_worker_is_syncing(self):
+        self.mock_downtime_data.return_value = [make_downtime(1, self.now, self.now + timedelta(hours=1))]
+        DowntimeDB.get_downtime_intervals()
+        self.shared_cache.delete(DOWNTIME_INTERVALS_FRESH_KEY)
+        self.shared_cache.add(DOWNTIME_SYNC_LOCK_KEY, True, 60)
+        downtime_intervals = DowntimeDB.get_downtime_intervals()
+        self.assertEqual(self.mock_downtime_data.call_count, 1)
+        self.assertIn('1m0a.doma.tst', downtime_intervals)
@@ -5,6 +5,7 @@ from datetime import timedelta
 from unittest.mock import patch
 from django.db.models.signals import post_save
 from django.core import mail
+from django.core.cache import caches
 from django_dramatiq.test import DramatiqTestCase
 
 from observation_portal.accounts.test_utils import blend_user
@@ -17,6 +18,7 @@ from observation_portal.common.test_helpers import (
 )
 from observation_portal.proposals.models import Proposal, Membership
 from observation_portal.observations.models import Observation, ConfigurationStatus, Summary
+from observation_portal.observations.tasks import propagate_observation_state
 from observation_portal.requestgroups.models import Request, RequestGroup, Window, Location
 from observation_portal.common.state_changes import (
     get_request_state_from_configuration_statuses,
@@ -70,6 +72,43 @@ class TestStateChanges(SetTimeMixin, TestCase):
             request.refresh_from_db()
             self.assertEqual(request.state, 'PENDING')
 
+    @override_settings(STATE_PROPAGATION_DELAY=5)
+    def test_config_status_updates_of_an_observation_are_propagated_together(self):
+        locmem = caches.create_connection('testlocmem')
+        locmem.clear()
+        observation = self.requestgroup.requests.first().observation_set.first()
+        with patch('observation_portal.observations.tasks.cache', locmem), \
+                patch.object(propagate_observation_state, 'send_with_options') as mock_send:
+            with self.captureOnCommitCallbacks(execute=True):
+                for cs in observation.configuration_statuses.all():
+                    cs.state = 'FAILED'
+                    cs.save()
+            self.assertEqual(mock_send.call_count, 1)
+            self.assertEqual(mock_send.call_args.kwargs['args'], (observation.id,))
+            observation.refresh_from_db()
+            self.assertEqual(observation.state, 'PENDING')
+
+            propagate_observation_state(observation.id)
+        observation.refresh_from_db()
+        self.assertEqual(observation.state, 'FAILED')
+
+    @override_settings(STATE_PROPAGATION_DELAY=5)
+    def test_config_status_updates_made_during_a_propagation_are_propagated_again(self):
+        locmem = caches.create_connection('testlocmem')
+        locmem.clear()
+        observation = self.requestgroup.requests.first().observation_set.first()
+
+        def concurrent_update(observation):
+            observation.configuration_statuses.update(modified=timezone.now() + timedelta(seconds=1))
+
+        with patch('observation_portal.observations.tasks.cache', locmem), \
+                patch('observation_portal.observations.tasks.on_observation_configuration_statuses_change',
+                      side_effect=concurrent_update), \
+                patch.object(propagate_observation_state, 'send_with_options') as mock_send:
+            propagate_observation_state(observation.id)
+        self.assertEqual(mock_send.call_count, 1)
+        self.assertEqual(mock_send.call_args.kwargs['args'], (observation.id,))
+
     def test_observation_state_pending_if_all_config_status_pending_and_not_attempted(self):
         observation = self.requestgroup.requests.first().observation_set.first()
         for i, cs in enumerate(observation.configuration_statuses.all()):
@@ -999,6 +1038,44 @@ class TestExpireRequests(TestCase):
         self.assertEqual(request.state, 'WINDOW_EXPIRED')
         self.assertEqual(self.request_group.state, 'WINDOW_EXPIRED')
 
+    def test_only_requests_past_their_last_window_are_set_to_expired(self, ipp_mock):
+        request_groups = dmixer.cycle(3).blend(
+            RequestGroup, state='PENDING', operator='SINGLE', observation_type=RequestGroup.NORMAL
+        )
+        expired_requests = []
+        for request_group in request_groups:
+            request = dmixer.blend(Request, state='PENDING', request_group=request_group)
+            dmixer.blend(Location, request=request, telescope_class='1m0')
+            dmixer.blend(
+                Window, start=timezone.now() - timedelta(days=2), end=timezone.now() - timedelta(days=1), request=request
+            )
+            expired_requests.append(request)
+        # A request that is still pending keeps a MANY request group pending, so nothing cascades back to it
+        many_request_group = dmixer.blend(
+            RequestGroup, state='PENDING', operator='MANY', observation_type=RequestGroup.NORMAL
+        )
+        pending_request = dmixer.blend(Request, state='PENDING', request_group=many_request_group)
+        dmixer.blend(
+            Window, start=timezone.now() - timedelta(days=2), end=timezone.now() - timedelta(days=1), request=pending_request
+        )
+        dmixer.blend(
+            Window, start=timezone.now() - timedelta(days=1), end=timezone.now() + timedelta(days=1), request=pending_request
+        )
+        result = update_request_states_for_window_expiration()
+        self.assertTrue(result)
+        for request in expired_requests:
+            request.refresh_from_db()
+            self.assertEqual(request.state, 'WINDOW_EXPIRED')
+        pending_request.refresh_from_db()
+        self.assertEqual(pending_request.state, 'PENDING')
+        for request_group in request_groups:
+            request_group.refresh_from_db()
+        self.assertEqual(request_groups[0].state, 'WINDOW_EXPIRED')
+        self.assertEqual(request_groups[1].state, 'WINDOW_EXPIRED')
+        self.assertEqual(request_groups[2].state, 'WINDOW_EXPIRED')
+        many_request_group.refresh_from_db()
+        self.assertEqual(many_request_group.state, 'PENDING')
+
     def test_request_is_not_set_to_expired(self, ipp_mock):
         request = dmixer.blend(Request, state='PENDING', request_group=self.request_group)
         dmixer.blend(
@@ -6,6 +6,7 @@ from observation_portal.common.test_helpers import SetTimeMixin
 
 from time_intervals.intervals import Intervals
 from django.test import TestCase
+from django.core.cache import caches
 from datetime import datetime, timedelta
 from django.utils import timezone
 from unittest.mock import patch
@@ -234,6 +235,62 @@ class TestTelescopeStates(TelescopeStatesFakeInput):
         total_expected_availability = (doma_expected_availability + domb_expected_availability) / 2.0
         self.assertAlmostEqual(total_expected_availability, combined_telescope_availability[combined_key][0][1])
 
+    @patch('observation_portal.common.telescope_states.get_site_rise_set_intervals')
+    def test_telescope_availability_completed_nights_are_cached(self, mock_intervals):
+        mock_intervals.return_value = [(datetime(2016, 9, 30, 18, 30, 0, tzinfo=timezone.utc),
+                                        datetime(2016, 9, 30, 21, 0, 0, tzinfo=timezone.utc)),
+                                       (datetime(2016, 10, 1, 18, 30, 0, tzinfo=timezone.utc),
+                                        datetime(2016, 10, 1, 21, 0, 0, tzinfo=timezone.utc)),
+                                       (datetime(2016, 10, 2, 18, 30, 0, tzinfo=timezone.utc),
+                                        datetime(2016, 10, 2, 21, 0, 0, tzinfo=timezone.utc))]
+        locmem_cache = caches.create_connection('testlocmem')
+        locmem_cache.clear()
+        start = datetime(2016, 9, 30, tzinfo=timezone.utc)
+        end = datetime(2016, 10, 3, tzinfo=timezone.utc)
+        with patch('observation_portal.common.telescope_states.cache', locmem_cache):
+            telescope_availability = get_telescope_availability_per_day(start, end)
+            self.assertTrue(telescope_availability[self.tk1])
+            # The night of 10/1 is complete, so it should now come from the cache without any telescope states
+            self.mock_es.return_value = []
+            cached_telescope_availability = get_telescope_availability_per_day(start, end)
+
+        self.assertEqual(telescope_availability[self.tk1], cached_telescope_availability[self.tk1])
+        self.assertEqual(telescope_availability[self.tk2], cached_telescope_availability[self.tk2])
+
+    @patch('observation_portal.common.telescope_states.get_site_rise_set_intervals')
+    def test_telescope_availability_nights_without_states_are_not_cached(self, mock_intervals):
+        mock_intervals.return_value = [(datetime(2016, 10, 1, 18, 30, 0, tzinfo=timezone.utc),
+                                        datetime(2016, 10, 1, 21, 0, 0, tzinfo=timezone.utc))]
+        locmem_cache = caches.create_connection('testlocmem')
+        locmem_cache.clear()
+        start = datetime(2016, 9, 28, tzinfo=timezone.utc)
+        end = datetime(2016, 10, 6, tzinfo=timezone.utc)
+        self.mock_es.return_value = []
+        with patch('observation_portal.common.telescope_states.cache', locmem_cache):
+            self.assertFalse(get_telescope_availability_per_day(start, end))
+            # Once the telescope states are back, the nights are computed from them instead of an empty cache
+            self.mock_es.return_value = self.es_output
+            telescope_availability = get_telescope_availability_per_day(start, end)
+
+        self.assertTrue(telescope_availability[self.tk1])
+        self.assertTrue(telescope_availability[self.tk2])
+
+    @patch('observation_portal.common.telescope_states.get_site_rise_set_intervals')
+    def test_telescope_availability_is_not_cached_when_telescope_states_are_unreachable(self, mock_intervals):
+        mock_intervals.return_value = [(datetime(2016, 10, 1, 18, 30, 0, tzinfo=timezone.utc),
+                                        datetime(2016, 10, 1, 21, 0, 0, tzinfo=timezone.utc))]
+        locmem_cache = caches.create_connection('testlocmem')
+        locmem_cache.clear()
+        start = datetime(2016, 9, 30, tzinfo=timezone.utc)
+        end = datetime(2016, 10, 3, tzinfo=timezone.utc)
+        with patch('observation_portal.common.telescope_states.cache', locmem_cache):
+            with patch('observation_portal.common.telescope_states.OpenSearch', side_effect=Exception):
+                get_telescope_availability_per_day(start, end)
+
+        self.assertFalse(locmem_cache.get_many([
+            f'telescope_availability_{self.tk1}_2016-10-01', f'telescope_availability_{self.tk2}_2016-10-01'
+        ]))
+
 
 class TelescopeStatesFromFile(TestCase):
     def setUp(self):
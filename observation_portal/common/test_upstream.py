@@ -0,0 +1,50 @@
+from django.test import TestCase, override_settings
+import requests
+import responses
+
+from observation_portal.common.upstream import UpstreamClient, UpstreamUnavailable, reset_upstream_clients
+
+
+@override_settings(UPSTREAM_RETRIES=2, UPSTREAM_RETRY_BACKOFF=0, UPSTREAM_CIRCUIT_BREAKER_THRESHOLD=3)
+class TestUpstreamClient(TestCase):
+    def setUp(self):
+        super().setUp()
+        reset_upstream_clients()
+        self.upstream_client = UpstreamClient('test')
+        self.url = f'http://upstreamfake/{self._testMethodName}/'
+
+    def test_get_is_retried_on_server_errors(self):
+        responses.add(responses.GET, self.url, status=503)
+        responses.add(responses.GET, self.url, json={'results': []}, status=200)
+        response = self.upstream_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_is_not_retried(self):
+        responses.add(responses.POST, self.url, status=503)
+        responses.add(responses.POST, self.url, json={}, status=201)
+        response = self.upstream_client.post(self.url)
+        self.assertEqual(response.status_code, 503)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.upstream_client.get(self.url + 'unregistered/')
+        self.assertTrue(self.upstream_client.circuit_breaker_for(self.url).is_open)
+        responses.add(responses.GET, self.url, json={'results': []}, status=200)
+        with self.assertRaises(UpstreamUnavailable):
+            self.upstream_client.get(self.url)
+
+    def test_circuit_of_one_host_does_not_stop_calls_to_others(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.upstream_client.get(self.url + 'unregistered/')
+        other_url = f'http://otherupstreamfake/{self._testMethodName}/'
+        responses.add(responses.GET, other_url, json={'results': []}, status=200)
+        response = self.upstream_client.get(other_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.upstream_client.circuit_breaker_for(other_url).is_open)
+
+    def test_last_good_response_is_served_while_upstream_is_failing(self):
+        responses.add(responses.GET, self.url, json={'results': ['good']}, status=200)
+        self.upstream_client.get(self.url, serve_stale=True)
+        responses.replace(responses.GET, self.url, status=500)
+        response = self.upstream_client.get(self.url, serve_stale=True)
+        self.assertEqual(response.json()['results'], ['good'])
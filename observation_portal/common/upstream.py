@@ -0,0 +1,177 @@
+"""
+upstream.py - Pooled HTTP clients for the services the portal depends on (ConfigDB, DowntimeDB, ...)
+"""
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger('upstream_request')
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'DELETE')
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+class UpstreamUnavailable(requests.exceptions.ConnectionError):
+    """Raised without contacting an upstream while its circuit breaker is open"""
+    pass
+
+
+class CircuitBreaker(object):
+    """Stops calls to an upstream after too many consecutive failures. Once the reset timeout has passed, a single
+    call is let through to test whether the upstream has recovered."""
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half open: push the next attempt back so only this call is let through
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class UpstreamClient(object):
+    """A requests Session for one upstream service, which pools connections per host, applies connect/read timeouts,
+    retries idempotent requests with jittered backoff and stops calling a host while it is failing. Every call is
+    logged as an UpstreamRequestLog with its latency and outcome so they can be aggregated per upstream.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=settings.UPSTREAM_POOL_MAXSIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.circuit_breakers = {}
+        self.circuit_breakers_lock = threading.Lock()
+        self.last_good_responses = {}
+
+    def circuit_breaker_for(self, url):
+        """Return the circuit breaker of the host of the url, so one failing host does not stop calls to the others"""
+        host = urlparse(url).netloc
+        with self.circuit_breakers_lock:
+            if host not in self.circuit_breakers:
+                self.circuit_breakers[host] = CircuitBreaker(
+                    settings.UPSTREAM_CIRCUIT_BREAKER_THRESHOLD, settings.UPSTREAM_CIRCUIT_BREAKER_RESET
+                )
+            return self.circuit_breakers[host]
+
+    def reset(self):
+        """Forget the state of the circuit breakers and the last good responses"""
+        with self.circuit_breakers_lock:
+            self.circuit_breakers = {}
+        self.last_good_responses = {}
+
+    def request(self, method, url, serve_stale=False, **kwargs):
+        """Make a request to the upstream. If serve_stale is set, the last successful response for the same url and
+        parameters is returned when the upstream cannot be reached."""
+        kwargs.setdefault('timeout', (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT))
+        stale_key = (method, url, str(sorted(kwargs.get('params', {}).items())))
+        try:
+            response = self._request_with_retries(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            if serve_stale and stale_key in self.last_good_responses:
+                logger.warning(f'{self.name} is unavailable, using the last good response for {url}')
+                return self.last_good_responses[stale_key]
+            raise
+        if serve_stale:
+            if response.ok:
+                self.last_good_responses[stale_key] = response
+            elif response.status_code >= 500 and stale_key in self.last_good_responses:
+                logger.warning(f'{self.name} is failing, using the last good response for {url}')
+                return self.last_good_responses[stale_key]
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def _request_with_retries(self, method, url, **kwargs):
+        retries = settings.UPSTREAM_RETRIES if method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            try:
+                response = self._request_once(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+            except UpstreamUnavailable:
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= retries:
+                    raise
+            time.sleep(random.uniform(0, settings.UPSTREAM_RETRY_BACKOFF * 2 ** attempt))
+            attempt += 1
+
+    def _request_once(self, method, url, **kwargs):
+        circuit_breaker = self.circuit_breaker_for(url)
+        if not circuit_breaker.allow_request():
+            self._log(method, url, 'circuit_open', 0, circuit_breaker)
+            raise UpstreamUnavailable(f'{self.name} is failing, not calling it for now')
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            circuit_breaker.record_failure()
+            self._log(method, url, e.__class__.__name__, time.monotonic() - start, circuit_breaker, level=logging.WARNING)
+            raise
+        if response.status_code >= 500:
+            circuit_breaker.record_failure()
+            self._log(method, url, response.status_code, time.monotonic() - start, circuit_breaker, level=logging.WARNING)
+        else:
+            circuit_breaker.record_success()
+            self._log(method, url, response.status_code, time.monotonic() - start, circuit_breaker)
+        return response
+
+    def _log(self, method, url, status, duration, circuit_breaker, level=logging.INFO):
+        tags = {
+            'upstream': self.name,
+            'method': method,
+            'uri': url,
+            'status': status,
+            'duration_ms': round(duration * 1000, 1),
+            'circuit_open': circuit_breaker.is_open
+        }
+        logger.log(level, 'UpstreamRequestLog', extra={'tags': tags})
+
+
+configdb_client = UpstreamClient('configdb')
+downtimedb_client = UpstreamClient('downtimedb')
+client_apps_client = UpstreamClient('client_apps')
+external_client = UpstreamClient('external')
+
+
+def reset_upstream_clients():
+    """Reset the module level clients, so the circuit breakers opened by one test do not affect the next"""
+    for client in (configdb_client, downtimedb_client, client_apps_client, external_client):
+        client.reset()
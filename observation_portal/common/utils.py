@@ -4,6 +4,7 @@ utils.py - Common utility functions
 import json
 import hashlib
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.cache import caches
 from cerberus import Validator
@@ -30,6 +31,15 @@ def get_queryset_field_values(queryset, field):
             values_set.update(values)
     return values_set
 
+
+def run_concurrently(*functions):
+    """Call each of the functions in its own thread and return their results in order. This is meant for overlapping
+    calls to upstream services, so any exception raised by one of the functions is raised again here."""
+    with ThreadPoolExecutor(max_workers=len(functions)) as executor:
+        futures = [executor.submit(function) for function in functions]
+        return [future.result() for future in futures]
+
+
 # Decorator to cache the value of the function - defaults to the locmem cache for 5 minutes
 def cache_function(cache_name='locmem', duration=300):
     def cache_decorator(method):
@@ -6,4 +6,6 @@ class ObservationsConfig(AppConfig):
 
     def ready(self):
         import observation_portal.observations.signals.handlers  # noqa
+        from observation_portal.observations.tasks import check_state_propagation_cache
+        check_state_propagation_cache()
         super().ready()
@@ -1,5 +1,6 @@
 import django_filters
 from django import forms
+from django.db.models import Exists, OuterRef
 
 from observation_portal.observations.models import Observation, ConfigurationStatus
 from observation_portal.requestgroups.models import RequestGroup, Request
@@ -75,12 +76,14 @@ class ObservationFilter(mixins.CustomIsoDateTimeFilterMixin, django_filters.Filt
     instrument_type = django_filters.MultipleChoiceFilter(
         choices=lambda: sorted(configdb.get_instrument_type_tuples()),
         label='Instrument Type',
-        field_name='configuration_statuses__configuration__instrument_type'
+        field_name='configuration__instrument_type__in',
+        method='filter_configuration_statuses'
     )
     configuration_type = django_filters.MultipleChoiceFilter(
         choices=lambda: sorted(configdb.get_configuration_type_tuples()),
         label='Configuration Type',
-        field_name='configuration_statuses__configuration__type'
+        field_name='configuration__type__in',
+        method='filter_configuration_statuses'
     )
     ordering = django_filters.OrderingFilter(
         fields=['start', 'end', 'modified', 'created', 'state'],
@@ -91,6 +94,12 @@ class ObservationFilter(mixins.CustomIsoDateTimeFilterMixin, django_filters.Filt
         model = Observation
         exclude = ['start', 'end', 'request', 'created', 'modified']
 
+    def filter_configuration_statuses(self, queryset, name, value):
+        # Use EXISTS rather than joining the configuration statuses, which would duplicate observations
+        return queryset.filter(
+            Exists(ConfigurationStatus.objects.filter(observation=OuterRef('pk'), **{name: value}))
+        )
+
 
 class ConfigurationStatusFilter(django_filters.FilterSet):
     instrument_name = django_filters.ChoiceFilter(choices=lambda: configdb.get_instrument_name_tuples())
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from datetime import date
+
+from observation_portal.observations.models import Observation, ObservationArchive
+
+TERMINAL_STATES = ['COMPLETED', 'FAILED', 'ABORTED', 'NOT_ATTEMPTED', 'CANCELED', 'BAD_DATA']
+# Observations in these states never ran, so they have no summaries that time accounting depends on
+DEFAULT_STATES = ['CANCELED', 'NOT_ATTEMPTED']
+
+
+class Command(BaseCommand):
+    help = ('Moves observations that ended more than a number of whole months ago into the ObservationArchive table, '
+            'removing them and their configuration statuses and summaries from the live tables. Observations with '
+            'summaries are only archived with --with-summaries. The time_accounting command recomputes time used from '
+            'the summaries in the live tables, so it must not be run on semesters that have archived summaries.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-m', '--months', type=int, default=12,
+                            help='Archive observations that ended before the start of the month this many months ago.')
+        parser.add_argument('--states', nargs='+', choices=TERMINAL_STATES, default=DEFAULT_STATES,
+                            help='Only archive observations in these states. Defaults to CANCELED and NOT_ATTEMPTED.')
+        parser.add_argument('--with-summaries', dest='with_summaries', action='store_true', default=False,
+                            help='Also archive observations with summaries. Time accounting must not be run on the '
+                                 'semesters they were in afterwards, since their time used would be lost.')
+        parser.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=1000,
+                            help='Number of observations to archive in each transaction.')
+        parser.add_argument('-d', '--dry-run', dest='dry_run', action='store_true', default=False,
+                            help='Dry-run mode will print how many observations would be archived without moving them.')
+
+    def handle(self, *args, **options):
+        month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        month_index = month_start.year * 12 + month_start.month - 1 - options['months']
+        cutoff = month_start.replace(year=month_index // 12, month=month_index % 12 + 1)
+        observations = Observation.objects.filter(end__lt=cutoff, state__in=options['states'])
+        if not options['with_summaries']:
+            observations = observations.exclude(configuration_statuses__summary__isnull=False)
+        observation_ids = observations.order_by('id').values_list('id', flat=True)
+
+        if options['dry_run']:
+            print(f'Dry Run Mode: Would archive {observation_ids.count()} observations that ended before {cutoff}',
+                  file=self.stdout)
+            return
+
+        total_archived = 0
+        while True:
+            batch_ids = list(observation_ids[:options['batch_size']])
+            if not batch_ids:
+                break
+            observations = Observation.objects.filter(id__in=batch_ids).prefetch_related(
+                'configuration_statuses', 'configuration_statuses__summary'
+            )
+            archived_observations = [
+                ObservationArchive(
+                    month=date(observation.start.year, observation.start.month, 1),
+                    observation_id=observation.id,
+                    request_id=observation.request_id,
+                    state=observation.state,
+                    data=observation.as_dict(no_request=True)
+                ) for observation in observations
+            ]
+            with transaction.atomic():
+                ObservationArchive.objects.bulk_create(archived_observations, ignore_conflicts=True)
+                num_deleted, _, _ = Observation.delete_by_ids(batch_ids)
+            total_archived += num_deleted
+            print(f'Archived {total_archived} observations', file=self.stdout)
+
+        print(f'Archived {total_archived} observations that ended before {cutoff}', file=self.stdout)
@@ -1,10 +1,13 @@
 from django.core.management.base import BaseCommand
+from django.db.models import Count
 from django.utils import timezone
 from datetime import datetime, timedelta
-from observation_portal.observations.time_accounting import configuration_time_used
+from observation_portal.observations.time_accounting import rapid_response_base_duration
 from observation_portal.observations.models import ConfigurationStatus
+from observation_portal.requestgroups.models import Configuration, RequestGroup
 
 import logging
+import time
 logger = logging.getLogger()
 
 
@@ -16,14 +19,74 @@ class Command(BaseCommand):
                             help='Semester start date (datetime in isoformat)')
         parser.add_argument('--end', default=timezone.now(), type=datetime.fromisoformat,
                             help='Semester end date (datetime in isoformat)')
+        parser.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=1000,
+                            help='Number of configuration statuses to update at a time.')
 
     def handle(self, *args, **options):
-        for configuration_status in ConfigurationStatus.objects.filter(created__gte=options['start'], created__lte=options['end']).exclude(state='PENDING', time_charged__gt=0).iterator():
+        configuration_statuses = ConfigurationStatus.objects.filter(
+            created__gte=options['start'], created__lte=options['end'], summary__isnull=False
+        ).exclude(state='PENDING', time_charged__gt=0).select_related(
+            'summary', 'observation__request__request_group'
+        ).order_by('id')
+        # Base durations of the configurations of rapid response requests by request id, so each is computed once
+        base_durations = {}
+        started = time.monotonic()
+        total_updated = 0
+        last_id = 0
+        while True:
+            batch = list(configuration_statuses.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            self.load_base_durations(base_durations, {
+                cs.observation.request_id for cs in batch
+                if cs.observation.request.request_group.observation_type == RequestGroup.RAPID_RESPONSE
+            })
+            updated = []
+            for configuration_status in batch:
+                try:
+                    configuration_status.time_charged = self.time_charged(configuration_status, base_durations)
+                    updated.append(configuration_status)
+                except Exception as ex:
+                    logger.warning(f"Failed to update time_charged for configuration status {configuration_status.id}: {repr(ex)}")
+            # bulk_update skips the post_save signals, so no state changes are propagated for these rows
+            ConfigurationStatus.objects.bulk_update(updated, ['time_charged'])
+            total_updated += len(updated)
+            elapsed = time.monotonic() - started
+            print(f'Updated time_charged for {total_updated} configuration statuses '
+                  f'({total_updated / elapsed if elapsed else 0:.1f} per second)', file=self.stdout)
+
+        print(f'Finished updating time_charged for {total_updated} configuration statuses in {time.monotonic() - started:.1f} seconds',
+              file=self.stdout)
+
+    @staticmethod
+    def load_base_durations(base_durations, request_ids):
+        request_ids = request_ids - base_durations.keys()
+        if not request_ids:
+            return
+        configurations = Configuration.objects.filter(request__in=request_ids).annotate(
+            num_configurations=Count('request__configurations')
+        ).select_related(
+            'target', 'constraints', 'acquisition_config', 'guiding_config'
+        ).prefetch_related('instrument_configs', 'instrument_configs__rois')
+        for request_id in request_ids:
+            base_durations[request_id] = {}
+        for configuration in configurations:
             try:
-                has_summary = hasattr(configuration_status, 'summary')
-                if has_summary:
-                    time_used = configuration_time_used(configuration_status.summary, configuration_status.observation.request.request_group.observation_type)
-                    configuration_status.time_charged = time_used.total_seconds() / 3600.0
-                    configuration_status.save()
+                base_durations[configuration.request_id][configuration.id] = rapid_response_base_duration(
+                    configuration, configuration.num_configurations
+                )
             except Exception as ex:
-                logger.warning(f"Failed to update time_charged for configuration status {configuration_status.id}: {repr(ex)}")
+                logger.warning(f"Failed to compute the duration of configuration {configuration.id}: {repr(ex)}")
+
+    @staticmethod
+    def time_charged(configuration_status, base_durations):
+        """ The same time as configuration_time_used, with the rapid response base durations looked up """
+        summary = configuration_status.summary
+        configuration_time = summary.end - summary.start
+        if configuration_status.observation.request.request_group.observation_type == RequestGroup.RAPID_RESPONSE:
+            configuration_time = min(
+                configuration_time,
+                base_durations[configuration_status.observation.request_id][configuration_status.configuration_id]
+            )
+        return configuration_time.total_seconds() / 3600.0
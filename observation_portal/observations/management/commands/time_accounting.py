@@ -1,15 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+
 from django.core.management.base import BaseCommand
-from datetime import datetime, timedelta
+from django.db import connection, transaction
+from django.db.models import Case, DurationField, ExpressionWrapper, F, Sum, When
 from observation_portal.common.configdb import configdb
-from observation_portal.observations.models import Observation, Summary
+from observation_portal.observations.models import Summary, TimeAccountingEntry
 from observation_portal.proposals.models import Proposal, Semester, TimeAllocation
-from observation_portal.requestgroups.models import RequestGroup
+from observation_portal.requestgroups.models import Configuration, RequestGroup
 
 import math
 
+OBSERVATION = 'configuration_status__observation'
+REQUEST_GROUP = 'configuration_status__observation__request__request_group'
+
+
+def get_attempted_hours_by_request(semester, proposal_ids):
+    """ Returns a list of (request id, proposal id, observation type, hours) for every request that was attempted in
+        the semester, with the summary durations of all of its observations summed in a single grouped query. The
+        summaries of rapid response observations are clipped to the end of their observation.
+    """
+    observation_end = F(f'{OBSERVATION}__end')
+    duration = Case(
+        When(
+            end__gt=observation_end,
+            then=ExpressionWrapper(observation_end - F('start'), output_field=DurationField()),
+            **{f'{REQUEST_GROUP}__observation_type': RequestGroup.RAPID_RESPONSE}
+        ),
+        default=ExpressionWrapper(F('end') - F('start'), output_field=DurationField()),
+        output_field=DurationField()
+    )
+    totals = Summary.objects.filter(**{
+        f'{OBSERVATION}__end__gt': semester.start,
+        f'{OBSERVATION}__start__lt': semester.end,
+        f'{REQUEST_GROUP}__proposal__in': proposal_ids
+    }).exclude(**{
+        f'{OBSERVATION}__state': 'PENDING'
+    }).exclude(**{
+        f'{REQUEST_GROUP}__observation_type__in': RequestGroup.NON_SCHEDULED_TYPES
+    }).values_list(
+        f'{OBSERVATION}__request', f'{REQUEST_GROUP}__proposal', f'{REQUEST_GROUP}__observation_type'
+    ).annotate(duration=Sum(duration)).order_by()
+    return [
+        (request_id, proposal_id, observation_type, duration.total_seconds() / 3600.0)
+        for request_id, proposal_id, observation_type, duration in totals
+    ]
+
 
 class Command(BaseCommand):
-    help = 'Performs time accounting on a specific proposal and instrument type and semester'
+    help = ('Performs time accounting on a specific proposal and instrument type and semester. The time used is '
+            'recomputed from the summaries in the live tables, so do not run it on semesters with observations that '
+            'were archived with their summaries.')
 
     def add_arguments(self, parser):
         proposals = [p['id'] for p in Proposal.objects.all().values('id')]
@@ -20,15 +61,17 @@ class Command(BaseCommand):
                             help='Instrument type to perform time accounting on. Default empty string for all types.')
         semesters = [s['id'] for s in Semester.objects.all().values('id')]
         current_semester = Semester.current_semesters().first()
-        parser.add_argument('-s', '--semester', type=str, choices=semesters, default=current_semester.id,
-                            help='Semester to perform time accounting on. Defaults to current semester.')
+        parser.add_argument('-s', '--semester', type=str, nargs='+', choices=semesters, default=[current_semester.id],
+                            help='Semester(s) to perform time accounting on. Defaults to current semester.')
+        parser.add_argument('--parallel', type=int, default=1,
+                            help='Number of semesters to perform time accounting on at once. Defaults to 1.')
         parser.add_argument('-d', '--dry-run', dest='dry_run', action='store_true', default=False,
                             help='Dry-run mode will print the time totals but not change anything in the db.')
 
     def handle(self, *args, **options):
         proposal_str = options['proposal'] or 'All'
         instrument_type_str = options['instrument_type'] or 'All'
-        semester_str = options['semester']
+        semester_str = ', '.join(options['semester'])
         dry_run_str = 'Dry Run Mode: ' if options['dry_run'] else ''
         print(
             f"{dry_run_str}Running time accounting for Proposal(s): {proposal_str} and Instrument Type(s): {instrument_type_str} in Semester: {semester_str}",
@@ -36,67 +79,134 @@ class Command(BaseCommand):
         )
 
         if options['proposal']:
-            proposals = [Proposal.objects.get(id=options['proposal'])]
+            proposal_ids = [options['proposal']]
         else:
-            proposals = Proposal.objects.filter(active=True)
+            proposal_ids = list(Proposal.objects.filter(active=True).values_list('id', flat=True))
 
         if options['instrument_type']:
-            instrument_types = [options['instrument_type'].upper()]
+            instrument_types = {options['instrument_type'].upper()}
         else:
-            instrument_types = [it[0].upper() for it in configdb.get_instrument_type_tuples()]
-
-        semester = Semester.objects.get(id=options['semester'])
-        for proposal in proposals:
-            for instrument_type in instrument_types:
-                attempted_time = {
-                    RequestGroup.NORMAL: 0,
-                    RequestGroup.RAPID_RESPONSE: 0,
-                    RequestGroup.TIME_CRITICAL: 0
-                }
-                observations = Observation.objects.filter(end__gt=semester.start, start__lt=semester.end,
-                                                          request__request_group__proposal=proposal.id,
-                                                          request__configurations__instrument_type=instrument_type,
-                                                          ).exclude(state='PENDING'
-                                                          ).exclude(request__request_group__observation_type__in=RequestGroup.NON_SCHEDULED_TYPES
-                                                          ).prefetch_related(
-                    'request',
-                    'request__request_group',
-                    'configuration_statuses',
-                    'configuration_statuses__summary'
-                ).order_by('start').distinct()
-
-                for observation in observations:
-                    observation_type = observation.request.request_group.observation_type
-                    configuration_time = timedelta(seconds=0)
-                    for configuration_status in observation.configuration_statuses.all():
-                        try:
-                            if configuration_status.summary.end > observation.end and observation_type == RequestGroup.RAPID_RESPONSE:
-                                configuration_time += observation.end - configuration_status.summary.start
-                            else:
-                                configuration_time += configuration_status.summary.end - configuration_status.summary.start
-                        except Summary.DoesNotExist:
-                            pass
-
-                    attempted_time[observation_type] += (configuration_time.total_seconds() / 3600.0)
-                print(
-                    "Proposal: {}, Instrument Type: {}, Used {} NORMAL hours, {} RAPID_RESPONSE hours, and {} TIME_CRITICAL hours".format(
-                        proposal.id, instrument_type, attempted_time[RequestGroup.NORMAL], 
-                        attempted_time[RequestGroup.RAPID_RESPONSE],
-                        attempted_time[RequestGroup.TIME_CRITICAL]), file=self.stdout
+            instrument_types = {it[0].upper() for it in configdb.get_instrument_type_tuples()}
+
+        def account_semester(semester_id):
+            return self.account_semester(semester_id, proposal_ids, instrument_types, options['dry_run'])
+
+        def account_semester_in_thread(semester_id):
+            try:
+                return account_semester(semester_id)
+            finally:
+                connection.close()
+
+        if options['parallel'] > 1:
+            with ThreadPoolExecutor(max_workers=options['parallel']) as executor:
+                results = list(executor.map(account_semester_in_thread, options['semester']))
+        else:
+            results = [account_semester(semester_id) for semester_id in options['semester']]
+
+        for output, errors in results:
+            for line in output:
+                print(line, file=self.stdout)
+            for line in errors:
+                print(line, file=self.stderr)
+
+    def account_semester(self, semester_id, proposal_ids, instrument_types, dry_run):
+        """ Computes the time used on each of the TimeAllocations of the semester covering the instrument types, and
+            updates the ones that are different unless this is a dry run. Returns the lines to print to stdout and stderr.
+        """
+        semester = Semester.objects.get(id=semester_id)
+        time_allocations = [
+            time_allocation for time_allocation in TimeAllocation.objects.filter(
+                semester=semester, proposal__in=proposal_ids
+            ).order_by('proposal', 'id')
+            if instrument_types.intersection(it.upper() for it in time_allocation.instrument_types)
+        ]
+        if dry_run:
+            output, errors, _ = self.compute_time_used(semester, time_allocations)
+            return output, errors
+
+        output = []
+        errors = []
+        time_allocation_ids_by_proposal = defaultdict(list)
+        for time_allocation in time_allocations:
+            time_allocation_ids_by_proposal[time_allocation.proposal_id].append(time_allocation.id)
+        for time_allocation_ids in time_allocation_ids_by_proposal.values():
+            # The time used of a proposal is recomputed and written with its TimeAllocations locked, so charges made in
+            # the meantime are either in the summaries that are summed up or added on top of the new time used. The
+            # ledger entries are locked first, in the same order as apply_time_accounting_entries, and the ones not
+            # applied yet are marked as applied since their summaries are counted here.
+            with transaction.atomic():
+                unapplied_entries = TimeAccountingEntry.objects.select_for_update().filter(
+                    time_allocation__in=time_allocation_ids, applied=False
+                )
+                unapplied_entry_ids = list(unapplied_entries.values_list('id', flat=True))
+                locked_time_allocations = list(
+                    TimeAllocation.objects.select_for_update().filter(id__in=time_allocation_ids).order_by('id')
+                )
+                TimeAccountingEntry.objects.filter(id__in=unapplied_entry_ids).update(applied=True)
+                proposal_output, proposal_errors, changed_time_allocations = self.compute_time_used(
+                    semester, locked_time_allocations
                 )
+                TimeAllocation.objects.bulk_update(
+                    changed_time_allocations, ['std_time_used', 'rr_time_used', 'tc_time_used']
+                )
+            output.extend(proposal_output)
+            errors.extend(proposal_errors)
+        return output, errors
+
+    @staticmethod
+    def compute_time_used(semester, time_allocations):
+        """ Computes the time used on each of the TimeAllocations of the semester from the summaries of their proposals.
+            Returns the lines to print to stdout and stderr, and the TimeAllocations whose time used is different, with
+            their new time used set.
+        """
+        output = []
+        errors = []
+        time_allocations_by_proposal = defaultdict(list)
+        for time_allocation in time_allocations:
+            time_allocations_by_proposal[time_allocation.proposal_id].append(time_allocation)
+
+        attempted_hours = get_attempted_hours_by_request(semester, list(time_allocations_by_proposal.keys()))
+        request_instrument_types = defaultdict(set)
+        for request_id, instrument_type in Configuration.objects.filter(
+            request__in={request_id for request_id, *_ in attempted_hours}
+        ).values_list('request', 'instrument_type').distinct():
+            request_instrument_types[request_id].add(instrument_type.upper())
+
+        attempted_time = {
+            time_allocation.id: {
+                RequestGroup.NORMAL: 0,
+                RequestGroup.RAPID_RESPONSE: 0,
+                RequestGroup.TIME_CRITICAL: 0
+            } for time_allocation in time_allocations
+        }
+        for request_id, proposal_id, observation_type, hours in attempted_hours:
+            # A request counts once towards each time allocation that shares any of its instrument types
+            for time_allocation in time_allocations_by_proposal[proposal_id]:
+                if request_instrument_types[request_id].intersection(it.upper() for it in time_allocation.instrument_types):
+                    attempted_time[time_allocation.id][observation_type] += hours
 
-                time_allocation = TimeAllocation.objects.get(proposal=proposal, instrument_types__contains=[instrument_type],
-                                                             semester=semester)
-                if not math.isclose(time_allocation.std_time_used, attempted_time[RequestGroup.NORMAL], abs_tol=0.0001):
-                    print("{} is different from existing NORMAL time {}".format(attempted_time[RequestGroup.NORMAL], time_allocation.std_time_used), file=self.stderr)
-                if not math.isclose(time_allocation.rr_time_used, attempted_time[RequestGroup.RAPID_RESPONSE], abs_tol=0.0001):
-                    print("{} is different from existing RAPID_RESPONSE time {}".format(attempted_time[RequestGroup.RAPID_RESPONSE], time_allocation.rr_time_used), file=self.stderr)
-                if not math.isclose(time_allocation.tc_time_used, attempted_time[RequestGroup.TIME_CRITICAL], abs_tol=0.0001):
-                    print("{} is different from existing TIME_CRITICAL time {}".format(attempted_time[RequestGroup.TIME_CRITICAL], time_allocation.tc_time_used), file=self.stderr)
-
-                if not options['dry_run']:
-                    # Update the time allocation for this proposal accordingly
-                    time_allocation.std_time_used = attempted_time[RequestGroup.NORMAL]
-                    time_allocation.rr_time_used = attempted_time[RequestGroup.RAPID_RESPONSE]
-                    time_allocation.tc_time_used = attempted_time[RequestGroup.TIME_CRITICAL]
-                    time_allocation.save()
+        time_allocations_to_update = []
+        for time_allocation in time_allocations:
+            used = attempted_time[time_allocation.id]
+            output.append(
+                "Proposal: {}, Instrument Type: {}, Used {} NORMAL hours, {} RAPID_RESPONSE hours, and {} TIME_CRITICAL hours".format(
+                    time_allocation.proposal_id, ', '.join(time_allocation.instrument_types), used[RequestGroup.NORMAL],
+                    used[RequestGroup.RAPID_RESPONSE],
+                    used[RequestGroup.TIME_CRITICAL])
+            )
+            changed = False
+            if not math.isclose(time_allocation.std_time_used, used[RequestGroup.NORMAL], abs_tol=0.0001):
+                errors.append("{} is different from existing NORMAL time {}".format(used[RequestGroup.NORMAL], time_allocation.std_time_used))
+                changed = True
+            if not math.isclose(time_allocation.rr_time_used, used[RequestGroup.RAPID_RESPONSE], abs_tol=0.0001):
+                errors.append("{} is different from existing RAPID_RESPONSE time {}".format(used[RequestGroup.RAPID_RESPONSE], time_allocation.rr_time_used))
+                changed = True
+            if not math.isclose(time_allocation.tc_time_used, used[RequestGroup.TIME_CRITICAL], abs_tol=0.0001):
+                errors.append("{} is different from existing TIME_CRITICAL time {}".format(used[RequestGroup.TIME_CRITICAL], time_allocation.tc_time_used))
+                changed = True
+            if changed:
+                time_allocation.std_time_used = used[RequestGroup.NORMAL]
+                time_allocation.rr_time_used = used[RequestGroup.RAPID_RESPONSE]
+                time_allocation.tc_time_used = used[RequestGroup.TIME_CRITICAL]
+                time_allocations_to_update.append(time_allocation)
+        return output, errors, time_allocations_to_update
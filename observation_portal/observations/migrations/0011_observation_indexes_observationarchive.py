@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:34
+
+from django.db import migrations, models
+import django.core.serializers.json
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('observations', '0010_alter_configurationstatus_state_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObservationArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, help_text='First day of the month the observation started in')),
+                ('observation_id', models.PositiveIntegerField(help_text='Id the observation had in the live table', unique=True)),
+                ('request_id', models.PositiveIntegerField(db_index=True, help_text='Id of the Request of the observation')),
+                ('state', models.CharField(help_text='State of the observation when it was archived', max_length=40)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='The observation as a dictionary')),
+                ('archived', models.DateTimeField(auto_now_add=True, help_text='Time when this Observation was archived')),
+            ],
+            options={
+                'ordering': ['-month', '-observation_id'],
+            },
+        ),
+    ]
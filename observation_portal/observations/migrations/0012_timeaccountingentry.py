@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0011_proposalinvite_time_limit'),
+        ('observations', '0011_observation_indexes_observationarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeAccountingEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('configuration_status_id', models.PositiveIntegerField(db_index=True, help_text='Id of the ConfigurationStatus this time was charged for. It is kept after the ConfigurationStatus is deleted')),
+                ('observation_type', models.CharField(help_text='Observation type of the RequestGroup, which selects the *_time_used of the TimeAllocation to charge', max_length=40)),
+                ('entry_type', models.CharField(choices=[('SUMMARY', 'SUMMARY'), ('REFUND', 'REFUND')], help_text='Whether this time was charged for a summary update or refunded', max_length=40)),
+                ('hours', models.FloatField(help_text='Hours charged to the TimeAllocation, negative when time is given back')),
+                ('applied', models.BooleanField(db_index=True, default=False, help_text='Whether these hours have been added to the TimeAllocation')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, help_text='Time when this entry was created')),
+                ('time_allocation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='time_accounting_entries', to='proposals.timeallocation')),
+            ],
+            options={
+                'verbose_name_plural': 'Time accounting entries',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.23 on 2026-10-19 16:12
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The observation table is large and written constantly, so its indexes are built without locking out writes
+    atomic = False
+
+    dependencies = [
+        ('observations', '0012_timeaccountingentry'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='observation',
+            index=models.Index(fields=['site', 'enclosure', 'telescope', 'start'], name='observation_location_start_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='observation',
+            index=models.Index(fields=['end'], name='observation_end_idx'),
+        ),
+    ]
@@ -1,25 +1,31 @@
-from django.db import models
+from django.db import models, transaction
 from django.forms.models import model_to_dict
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from django.core.cache import cache
 from django.utils.module_loading import import_string
 from django.conf import settings
 from datetime import timedelta
 from collections import defaultdict
-import copy
 
 from observation_portal.requestgroups.models import Request, RequestGroup, Configuration, Location
+from observation_portal.common.change_notifications import bump_schedule_versions, notify_change
 import logging
 
 logger = logging.getLogger()
 
 
-def observation_as_dict(instance, no_request=False):
+def observation_as_dict(instance, no_request=False, request_dict=None):
+    """ Serialize an Observation. The dictionary of its Request can be passed in as request_dict when it has already
+        been built, it is never modified so it can be shared between Observations of the same Request.
+    """
     ret_dict = model_to_dict(instance)
     if no_request:
         ret_dict['configuration_statuses'] = [config_status.as_dict() for config_status in instance.configuration_statuses.all()]
     else:
-        ret_dict['request'] = instance.request.as_dict(for_observation=True)
+        if request_dict is None:
+            request_dict = instance.request.as_dict(for_observation=True)
+        ret_dict['request'] = dict(request_dict)
         ret_dict['proposal'] = instance.request.request_group.proposal.id
         ret_dict['submitter'] = instance.request.request_group.submitter.username
         ret_dict['name'] = instance.request.request_group.name
@@ -28,45 +34,63 @@ def observation_as_dict(instance, no_request=False):
         ret_dict['request_group_id'] = instance.request.request_group.id
         ret_dict['created'] = instance.created
         ret_dict['modified'] = instance.modified
-        ret_dict['request']['configurations'] = get_expanded_configurations(instance, ret_dict['request']['configurations'])
+        ret_dict['request']['configurations'] = get_expanded_configurations(instance, request_dict['configurations'])
     return ret_dict
 
 
+def observations_as_dicts(observations, no_request=False):
+    """ Serialize many Observations in one pass, building the dictionary of each Request only once. Falls back on
+        serializing each Observation on its own if the Observation serializer has been overridden.
+    """
+    as_dict = import_string(settings.AS_DICT['observations']['Observation'])
+    if no_request or as_dict is not observation_as_dict:
+        return [as_dict(observation, no_request=no_request) for observation in observations]
+    request_dicts = {}
+    observation_dicts = []
+    for observation in observations:
+        if observation.request_id not in request_dicts:
+            request_dicts[observation.request_id] = observation.request.as_dict(for_observation=True)
+        observation_dicts.append(observation_as_dict(observation, request_dict=request_dicts[observation.request_id]))
+    return observation_dicts
+
+
 def get_expanded_configurations(observation, configurations):
     ''' Gets set of expanded configurations with configuration details filled in for a given observation
     '''
+    config_statuses = list(observation.configuration_statuses.all())
     # If this is a REAL_TIME observation, just return its configuration_status since it doesn't have a configuration
     if observation.request.request_group.observation_type == RequestGroup.REAL_TIME:
-        if observation.configuration_statuses.all().count() > 0:
-            config_status = observation.configuration_statuses.first()
+        if config_statuses:
             return [{
-                'configuration_status': config_status.id,
-                'state': config_status.state
+                'configuration_status': config_statuses[0].id,
+                'state': config_statuses[0].state
             }]
         else:
             return []
     expanded_configurations = []
     configuration_status_by_config = defaultdict(list)
     # First arrange the configuration statuses by Configuration they apply to in the order they apply
-    for config_status in observation.configuration_statuses.all():
-        configuration_status_by_config[config_status.configuration.id].append(config_status)
+    for config_status in config_statuses:
+        configuration_status_by_config[config_status.configuration_id].append(config_status)
     # Loop over configuration_repeats and then over each Configuration in order to add that configuration to
     # the return set with the configuration_status fields added in.
     for repeat_index in range(observation.request.configuration_repeats):
         for configuration in configurations:
-            # First deepcopy the configuration details - these will be modified
-            expanded_configurations.append(copy.deepcopy(configuration))
+            # Shallow copy the configuration details, only the top level fields are modified so the nested
+            # structures are shared between the repeats
+            expanded_configuration = dict(configuration)
             # Fill in some extra fields on the configuration using the configuration status
             config_status = configuration_status_by_config[configuration['id']][repeat_index]
-            expanded_configurations[-1]['configuration_status'] = config_status.id
-            expanded_configurations[-1]['state'] = config_status.state
-            expanded_configurations[-1]['instrument_name'] = config_status.instrument_name
-            expanded_configurations[-1]['guide_camera_name'] = config_status.guide_camera_name
-            expanded_configurations[-1]['priority'] += (repeat_index * len(configurations))
+            expanded_configuration['configuration_status'] = config_status.id
+            expanded_configuration['state'] = config_status.state
+            expanded_configuration['instrument_name'] = config_status.instrument_name
+            expanded_configuration['guide_camera_name'] = config_status.guide_camera_name
+            expanded_configuration['priority'] = configuration['priority'] + (repeat_index * len(configurations))
             if hasattr(config_status, 'summary'):
-                expanded_configurations[-1]['summary'] = config_status.summary.as_dict()
+                expanded_configuration['summary'] = config_status.summary.as_dict()
             else:
-                expanded_configurations[-1]['summary'] = {}
+                expanded_configuration['summary'] = {}
+            expanded_configurations.append(expanded_configuration)
     return expanded_configurations
 
 
@@ -135,21 +159,32 @@ class Observation(models.Model):
         help_text='Current State of this Observation'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', 'enclosure', 'telescope', 'start'], name='observation_location_start_idx'),
+            models.Index(fields=['end'], name='observation_end_idx')
+        ]
+
     @staticmethod
     def cancel(observations):
+        """ Deletes the observations starting more than 72 hours from now, cancels the rest of the future ones and aborts
+            the ones in progress. Each is a single statement over the ids of the given observations, so the queryset is
+            never loaded.
+        """
         now = timezone.now()
-
-        observation_ids_to_delete = [observation.id for observation in observations if
-                                     observation.start >= now + timedelta(hours=72)]
-        _, deleted_observations = Observation.objects.filter(id__in=observation_ids_to_delete).delete()
-
-        observation_ids_to_cancel = [observation.id for observation in observations if
-                                     now < observation.start < now + timedelta(hours=72)]
-        canceled = observations.filter(pk__in=observation_ids_to_cancel).update(state='CANCELED', modified=now)
-
-        observation_ids_to_abort = [observation.id for observation in observations if
-                                    observation.start <= now < observation.end]
-        aborted = observations.filter(pk__in=observation_ids_to_abort).update(state='ABORTED', modified=now)
+        observations = observations.prefetch_related(None).order_by()
+        observation_ids = observations.values('id')
+        bump_schedule_versions(observations.values_list('site', flat=True).distinct())
+
+        _, deleted_observations = Observation.objects.filter(
+            id__in=observation_ids, start__gte=now + timedelta(hours=72)
+        ).delete()
+        canceled = Observation.objects.filter(
+            id__in=observation_ids, start__gt=now, start__lt=now + timedelta(hours=72)
+        ).update(state='CANCELED', modified=now)
+        aborted = Observation.objects.filter(
+            id__in=observation_ids, start__lte=now, end__gt=now
+        ).update(state='ABORTED', modified=now)
 
         return deleted_observations.get('observations.Observation', 0) + canceled + aborted
 
@@ -159,6 +194,7 @@ class Observation(models.Model):
             old_end_time = self.end
             self.end = new_end_time
             self.save()
+            bump_schedule_versions([self.site])
             # Cancel observations that used to be under this observation
             if new_end_time > old_end_time:
                 observations = Observation.objects.filter(
@@ -181,35 +217,60 @@ class Observation(models.Model):
             try:
                 telescope_class = self.request.location.telescope_class
                 cache.set(f"observation_portal_last_change_time_{telescope_class}", timezone.now(), None)
+                notify_change(f"observation_portal_last_change_time_{telescope_class}")
             except Location.DoesNotExist:
                 pass
             cache.set('observation_portal_last_change_time_all', timezone.now(), None)
+            notify_change('observation_portal_last_change_time_all')
         return self
 
     @staticmethod
     def delete_old_observations(cutoff):
-        observations = Observation.objects.filter(start__lt=cutoff, end__lt=cutoff, state='CANCELED').exclude(
+        """ Deletes CANCELED observations from before the cutoff that never started, in batches of ids. Each batch
+            deletes its Summaries, ConfigurationStatuses and Observations with one statement each in a short transaction.
+        """
+        observation_ids = Observation.objects.filter(start__lt=cutoff, end__lt=cutoff, state='CANCELED').exclude(
             configuration_statuses__state__in=['ATTEMPTED', 'FAILED', 'COMPLETED']
-        )
-        logger.warning('There are {} observations to be deleted. Only the first 100,000 will be deleted this run'.format(observations.count()))
-        total_deleted = 0
+        ).values_list('id', flat=True)
+        batch_size = settings.DELETE_OLD_OBSERVATIONS_BATCH_SIZE
         total_obs_deleted = 0
         total_cs_deleted = 0
         total_sm_deleted = 0
-        for observation in observations[:100000]:
-            num_deleted, deleted_dict = observation.delete()
-            total_deleted += num_deleted
-            total_obs_deleted += deleted_dict.get('observations.Observation', 0)
-            total_cs_deleted += deleted_dict.get('observations.ConfigurationStatus', 0)
-            total_sm_deleted += deleted_dict.get('observations.Summary', 0)
+        while total_obs_deleted < settings.DELETE_OLD_OBSERVATIONS_MAX_PER_RUN:
+            batch_ids = list(observation_ids[:batch_size])
+            if not batch_ids:
+                break
+            with transaction.atomic():
+                obs_deleted, cs_deleted, sm_deleted = Observation.delete_by_ids(batch_ids)
+            total_obs_deleted += obs_deleted
+            total_cs_deleted += cs_deleted
+            total_sm_deleted += sm_deleted
+            logger.info(f'Deleted {total_obs_deleted} old observations so far')
 
         logger.warning('Deleted {} objects: {} observations, {} configuration_statuses, and {} summaries'.format(
-            total_deleted, total_obs_deleted, total_cs_deleted, total_sm_deleted
+            total_obs_deleted + total_cs_deleted + total_sm_deleted, total_obs_deleted, total_cs_deleted, total_sm_deleted
         ))
 
+    @staticmethod
+    def delete_by_ids(observation_ids):
+        """ Deletes the Observations with the given ids along with their ConfigurationStatuses and Summaries. The ids
+            come in bounded batches, so the rows collected for the cascade stay small. Returns the number of each that
+            were deleted.
+        """
+        _, deleted = Observation.objects.filter(id__in=observation_ids).delete()
+        return (
+            deleted.get('observations.Observation', 0),
+            deleted.get('observations.ConfigurationStatus', 0),
+            deleted.get('observations.Summary', 0)
+        )
+
     def as_dict(self, no_request=False):
         return import_string(settings.AS_DICT['observations']['Observation'])(self, no_request=no_request)
 
+    @staticmethod
+    def as_dicts(observations, no_request=False):
+        return observations_as_dicts(observations, no_request=no_request)
+
     # Returns the current configuration repeat we are within the request for this configuration status
     def get_current_repeat(self, configuration_status_id):
         num_configurations = self.request.configurations.count()
@@ -326,3 +387,81 @@ class Summary(models.Model):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         self.configuration_status.save()
+
+
+class TimeAccountingEntry(models.Model):
+    """ Append-only ledger of the time charged to TimeAllocations. Each debit or refund of a configuration status adds
+        an entry, and the entries are summed into the *_time_used of their TimeAllocation by
+        apply_time_accounting_entries, so concurrent charges to a proposal don't wait on its TimeAllocation row.
+    """
+    SUMMARY = 'SUMMARY'
+    REFUND = 'REFUND'
+    ENTRY_TYPES = (
+        (SUMMARY, SUMMARY),
+        (REFUND, REFUND)
+    )
+
+    time_allocation = models.ForeignKey(
+        'proposals.TimeAllocation', related_name='time_accounting_entries', on_delete=models.CASCADE
+    )
+    configuration_status_id = models.PositiveIntegerField(
+        db_index=True,
+        help_text='Id of the ConfigurationStatus this time was charged for. It is kept after the ConfigurationStatus is deleted'
+    )
+    observation_type = models.CharField(
+        max_length=40,
+        help_text='Observation type of the RequestGroup, which selects the *_time_used of the TimeAllocation to charge'
+    )
+    entry_type = models.CharField(
+        max_length=40, choices=ENTRY_TYPES,
+        help_text='Whether this time was charged for a summary update or refunded'
+    )
+    hours = models.FloatField(
+        help_text='Hours charged to the TimeAllocation, negative when time is given back'
+    )
+    applied = models.BooleanField(
+        default=False, db_index=True,
+        help_text='Whether these hours have been added to the TimeAllocation'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True, db_index=True,
+        help_text='Time when this entry was created'
+    )
+
+    class Meta:
+        verbose_name_plural = 'Time accounting entries'
+        ordering = ['-id']
+
+
+class ObservationArchive(models.Model):
+    """ Observations moved out of the live tables by the archive_observations command. Each is kept as its serialized
+        dictionary, including its configuration statuses and summaries, and rows are grouped by the month the
+        observation started in. PostgreSQL compresses the JSON data of these rows.
+    """
+    month = models.DateField(
+        db_index=True,
+        help_text='First day of the month the observation started in'
+    )
+    observation_id = models.PositiveIntegerField(
+        unique=True,
+        help_text='Id the observation had in the live table'
+    )
+    request_id = models.PositiveIntegerField(
+        db_index=True,
+        help_text='Id of the Request of the observation'
+    )
+    state = models.CharField(
+        max_length=40,
+        help_text='State of the observation when it was archived'
+    )
+    data = models.JSONField(
+        encoder=DjangoJSONEncoder,
+        help_text='The observation as a dictionary'
+    )
+    archived = models.DateTimeField(
+        auto_now_add=True,
+        help_text='Time when this Observation was archived'
+    )
+
+    class Meta:
+        ordering = ['-month', '-observation_id']
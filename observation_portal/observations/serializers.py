@@ -1,3 +1,4 @@
+from collections import Counter
 from datetime import datetime, timedelta
 
 from rest_framework import serializers
@@ -11,8 +12,11 @@ from django.contrib.auth.models import User
 from observation_portal.common.configdb import configdb
 from observation_portal.common.rise_set_utils import is_realtime_interval_available_for_telescope
 from observation_portal.common.state_changes import set_observation_state_to_bad_data
+from observation_portal.common.change_notifications import bump_schedule_versions
 from observation_portal.observations.models import Observation, ConfigurationStatus, Summary
 from observation_portal.observations.realtime import realtime_time_available
+from observation_portal.observations.tasks import propagate_observation_states
+from observation_portal.observations.time_accounting import on_summaries_update_time_accounting
 from observation_portal.requestgroups.models import RequestGroup, Request, AcquisitionConfig, GuidingConfig, Target
 from observation_portal.requestgroups.serializers import ConfigurationTypeValidationHelper
 from observation_portal.proposals.models import Proposal
@@ -89,7 +93,7 @@ class ConfigurationStatusSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         data = super().validate(data)
-        if self.context.get('request').method == 'PATCH':
+        if self.partial or self.context.get('request').method == 'PATCH':
             # For a partial update, only validate the end time if its set
             if 'end' in data and data['end'] <= timezone.now():
                 raise serializers.ValidationError(_('Updated end time must be in the future'))
@@ -106,16 +110,25 @@ class ConfigurationStatusSerializer(serializers.ModelSerializer):
             )))
         return data
 
+    @staticmethod
+    def updates_state(instance, validated_data):
+        """ Whether an update sets the state of a configuration status. The state of a configuration status in a terminal
+            state can only be set to BAD_DATA. A state that is set is propagated to the observation even if it did not
+            change, while an update without a state, like one to only the summary, is not propagated.
+        """
+        if 'state' not in validated_data:
+            return False
+        return instance.state not in ConfigurationStatusSerializer.TERMINAL_STATES or validated_data['state'] == 'BAD_DATA'
+
     def update(self, instance, validated_data):
         update_fields = ['state']
-        if instance.state not in ConfigurationStatusSerializer.TERMINAL_STATES:
-            instance.state = validated_data.get('state', instance.state)
-            instance.save(update_fields=update_fields)
-        elif validated_data.get('state', '') == 'BAD_DATA':
-            # If we set the config status state to BAD_DATA, mark the observation that way (which attempts to reset the Request to PENDING)
+        if self.updates_state(instance, validated_data):
+            bad_data_in_terminal_state = instance.state in ConfigurationStatusSerializer.TERMINAL_STATES
             instance.state = validated_data['state']
             instance.save(update_fields=update_fields)
-            set_observation_state_to_bad_data(instance.observation, set_configuration_statuses=False)
+            if bad_data_in_terminal_state:
+                # If we set the config status state to BAD_DATA, mark the observation that way (which attempts to reset the Request to PENDING)
+                set_observation_state_to_bad_data(instance.observation, set_configuration_statuses=False)
 
         if 'summary' in validated_data:
             summary_serializer = import_string(settings.SERIALIZERS['observations']['Summary'])(data=validated_data['summary'])
@@ -132,6 +145,18 @@ class ConfigurationStatusSerializer(serializers.ModelSerializer):
                               }
                 )
 
+        bump_schedule_versions([instance.observation.site])
+        self.update_observation_end_time(instance, validated_data)
+
+        return instance
+
+    @staticmethod
+    def update_observation_end_time(instance, validated_data):
+        """ Move the end of the observation to fit the rest of its configurations after a new end time or exposure start
+            time for this configuration """
+        if 'end' not in validated_data and 'exposures_start_at' not in validated_data:
+            return
+
         current_repeat = instance.observation.get_current_repeat(instance.id)
 
         if 'end' in validated_data:
@@ -144,7 +169,110 @@ class ConfigurationStatusSerializer(serializers.ModelSerializer):
             obs_end_time += timedelta(seconds=instance.observation.request.get_remaining_duration(instance.configuration.priority, include_current=True, current_repeat=current_repeat))
             instance.observation.update_end_time(obs_end_time)
 
-        return instance
+
+class ConfigurationStatusBulkUpdateListSerializer(serializers.ListSerializer):
+    """ Applies updates to many configuration statuses and their summaries in one transaction. The rows are loaded
+        together when the updates are validated and saved with bulk updates that skip the save signals, the time
+        accounting for the summaries is summed up per TimeAllocation and the new states are propagated once per affected
+        Observation.
+    """
+    def run_child_validation(self, data):
+        # Each update is validated on its own here, and against its configuration status in validate()
+        self.child.instance = None
+        return super().run_child_validation(data)
+
+    def validate(self, attrs):
+        id_counts = Counter(update['id'] for update in attrs)
+        duplicate_ids = sorted(id for id, count in id_counts.items() if count > 1)
+        if duplicate_ids:
+            raise serializers.ValidationError({'id': _(f'Configuration statuses {duplicate_ids} are updated more than once')})
+        instances = self.instance if self.instance is not None else ConfigurationStatus.objects.all()
+        self.configuration_statuses = instances.filter(id__in=id_counts.keys()).select_related(
+            'summary', 'configuration', 'observation__request__request_group'
+        ).in_bulk()
+        missing_ids = sorted(set(id_counts.keys()) - set(self.configuration_statuses.keys()))
+        if missing_ids:
+            raise serializers.ValidationError({'id': _(f'Configuration statuses {missing_ids} do not exist')})
+        for update in attrs:
+            if 'exposures_start_at' in update and update['exposures_start_at'] < self.configuration_statuses[update['id']].observation.start:
+                raise serializers.ValidationError({update['id']: _('Updated exposure start time must be after the observation start time')})
+            if 'summary' in update:
+                # Summaries are always replaced as a whole, so they are validated in full even in a partial update
+                summary_serializer = import_string(settings.SERIALIZERS['observations']['Summary'])(data=update['summary'])
+                if not summary_serializer.is_valid():
+                    raise serializers.ValidationError({update['id']: summary_serializer.errors})
+        return attrs
+
+    def update(self, instances, validated_data):
+        # The configuration statuses were loaded from the instances when the updates were validated
+        updates_by_id = {update['id']: update for update in validated_data}
+        configuration_statuses = self.configuration_statuses
+
+        now = timezone.now()
+        changed_configuration_statuses = {}
+        state_updated_configuration_statuses = []
+        bad_data_configuration_statuses = []
+        summary_changes = []
+        with transaction.atomic():
+            for configuration_status_id, update in updates_by_id.items():
+                configuration_status = configuration_statuses[configuration_status_id]
+                if ConfigurationStatusSerializer.updates_state(configuration_status, update):
+                    if configuration_status.state in ConfigurationStatusSerializer.TERMINAL_STATES:
+                        bad_data_configuration_statuses.append(configuration_status)
+                    configuration_status.state = update['state']
+                    changed_configuration_statuses[configuration_status_id] = configuration_status
+                    state_updated_configuration_statuses.append(configuration_status)
+
+                if 'summary' in update:
+                    summary_data = update['summary']
+                    current_summary = getattr(configuration_status, 'summary', None)
+                    summary = Summary(id=current_summary.id if current_summary else None, configuration_status=configuration_status)
+                    if current_summary:
+                        summary.created = current_summary.created
+                    summary.reason = summary_data.get('reason', '')
+                    summary.start = summary_data.get('start')
+                    summary.end = summary_data.get('end')
+                    summary.state = summary_data.get('state')
+                    summary.time_completed = summary_data.get('time_completed')
+                    summary.events = summary_data.get('events', {})
+                    summary.modified = now
+                    summary_changes.append((current_summary, summary))
+                    changed_configuration_statuses[configuration_status_id] = configuration_status
+
+            new_summaries = [summary for current, summary in summary_changes if current is None]
+            updated_summaries = [summary for current, summary in summary_changes if current is not None]
+            Summary.objects.bulk_create(new_summaries)
+            Summary.objects.bulk_update(
+                updated_summaries, ['reason', 'start', 'end', 'state', 'time_completed', 'events', 'modified']
+            )
+            on_summaries_update_time_accounting(summary_changes)
+            for configuration_status in changed_configuration_statuses.values():
+                configuration_status.modified = now
+            ConfigurationStatus.objects.bulk_update(
+                changed_configuration_statuses.values(), ['state', 'time_charged', 'modified']
+            )
+            bump_schedule_versions(
+                configuration_status.observation.site for configuration_status in changed_configuration_statuses.values()
+            )
+            for configuration_status in bad_data_configuration_statuses:
+                # Mark the observation as BAD_DATA, which attempts to reset the Request to PENDING
+                set_observation_state_to_bad_data(configuration_status.observation, set_configuration_statuses=False)
+            for configuration_status_id, update in updates_by_id.items():
+                ConfigurationStatusSerializer.update_observation_end_time(configuration_statuses[configuration_status_id], update)
+
+        # The BAD_DATA state transition is handled above, like in the post_save handler of a single update
+        propagate_observation_states({
+            configuration_status.observation_id: configuration_status.observation
+            for configuration_status in state_updated_configuration_statuses if configuration_status.state != 'BAD_DATA'
+        }.values())
+        return list(configuration_statuses.values())
+
+
+class ConfigurationStatusBulkUpdateSerializer(ConfigurationStatusSerializer):
+    id = serializers.IntegerField()
+
+    class Meta(ConfigurationStatusSerializer.Meta):
+        list_serializer_class = ConfigurationStatusBulkUpdateListSerializer
 
 
 class ObservationTargetSerializer(serializers.ModelSerializer):
@@ -482,13 +610,72 @@ class RealTimeSerializer(serializers.ModelSerializer):
         return data
 
 
+class PreloadedRequestField(serializers.PrimaryKeyRelatedField):
+    """ Uses the Requests preloaded for a bulk submission, falling back to looking the Request up in the database """
+    def to_internal_value(self, data):
+        preloaded_requests = self.context.get('preloaded_requests', {})
+        if not isinstance(data, bool):
+            try:
+                return preloaded_requests[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class ObservationListSerializer(serializers.ListSerializer):
+    """ Validates each observation of a bulk submission once, against Requests that are loaded up front, and keeps the
+        errors of the invalid observations by index instead of rejecting the whole list. The valid observations and their
+        configuration statuses are then inserted with a bulk_create each.
+    """
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            return super().to_internal_value(data)
+        request_ids = set()
+        for item in data:
+            try:
+                request_ids.add(int(item['request']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        self.context['preloaded_requests'] = Request.objects.filter(id__in=request_ids).select_related(
+            'location', 'request_group__proposal'
+        ).prefetch_related('windows', 'configurations').in_bulk()
+        user = self.context['request'].user
+        if not user.is_staff:
+            self.context['direct_submission_proposals'] = set(user.proposal_set.filter(direct_submission=True))
+
+        self.item_errors = {}
+        validated_data = []
+        for i, item in enumerate(data):
+            try:
+                validated_data.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                self.item_errors[i] = exc.detail
+        return validated_data
+
+    def create(self, validated_data):
+        observations = []
+        configuration_statuses = []
+        for observation_data in validated_data:
+            configuration_statuses_data = observation_data.pop('configuration_statuses')
+            observation = Observation(**observation_data)
+            observations.append(observation)
+            for configuration_status in configuration_statuses_data:
+                configuration_statuses.append(ConfigurationStatus(observation=observation, **configuration_status))
+        with transaction.atomic():
+            Observation.objects.bulk_create(observations)
+            ConfigurationStatus.objects.bulk_create(configuration_statuses)
+        return observations
+
+
 class ObservationSerializer(serializers.ModelSerializer):
     configuration_statuses = import_string(settings.SERIALIZERS['observations']['ConfigurationStatus'])(many=True)
+    request = PreloadedRequestField(queryset=Request.objects.all())
 
     class Meta:
         model = Observation
         fields = ('site', 'enclosure', 'telescope', 'start', 'end', 'priority', 'configuration_statuses', 'request', 'state', 'modified', 'created')
         read_only_fields = ('modified', 'created')
+        list_serializer_class = ObservationListSerializer
 
     def validate(self, data):
         user = self.context['request'].user
@@ -499,7 +686,10 @@ class ObservationSerializer(serializers.ModelSerializer):
             proposal = data['request'].request_group.proposal
 
         # If the user is not staff, check that they are allowed to perform the action
-        if not user.is_staff and proposal not in user.proposal_set.filter(direct_submission=True):
+        direct_submission_proposals = self.context.get('direct_submission_proposals')
+        if direct_submission_proposals is None and not user.is_staff:
+            direct_submission_proposals = user.proposal_set.filter(direct_submission=True)
+        if not user.is_staff and proposal not in direct_submission_proposals:
             raise serializers.ValidationError(_(
                 'Non staff users can only create or update observations on proposals they belong to that '
                 'allow direct submission'
@@ -547,9 +737,13 @@ class ObservationSerializer(serializers.ModelSerializer):
             )))
 
         # Validate that the site, enclosure, telescope has the appropriate instrument
-        available_instruments = configdb.get_instruments_at_location(
-            data['site'], data['enclosure'], data['telescope'], only_schedulable=False
-        )
+        available_instruments_by_location = self.context.setdefault('available_instruments_by_location', {})
+        location = (data['site'], data['enclosure'], data['telescope'])
+        if location not in available_instruments_by_location:
+            available_instruments_by_location[location] = configdb.get_instruments_at_location(
+                *location, only_schedulable=False
+            )
+        available_instruments = available_instruments_by_location[location]
         for configuration in data['request'].configurations.all():
             if configuration.instrument_type.upper() not in available_instruments['types']:
                 raise serializers.ValidationError(_('Instrument type {} not available at {}.{}.{}'.format(
@@ -1,8 +1,10 @@
+from django.conf import settings
 from django.dispatch import receiver
 from django.db.models.signals import post_save, pre_save
 
 from observation_portal.observations.models import ConfigurationStatus, Summary
 from observation_portal.observations.time_accounting import on_summary_update_time_accounting
+from observation_portal.observations.tasks import queue_state_propagation
 from observation_portal.common.state_changes import on_configuration_status_state_change
 
 
@@ -12,7 +14,10 @@ def cb_configurationstatus_post_save(sender, instance, created, *args, **kwargs)
     if not created:
         # The BAD_DATA state transition is handled separately, in the serializer for the Observation
         if instance.state != 'BAD_DATA':
-            on_configuration_status_state_change(instance)
+            if settings.STATE_PROPAGATION_DELAY:
+                queue_state_propagation(instance.observation_id)
+            else:
+                on_configuration_status_state_change(instance)
 
 
 @receiver(pre_save, sender=Summary)
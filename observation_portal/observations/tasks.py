@@ -1,15 +1,80 @@
 import dramatiq
 import logging
 from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
 from django.utils import timezone
 
-from observation_portal.observations.models import Observation
+from observation_portal.observations.models import Observation, ConfigurationStatus
+from observation_portal.observations.time_accounting import apply_time_accounting_entries
+from observation_portal.common.state_changes import on_observation_configuration_statuses_change
 
 logger = logging.getLogger(__name__)
 
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
 
 @dramatiq.actor(time_limit=1800000)
 def delete_old_observations():
     cutoff = timezone.now() - timedelta(days=14)
     logger.info(f'Deleting CANCELED observations before cutoff date {cutoff}')
     Observation.delete_old_observations(cutoff)
+
+
+@dramatiq.actor()
+def apply_time_accounting():
+    num_applied = apply_time_accounting_entries()
+    if num_applied:
+        logger.info(f'Applied {num_applied} time accounting entries to their TimeAllocations')
+
+
+def check_state_propagation_cache():
+    """ The pending propagation flags are shared by the web and worker processes, so delayed propagation needs a cache
+        that all of them use """
+    if settings.STATE_PROPAGATION_DELAY and settings.CACHES['default']['BACKEND'] in LOCAL_CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            'STATE_PROPAGATION_DELAY requires a default cache shared by the web and worker processes'
+        )
+
+
+def queue_state_propagation(observation_id):
+    """ Propagate the configuration status states of an observation to it, its request and its request group after
+        STATE_PROPAGATION_DELAY seconds. Any further updates to the observation within that time are covered by the
+        same propagation. Nothing is flagged or sent until the update is committed, so a rolled back update never
+        blocks the propagation of the next one.
+    """
+    def send_state_propagation():
+        if cache.add(f'state_propagation_pending_{observation_id}', True, settings.STATE_PROPAGATION_DELAY * 10):
+            propagate_observation_state.send_with_options(
+                args=(observation_id,), delay=int(settings.STATE_PROPAGATION_DELAY * 1000)
+            )
+
+    transaction.on_commit(send_state_propagation)
+
+
+def propagate_observation_states(observations):
+    """ Propagate the configuration status states of each observation, the same way the post_save handler of a
+        ConfigurationStatus does """
+    for observation in observations:
+        if settings.STATE_PROPAGATION_DELAY:
+            queue_state_propagation(observation.id)
+        else:
+            on_observation_configuration_statuses_change(observation)
+
+
+@dramatiq.actor()
+def propagate_observation_state(observation_id):
+    # Clear the pending flag first so updates made while this runs queue another propagation
+    cache.delete(f'state_propagation_pending_{observation_id}')
+    started = timezone.now()
+    try:
+        observation = Observation.objects.select_related('request__request_group').get(pk=observation_id)
+    except Observation.DoesNotExist:
+        logger.info(f'Observation {observation_id} no longer exists, not propagating its state')
+        return
+    on_observation_configuration_statuses_change(observation)
+    # Updates that were committed while this ran may not have been seen, so propagate again if there are any
+    if ConfigurationStatus.objects.filter(observation_id=observation_id, modified__gt=started).exists():
+        queue_state_propagation(observation_id)
@@ -1,9 +1,9 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from io import StringIO
 
 from django.test import override_settings
 from time_intervals.intervals import Intervals
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APIRequestFactory
 from django.utils import timezone
 from mixer.backend.django import mixer
 from dateutil.parser import parse
@@ -14,17 +14,22 @@ from rest_framework.authtoken.models import Token
 
 from observation_portal.common.test_helpers import SetTimeMixin
 from observation_portal.requestgroups.models import RequestGroup, Window, Location, Request
-from observation_portal.observations.time_accounting import configuration_time_used, refund_configuration_status_time, refund_observation_time
-from observation_portal.observations.models import Observation, ConfigurationStatus, Summary
+from observation_portal.observations.time_accounting import (
+    configuration_time_used, refund_configuration_status_time, refund_observation_time, apply_time_accounting_entries,
+    rapid_response_base_duration
+)
+from observation_portal.observations.models import Observation, ConfigurationStatus, Summary, ObservationArchive, TimeAccountingEntry
+from observation_portal.observations.filters import ObservationFilter
 from observation_portal.proposals.models import Proposal, Membership, Semester, TimeAllocation
 from observation_portal.common.test_helpers import create_simple_requestgroup, create_simple_configuration
 from observation_portal.accounts.test_utils import blend_user
-from observation_portal.observations import views
+from observation_portal.common import change_notifications
 from observation_portal.observations import viewsets
 import observation_portal.observations.signals.handlers  # noqa
 
 from unittest.mock import patch
 import copy
+import re
 
 realtime = {
     "proposal": "auto_focus",
@@ -355,6 +360,20 @@ class TestPostScheduleApi(SetTimeMixin, APITestCase):
         with self.assertRaises(Observation.DoesNotExist):
             observation = Observation.objects.get(pk=obj_json['id'])
 
+    @override_settings(DELETE_OLD_OBSERVATIONS_BATCH_SIZE=1)
+    def test_delete_old_observations_in_batches(self):
+        observation_ids = []
+        for _ in range(3):
+            response = self.client.post(reverse('api:schedule-list'), data=self.observation)
+            self.assertEqual(response.status_code, 201)
+            observation_ids.append(response.json()['id'])
+        Observation.objects.filter(id__in=observation_ids).update(state='CANCELED')
+        mixer.blend(Summary, configuration_status=ConfigurationStatus.objects.filter(observation_id=observation_ids[0]).first())
+        Observation.delete_old_observations(datetime(2099, 1, 1, tzinfo=timezone.utc))
+        self.assertFalse(Observation.objects.filter(id__in=observation_ids).exists())
+        self.assertFalse(ConfigurationStatus.objects.filter(observation_id__in=observation_ids).exists())
+        self.assertEqual(Summary.objects.count(), 0)
+
     def test_cant_delete_observation_with_started_configuration_statuses(self):
         response = self.client.post(reverse('api:schedule-list'), data=self.observation)
         self.assertEqual(response.status_code, 201)
@@ -1130,6 +1149,25 @@ class TestPostObservationApi(TestObservationApiBase):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(len(Observation.objects.all()), 2)
 
+    def test_multiple_observations_with_some_invalid_creates_the_valid_ones(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        bad_observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id],
+            start="2016-09-05T23:35:40Z", end="2016-09-05T22:35:39Z"
+        )
+        observations = [observation, bad_observation, observation]
+        response = self.client.post(reverse('api:observations-list'), data=observations)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['num_created'], 2)
+        self.assertEqual(list(response.json()['errors'].keys()), ['1'])
+        self.assertIn('End time must be after start time', str(response.json()['errors']['1']))
+        self.assertEqual(len(Observation.objects.all()), 2)
+        self.assertEqual(len(ConfigurationStatus.objects.all()), 2)
+        for observation in Observation.objects.all():
+            self.assertEqual(observation.configuration_statuses.count(), 1)
+
     def test_multiple_configurations_within_an_observation_succeeds(self):
         create_simple_configuration(self.requestgroup.requests.first())
         create_simple_configuration(self.requestgroup.requests.first())
@@ -1186,6 +1224,27 @@ class TestPostObservationApi(TestObservationApiBase):
         observation_obj = Observation.objects.first()
         self.assertEqual(observation_obj.state, 'ABORTED')
 
+    def test_cancel_deletes_cancels_and_aborts_observations_in_one_call(self):
+        self.window.start = datetime(2016, 8, 28, tzinfo=timezone.utc)
+        self.window.save()
+        distant = self._generate_observation_data(self.requestgroup.requests.first().id,
+                                                  [self.requestgroup.requests.first().configurations.first().id])
+        close = copy.deepcopy(distant)
+        close['start'] = "2016-09-02T22:35:39Z"
+        close['end'] = "2016-09-02T23:35:39Z"
+        current = copy.deepcopy(distant)
+        current['start'] = "2016-08-31T23:35:39Z"
+        current['end'] = "2016-09-01T01:35:39Z"
+        self._create_observation([distant, close, current])
+        cancel_dict = {'ids': [observation.id for observation in Observation.objects.all()]}
+        response = self.client.post(reverse('api:observations-cancel'), data=cancel_dict)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['canceled'], 3)
+        self.assertEqual(
+            sorted(Observation.objects.values_list('state', flat=True)), ['ABORTED', 'CANCELED']
+        )
+        self.assertEqual(len(ConfigurationStatus.objects.all()), 2)
+
     def test_cancel_current_in_progress_observation_fails(self):
         self.window.start = datetime(2016, 8, 28, tzinfo=timezone.utc)
         self.window.save()
@@ -1719,6 +1778,85 @@ class TestUpdateConfigurationStatusApi(TestObservationApiBase):
         self.assertEqual(configuration_status.summary.state, 'ABORTED')
         self.assertEqual(len(Summary.objects.all()), 1)
 
+    def test_bulk_update_configuration_statuses_and_summaries(self):
+        create_simple_configuration(self.requestgroup.requests.first())
+        configuration_ids = [config.id for config in self.requestgroup.requests.first().configurations.all()]
+        observation = self._generate_observation_data(self.requestgroup.requests.first().id, configuration_ids)
+        self._create_observation(observation)
+        configuration_statuses = list(ConfigurationStatus.objects.all())
+        update_data = [
+            {'id': configuration_statuses[0].id, 'state': 'COMPLETED', 'summary': self.summary},
+            {'id': configuration_statuses[1].id, 'state': 'FAILED'}
+        ]
+        response = self.client.post(reverse('api:configurationstatus-bulk-update'), data=update_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        configuration_statuses[0].refresh_from_db()
+        configuration_statuses[1].refresh_from_db()
+        self.assertEqual(configuration_statuses[0].state, 'COMPLETED')
+        self.assertEqual(configuration_statuses[0].summary.time_completed, self.summary['time_completed'])
+        self.assertEqual(configuration_statuses[0].summary.events, self.summary['events'])
+        self.assertEqual(configuration_statuses[1].state, 'FAILED')
+        self.assertEqual(Observation.objects.first().state, 'FAILED')
+
+    def test_bulk_update_with_unknown_configuration_status_fails(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        self._create_observation(observation)
+        configuration_status = ConfigurationStatus.objects.first()
+        update_data = [
+            {'id': configuration_status.id, 'state': 'ATTEMPTED'},
+            {'id': configuration_status.id + 1000, 'state': 'ATTEMPTED'}
+        ]
+        response = self.client.post(reverse('api:configurationstatus-bulk-update'), data=update_data)
+        self.assertEqual(response.status_code, 400)
+        configuration_status.refresh_from_db()
+        self.assertEqual(configuration_status.state, 'PENDING')
+
+    def test_bulk_update_with_duplicate_configuration_status_ids_fails(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        self._create_observation(observation)
+        configuration_status = ConfigurationStatus.objects.first()
+        update_data = [
+            {'id': configuration_status.id, 'state': 'ATTEMPTED'},
+            {'id': configuration_status.id, 'state': 'FAILED'}
+        ]
+        response = self.client.post(reverse('api:configurationstatus-bulk-update'), data=update_data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('more than once', str(response.json()['id']))
+        configuration_status.refresh_from_db()
+        self.assertEqual(configuration_status.state, 'PENDING')
+
+    def test_bulk_update_with_unchanged_state_propagates_it_to_the_observation(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        self._create_observation(observation)
+        # The state was set without being propagated, so sending it again has to propagate it like a single update
+        ConfigurationStatus.objects.update(state='ATTEMPTED')
+        configuration_status = ConfigurationStatus.objects.first()
+        update_data = [{'id': configuration_status.id, 'state': 'ATTEMPTED'}]
+        response = self.client.post(reverse('api:configurationstatus-bulk-update'), data=update_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Observation.objects.first().state, 'IN_PROGRESS')
+
+    def test_bulk_update_of_summary_only_does_not_propagate_state(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        self._create_observation(observation)
+        ConfigurationStatus.objects.update(state='ATTEMPTED')
+        configuration_status = ConfigurationStatus.objects.first()
+        update_data = [{'id': configuration_status.id, 'summary': self.summary}]
+        response = self.client.post(reverse('api:configurationstatus-bulk-update'), data=update_data)
+        self.assertEqual(response.status_code, 200)
+        configuration_status.refresh_from_db()
+        self.assertEqual(configuration_status.summary.state, self.summary['state'])
+        self.assertEqual(Observation.objects.first().state, 'PENDING')
+
     def test_update_incomplete_summary_fails(self):
         observation = self._generate_observation_data(
             self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
@@ -2407,7 +2545,7 @@ class TestLastScheduled(TestObservationApiBase):
         # Mock the cache with a real one for these tests
         self.locmem_cache = caches.create_connection('testlocmem')
         self.locmem_cache.clear()
-        self.patch1 = patch.object(views, 'cache', self.locmem_cache)
+        self.patch1 = patch.object(change_notifications, 'cache', self.locmem_cache)
         self.patch1.start()
         self.patch2 = patch.object(viewsets, 'cache', self.locmem_cache)
         self.patch2.start()
@@ -2426,6 +2564,15 @@ class TestLastScheduled(TestObservationApiBase):
         self.assertAlmostEqual(parse(last_schedule), timezone.now() - timedelta(days=7),
                                delta=timedelta(minutes=1))
 
+    def test_last_schedule_date_without_cached_value_does_not_move_between_calls(self):
+        first_response = self.client.get(reverse('api:last_scheduled'), {'site': 'tst'})
+        since = first_response.json()['last_schedule_time']
+        with patch('observation_portal.common.change_notifications.ChangeSubscription.wait') as mock_wait:
+            mock_wait.return_value = False
+            second_response = self.client.get(reverse('api:last_scheduled'), {'site': 'tst', 'since': since, 'wait': 10})
+            mock_wait.assert_called_once_with(10)
+        self.assertEqual(second_response.json()['last_schedule_time'], since)
+
     def test_last_schedule_date_is_updated_when_single_observation_is_submitted(self):
         last_schedule_cached = self.locmem_cache.get('observation_portal_last_schedule_time_tst')
         self.assertIsNone(last_schedule_cached)
@@ -2486,6 +2633,91 @@ class TestLastScheduled(TestObservationApiBase):
         self.assertAlmostEqual(parse(last_schedule), timezone.now() - timedelta(days=7),
                                delta=timedelta(minutes=1))
 
+    def test_long_poll_answers_straight_away_when_schedule_changed_since(self):
+        self.locmem_cache.set('observation_portal_last_schedule_time_tst', timezone.now(), None)
+        since = (timezone.now() - timedelta(hours=1)).isoformat()
+        with patch('observation_portal.common.change_notifications.ChangeSubscription.wait') as mock_wait:
+            response = self.client.get(reverse('api:last_scheduled'), {'site': 'tst', 'since': since, 'wait': 10})
+            mock_wait.assert_not_called()
+        self.assertAlmostEqual(parse(response.json()['last_schedule_time']), timezone.now(), delta=timedelta(minutes=1))
+
+    def test_long_poll_returns_new_schedule_time_after_change(self):
+        last_schedule_time = timezone.now() - timedelta(hours=1)
+        self.locmem_cache.set('observation_portal_last_schedule_time_tst', last_schedule_time, None)
+        new_schedule_time = timezone.now()
+
+        def schedule_changed(timeout):
+            self.locmem_cache.set('observation_portal_last_schedule_time_tst', new_schedule_time, None)
+            return True
+
+        with patch('observation_portal.common.change_notifications.ChangeSubscription.wait') as mock_wait:
+            mock_wait.side_effect = schedule_changed
+            response = self.client.get(
+                reverse('api:last_scheduled'), {'site': 'tst', 'since': last_schedule_time.isoformat(), 'wait': 10}
+            )
+            mock_wait.assert_called_once_with(10)
+        self.assertEqual(parse(response.json()['last_schedule_time']), new_schedule_time)
+
+    def test_long_poll_rejects_invalid_since(self):
+        response = self.client.get(reverse('api:last_scheduled'), {'site': 'tst', 'since': 'notatime'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_site_schedule_returns_not_modified(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        self._create_observation(observation)
+        response = self.client.get(reverse('api:schedule-list') + '?site=tst')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        etag = response['ETag']
+
+        response = self.client.get(reverse('api:schedule-list') + '?site=tst', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_site_schedule_snapshot_is_replaced_when_observations_are_scheduled(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        self._create_observation(observation)
+        response = self.client.get(reverse('api:schedule-list') + '?site=tst')
+        etag = response['ETag']
+
+        self._create_observation(observation)
+        response = self.client.get(reverse('api:schedule-list') + '?site=tst', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_site_schedule_snapshot_is_replaced_when_configuration_statuses_change(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        self._create_observation(observation)
+        response = self.client.get(reverse('api:schedule-list') + '?site=tst')
+        etag = response['ETag']
+
+        configuration_status = ConfigurationStatus.objects.first()
+        self.client.patch(reverse('api:configurationstatus-detail', args=(configuration_status.id,)), {'state': 'ATTEMPTED'})
+        response = self.client.get(reverse('api:schedule-list') + '?site=tst', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_site_schedule_snapshot_is_replaced_when_request_group_is_canceled(self):
+        observation = self._generate_observation_data(
+            self.requestgroup.requests.first().id, [self.requestgroup.requests.first().configurations.first().id]
+        )
+        self._create_observation(observation)
+        response = self.client.get(reverse('api:schedule-list') + '?site=tst')
+        etag = response['ETag']
+
+        self.requestgroup.state = 'CANCELED'
+        self.requestgroup.save()
+        response = self.client.get(reverse('api:schedule-list') + '?site=tst', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
 
 class TestTimeAccountingBase(TestObservationApiBase):
     def setUp(self):
@@ -2562,6 +2794,35 @@ class TestTimeAccounting(TestTimeAccountingBase):
                                        config_status_state='COMPLETED',
                                        config_end=datetime(2019, 9, 5, 22, 58, 24, tzinfo=timezone.utc))
 
+    def test_rapid_response_base_duration_uses_stored_duration(self):
+        configuration = self.requestgroup.requests.first().configurations.first()
+        configuration.cached_duration = None
+        live_base_duration = rapid_response_base_duration(configuration, 1)
+        configuration.cached_duration = configuration.duration + 600
+        self.assertEqual(rapid_response_base_duration(configuration, 1), live_base_duration + timedelta(seconds=600))
+
+    @override_settings(DEFER_TIME_ACCOUNTING=True)
+    def test_deferred_time_accounting_is_applied_from_the_ledger(self):
+        _, config_status = self._create_observation_and_config_status(
+            self.requestgroup, start=datetime(2019, 9, 5, 22, 20, tzinfo=timezone.utc),
+            end=datetime(2019, 9, 5, 23, tzinfo=timezone.utc), config_state='COMPLETED'
+        )
+        summary = mixer.blend(Summary, configuration_status=config_status,
+                              start=datetime(2019, 9, 5, 22, 20, tzinfo=timezone.utc),
+                              end=datetime(2019, 9, 5, 22, 50, tzinfo=timezone.utc))
+        summary.end = datetime(2019, 9, 5, 22, 35, tzinfo=timezone.utc)
+        summary.save()
+        self.time_allocation.refresh_from_db()
+        self.assertEqual(self.time_allocation.std_time_used, 0)
+        entries = TimeAccountingEntry.objects.filter(configuration_status_id=config_status.id)
+        self.assertEqual(sorted(entry.hours for entry in entries), [-0.25, 0.5])
+
+        self.assertEqual(apply_time_accounting_entries(), 2)
+        self.time_allocation.refresh_from_db()
+        self.assertAlmostEqual(self.time_allocation.std_time_used, 0.25)
+        self.assertEqual(apply_time_accounting_entries(), 0)
+        self.assertFalse(TimeAccountingEntry.objects.filter(applied=False).exists())
+
     def test_multiple_summary_saves_leads_to_consistent_time_accounting(self):
         config_start = datetime(2019, 9, 5, 22, 20, 24, tzinfo=timezone.utc)
         config_status, summary = self._helper_test_summary_save(
@@ -2804,6 +3065,85 @@ class TestTimeAccountingCommand(TestObservationApiBase):
         self.time_allocation.refresh_from_db()
         self.assertEqual(self.time_allocation.std_time_used, 0)
 
+    def test_rapid_response_time_used_is_clipped_to_observation_end(self):
+        self.requestgroup.observation_type = RequestGroup.RAPID_RESPONSE
+        self.requestgroup.save()
+        observation = self._add_observation(state='COMPLETED', time_completed=1000)
+        summary = observation.configuration_statuses.first().summary
+        summary.end = observation.end + timedelta(hours=1)
+        summary.save()
+        call_command('time_accounting', f'-p{self.proposal.id}', '-i1M0-SCICAM-SBIG', f'-s{self.semester.id}',
+                     stdout=StringIO(), stderr=StringIO())
+        self.time_allocation.refresh_from_db()
+        self.assertAlmostEqual(self.time_allocation.rr_time_used, (observation.end - summary.start).total_seconds() / 3600.0)
+        self.assertEqual(self.time_allocation.std_time_used, 0)
+
+    @override_settings(DEFER_TIME_ACCOUNTING=True)
+    def test_command_marks_unapplied_time_accounting_entries_as_applied(self):
+        observation = self._add_observation(state='COMPLETED', time_completed=1000)
+        self.assertTrue(TimeAccountingEntry.objects.filter(time_allocation=self.time_allocation, applied=False).exists())
+        call_command('time_accounting', f'-p{self.proposal.id}', '-i1M0-SCICAM-SBIG', f'-s{self.semester.id}',
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(TimeAccountingEntry.objects.filter(time_allocation=self.time_allocation, applied=False).exists())
+        self.assertEqual(apply_time_accounting_entries(), 0)
+        summary = observation.configuration_statuses.first().summary
+        self.time_allocation.refresh_from_db()
+        self.assertAlmostEqual(self.time_allocation.std_time_used, (summary.end - summary.start).total_seconds() / 3600.0)
+
+    def test_populate_time_charged_fills_in_time_charged(self):
+        observation = self._add_observation(state='COMPLETED', time_completed=1000)
+        observation.configuration_statuses.update(time_charged=0)
+        call_command('populate_time_charged', '-b1', stdout=StringIO())
+        configuration_status = observation.configuration_statuses.first()
+        summary = configuration_status.summary
+        self.assertAlmostEqual(configuration_status.time_charged, (summary.end - summary.start).total_seconds() / 3600.0)
+
+
+@patch('observation_portal.observations.management.commands.archive_observations.timezone.now',
+       return_value=datetime(2016, 9, 1, tzinfo=timezone.utc))
+class TestArchiveObservationsCommand(TestObservationApiBase):
+    def _add_observation(self, state, start, summary=True):
+        observation = Observation.objects.create(request=self.requestgroup.requests.first(), state=state, site='tst', enclosure='domb', telescope='1m0a',
+                                                 start=start, end=start + timedelta(hours=1))
+        config_status = ConfigurationStatus.objects.create(observation=observation, configuration=self.requestgroup.requests.first().configurations.first(),
+                                                           state=state, instrument_name='xx03', guide_camera_name='xx03')
+        if summary:
+            Summary.objects.create(configuration_status=config_status, start=start, end=start + timedelta(hours=1), time_completed=3600, state=state)
+        return observation
+
+    def test_archives_old_terminal_observations(self, mock_now):
+        old_observation = self._add_observation('COMPLETED', datetime(2016, 7, 10, tzinfo=timezone.utc))
+        recent_observation = self._add_observation('COMPLETED', datetime(2016, 8, 30, tzinfo=timezone.utc))
+        pending_observation = self._add_observation('PENDING', datetime(2016, 7, 10, tzinfo=timezone.utc))
+        call_command('archive_observations', '-m1', '--states', 'COMPLETED', '--with-summaries', stdout=StringIO())
+        self.assertEqual(
+            set(Observation.objects.values_list('id', flat=True)), {recent_observation.id, pending_observation.id}
+        )
+        self.assertEqual(ConfigurationStatus.objects.count(), 2)
+        self.assertEqual(Summary.objects.count(), 2)
+        archived_observation = ObservationArchive.objects.get(observation_id=old_observation.id)
+        self.assertEqual(archived_observation.month, date(2016, 7, 1))
+        self.assertEqual(archived_observation.request_id, old_observation.request_id)
+        self.assertEqual(archived_observation.data['configuration_statuses'][0]['summary']['time_completed'], 3600)
+
+    def test_archives_only_canceled_and_not_attempted_observations_without_summaries_by_default(self, mock_now):
+        completed_observation = self._add_observation('COMPLETED', datetime(2016, 7, 10, tzinfo=timezone.utc))
+        canceled_observation = self._add_observation('CANCELED', datetime(2016, 7, 10, tzinfo=timezone.utc), summary=False)
+        not_attempted_observation = self._add_observation('NOT_ATTEMPTED', datetime(2016, 7, 10, tzinfo=timezone.utc))
+        call_command('archive_observations', '-m1', stdout=StringIO())
+        self.assertEqual(
+            set(Observation.objects.values_list('id', flat=True)), {completed_observation.id, not_attempted_observation.id}
+        )
+        self.assertEqual(list(ObservationArchive.objects.values_list('observation_id', flat=True)), [canceled_observation.id])
+
+    def test_dry_run_doesnt_archive_observations(self, mock_now):
+        self._add_observation('CANCELED', datetime(2016, 7, 10, tzinfo=timezone.utc), summary=False)
+        command_output = StringIO()
+        call_command('archive_observations', '-m1', '-d', stdout=command_output)
+        self.assertIn('Would archive 1 observations', command_output.getvalue())
+        self.assertEqual(Observation.objects.count(), 1)
+        self.assertEqual(ObservationArchive.objects.count(), 0)
+
 
 class TestGetObservationsDetailAPIView(APITestCase):
     def setUp(self):
@@ -2947,6 +3287,65 @@ class TestGetObservationsListAPIView(TestObservationApiBase):
         self.assertNotIn(self.first_private_proposal.id, str(response.content))
         self.assertNotIn(self.public_proposal.id, str(response.content))
 
+    def _get_all_pages_with_cursor(self, url):
+        observation_ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            observation_ids.extend(observation['id'] for observation in response.json()['results'])
+            url = response.json()['next']
+        return observation_ids, response.json()
+
+    def test_cursor_pagination_pages_through_all_observations(self):
+        staff_user = blend_user(user_params={'is_staff': True, 'is_superuser': True}, profile_params={'staff_view': True})
+        self.client.force_login(staff_user)
+        observation_ids, last_page = self._get_all_pages_with_cursor(
+            reverse('api:observations-list') + '?pagination=cursor&limit=4'
+        )
+        self.assertEqual(observation_ids, sorted(Observation.objects.values_list('id', flat=True), reverse=True))
+        self.assertEqual(last_page['count'], 9)
+
+    def test_cursor_pagination_with_ordering_field_and_no_count(self):
+        staff_user = blend_user(user_params={'is_staff': True, 'is_superuser': True}, profile_params={'staff_view': True})
+        self.client.force_login(staff_user)
+        observation_ids, last_page = self._get_all_pages_with_cursor(
+            reverse('api:observations-list') + '?pagination=cursor&limit=2&ordering=start&count=false'
+        )
+        self.assertEqual(
+            observation_ids, list(Observation.objects.order_by('start', 'id').values_list('id', flat=True))
+        )
+        self.assertNotIn('count', last_page)
+
+    def test_visible_observations_filtered_by_instrument_type_are_not_deduplicated(self):
+        request = APIRequestFactory().get(reverse('api:observations-list'))
+        request.user = self.non_staff_user
+        queryset = ObservationFilter(
+            {'instrument_type': ['1M0-SCICAM-SBIG'], 'configuration_type': ['EXPOSE']},
+            queryset=viewsets.observations_queryset(request)
+        ).qs
+        self.assertFalse(queryset.query.distinct)
+        plan = queryset.explain()
+        # PostgreSQL collapses duplicate rows with Unique or HashAggregate nodes, SQLite with a temp b-tree
+        self.assertIsNone(re.search(r'^\s*(->\s*)?(Unique|HashAggregate)\b', plan, re.MULTILINE))
+        self.assertNotIn('DISTINCT', plan)
+        self.assertEqual(queryset.count(), len(set(queryset.values_list('id', flat=True))))
+        self.assertEqual(queryset.count(), 6)
+
+    def test_bulk_as_dicts_matches_individual_as_dict(self):
+        observations = list(Observation.objects.order_by('id'))
+        # Two observations of the same request should share the request dictionary work
+        observations.append(Observation.objects.order_by('id').first())
+        self.assertEqual(Observation.as_dicts(observations), [observation.as_dict() for observation in observations])
+        self.assertEqual(
+            Observation.as_dicts(observations, no_request=True),
+            [observation.as_dict(no_request=True) for observation in observations]
+        )
+
+    def test_cursor_pagination_rejects_invalid_cursor(self):
+        response = self.client.get(reverse('api:observations-list') + '?pagination=cursor&cursor=notacursor')
+        self.assertEqual(response.status_code, 400)
+
+
 class TestGetObservationsFiltersApi(APITestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -1,15 +1,22 @@
 import logging
 from datetime import timedelta
+from django.conf import settings
 from django.db import transaction
-from django.db.models import F
-from observation_portal.requestgroups.duration_utils import get_configuration_duration
+from django.db.models import F, Sum
 from observation_portal.requestgroups.models import RequestGroup
 from observation_portal.common.configdb import configdb
 from observation_portal.proposals.models import TimeAllocation, Semester
+from observation_portal.observations.models import ConfigurationStatus, TimeAccountingEntry
 
 
 logger = logging.getLogger()
 
+TIME_USED_FIELDS = {
+    RequestGroup.NORMAL: 'std_time_used',
+    RequestGroup.RAPID_RESPONSE: 'rr_time_used',
+    RequestGroup.TIME_CRITICAL: 'tc_time_used'
+}
+
 
 def on_summary_update_time_accounting(current, instance):
     """ Whenever a summary is created or updated, do time accounting based on the completed time """
@@ -27,35 +34,106 @@ def on_summary_update_time_accounting(current, instance):
     debit_time(instance.configuration_status, observation_type, time_difference, new_config_time.total_seconds() / 3600.0)
 
 
-def debit_time(configuration_status, observation_type, time_difference, new_time_charged):
-    if time_difference:
-        time_allocations = configuration_status.observation.request.timeallocations
-        for time_allocation in time_allocations:
+def on_summaries_update_time_accounting(summary_changes):
+    """ Does the time accounting of on_summary_update_time_accounting for many summaries at once, given as a list of
+        (current, instance) pairs. The time_charged is set on each configuration status that was charged, and those
+        configuration statuses are returned unsaved.
+    """
+    time_allocations_by_request = {}
+    charged_configuration_statuses = {}
+    entries = []
+    for current, instance in summary_changes:
+        configuration_status = instance.configuration_status
+        request = configuration_status.observation.request
+        observation_type = request.request_group.observation_type
+        # No time accounting is done for Direct submitted observations
+        if observation_type in RequestGroup.NON_SCHEDULED_TYPES:
+            continue
+        if observation_type not in TIME_USED_FIELDS:
+            logger.warning(f'Failed to perform time accounting on configuration_status {configuration_status.id}. Observation Type'
+                           f'{observation_type} was not valid')
+            continue
+
+        current_config_time = timedelta(seconds=0)
+        if current is not None:
+            current_config_time = configuration_time_used(current, observation_type)
+        new_config_time = configuration_time_used(instance, observation_type)
+        time_difference = (new_config_time - current_config_time).total_seconds() / 3600.0
+        if not time_difference:
+            continue
+
+        if request.id not in time_allocations_by_request:
+            time_allocations_by_request[request.id] = list(request.timeallocations)
+        for time_allocation in time_allocations_by_request[request.id]:
             if configuration_status.configuration.instrument_type in time_allocation.instrument_types:
-                if observation_type == RequestGroup.NORMAL:
-                    with transaction.atomic():
-                        TimeAllocation.objects.select_for_update().filter(
-                            id=time_allocation.id).update(std_time_used=F('std_time_used') + time_difference)
-                        configuration_status.time_charged = new_time_charged
-                        configuration_status.save()
-                elif observation_type == RequestGroup.RAPID_RESPONSE:
-                    with transaction.atomic():
-                        TimeAllocation.objects.select_for_update().filter(
-                            id=time_allocation.id).update(rr_time_used=F('rr_time_used') + time_difference)
-                        configuration_status.time_charged = new_time_charged
-                        configuration_status.save()
-                elif observation_type == RequestGroup.TIME_CRITICAL:
-                    with transaction.atomic():
-                        TimeAllocation.objects.select_for_update().filter(
-                            id=time_allocation.id).update(tc_time_used=F('tc_time_used') + time_difference)
-                        configuration_status.time_charged = new_time_charged
-                        configuration_status.save()
-                else:
-                    logger.warning(f'Failed to perform time accounting on configuration_status {configuration_status.id}. Observation Type'
-                                   '{observation_type} was not valid')
-                    continue
+                entries.append(TimeAccountingEntry(
+                    time_allocation=time_allocation, configuration_status_id=configuration_status.id,
+                    observation_type=observation_type, entry_type=TimeAccountingEntry.SUMMARY, hours=time_difference
+                ))
+                configuration_status.time_charged = new_config_time.total_seconds() / 3600.0
+                charged_configuration_statuses[configuration_status.id] = configuration_status
+
+    record_time_accounting_entries(entries)
+    return list(charged_configuration_statuses.values())
+
+
+def debit_time(configuration_status, observation_type, time_difference, new_time_charged,
+               entry_type=TimeAccountingEntry.SUMMARY):
+    if not time_difference:
+        return
+    if observation_type not in TIME_USED_FIELDS:
+        logger.warning(f'Failed to perform time accounting on configuration_status {configuration_status.id}. Observation Type'
+                       f'{observation_type} was not valid')
+        return
+    entries = [
+        TimeAccountingEntry(
+            time_allocation=time_allocation, configuration_status_id=configuration_status.id,
+            observation_type=observation_type, entry_type=entry_type, hours=time_difference
+        )
+        for time_allocation in configuration_status.observation.request.timeallocations
+        if configuration_status.configuration.instrument_type in time_allocation.instrument_types
+    ]
+    if entries:
+        with transaction.atomic():
+            record_time_accounting_entries(entries)
+            # Update the row directly so charging time doesn't go through the save signals of the configuration status
+            configuration_status.time_charged = new_time_charged
+            ConfigurationStatus.objects.filter(id=configuration_status.id).update(time_charged=new_time_charged)
+
+
+def record_time_accounting_entries(entries):
+    """ Appends entries to the time accounting ledger. Unless DEFER_TIME_ACCOUNTING is set, they are applied to their
+        TimeAllocations straight away, otherwise the apply_time_accounting actor applies them shortly after. """
+    if not entries:
+        return
+    TimeAccountingEntry.objects.bulk_create(entries)
+    if not settings.DEFER_TIME_ACCOUNTING:
+        apply_time_accounting_entries()
 
 
+def apply_time_accounting_entries():
+    """ Adds the hours of the time accounting entries that have not been applied yet to the *_time_used of their
+        TimeAllocations, with a single update per TimeAllocation and observation type. Returns the number of entries
+        applied.
+    """
+    with transaction.atomic():
+        # Entries being applied by a concurrent call are skipped rather than waited on
+        entry_ids = list(TimeAccountingEntry.objects.select_for_update(skip_locked=True).filter(
+            applied=False
+        ).values_list('id', flat=True))
+        if not entry_ids:
+            return 0
+        totals = TimeAccountingEntry.objects.filter(id__in=entry_ids).values(
+            'time_allocation', 'observation_type'
+        ).annotate(total_hours=Sum('hours')).order_by('time_allocation', 'observation_type')
+        for total in totals:
+            field = TIME_USED_FIELDS[total['observation_type']]
+            TimeAllocation.objects.filter(id=total['time_allocation']).update(
+                **{field: F(field) + total['total_hours']}
+            )
+        TimeAccountingEntry.objects.filter(id__in=entry_ids).update(applied=True)
+    return len(entry_ids)
+
 
 def refund_observation_time(observation, percentage_refund):
     """ Refunds a percentage of an observations time used back to its TimeAllocations.
@@ -81,7 +159,8 @@ def refund_configuration_status_time(configuration_status, percentage_refund):
     if refunded_time_charged < configuration_status.time_charged:
         # The time_difference here should be negative, which means time is added to the TimeAllocation
         time_difference = refunded_time_charged - configuration_status.time_charged
-        debit_time(configuration_status, observation_type, time_difference, refunded_time_charged)
+        debit_time(configuration_status, observation_type, time_difference, refunded_time_charged,
+                   entry_type=TimeAccountingEntry.REFUND)
         return abs(time_difference)
     return 0.0
 
@@ -92,16 +171,29 @@ def configuration_time_used(summary, observation_type):
     configuration_time += summary.end - summary.start
 
     if observation_type == RequestGroup.RAPID_RESPONSE:
-        request_overheads = configdb.get_request_overheads(summary.configuration_status.configuration.instrument_type)
-        base_duration = timedelta(
-            seconds=get_configuration_duration(summary.configuration_status.configuration.as_dict(), request_overheads)['duration']
+        base_duration = rapid_response_base_duration(
+            summary.configuration_status.configuration,
+            len(summary.configuration_status.observation.request.configurations.all())
         )
-        base_duration += timedelta(seconds=(request_overheads['observation_front_padding'] / len(summary.configuration_status.observation.request.configurations.all())))
         configuration_time = min(configuration_time, base_duration)
 
     return configuration_time
 
 
+def rapid_response_base_duration(configuration, num_configurations):
+    """ The most a rapid response configuration can be charged: its own duration plus its share of the front padding
+        of a request with num_configurations configurations. The duration stored when the configuration was created is
+        used if it has one.
+    """
+    request_overheads = configdb.get_request_overheads(configuration.instrument_type)
+    duration = configuration.cached_duration
+    if duration is None:
+        duration = configuration.duration
+    base_duration = timedelta(seconds=duration)
+    base_duration += timedelta(seconds=(request_overheads['observation_front_padding'] / num_configurations))
+    return base_duration
+
+
 def debit_realtime_time_allocation(site, enclosure, telescope, proposal, hours):
     """ Attempts to debit the largest suitable time allocation for a real time observation
         If hours is negative, it will act as a credit rather than a debit.
@@ -1,15 +1,14 @@
-from datetime import timedelta
-
 from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.permissions import IsAdminUser
-from django.core.cache import cache
-from django.utils import timezone
 from rest_framework.response import Response
 from django_filters.rest_framework.backends import DjangoFilterBackend
 from django.utils.module_loading import import_string
 
 from observation_portal.common.configdb import configdb
+from observation_portal.common.change_notifications import (
+    ChangeSubscription, get_change_times, get_long_poll_parameters
+)
 from observation_portal.observations.filters import LastScheduledFilter
 from observation_portal.common.schema import ObservationPortalSchema
 from observation_portal import settings
@@ -22,6 +21,9 @@ class LastScheduledView(APIView):
 
         We are only updating when observations are submitted, and not when they are cancelled, because a site should
         not really care if the only change was removing things from it's schedule.
+
+        Instead of polling, a client can pass the last schedule time it saw as `since`, and the response is held back
+        until the schedule changes or `wait` seconds have passed.
     """
     permission_classes = (IsAdminUser,)
     schema = ObservationPortalSchema(tags=['Observations'])
@@ -32,17 +34,23 @@ class LastScheduledView(APIView):
         site = request.query_params.get('site')
         cache_key = 'observation_portal_last_schedule_time'
         if site:
-            cache_key += f"_{site}"
-            last_schedule_time = cache.get(cache_key, timezone.now() - timedelta(days=7))
+            keys = [cache_key + f"_{site}"]
         else:
             sites = configdb.get_site_tuples()
             keys = [cache_key + "_" + s[0] for s in sites]
-            cache_dict = cache.get_many(keys)
-            last_schedule_time = max(list(cache_dict.values()) + [timezone.now() - timedelta(days=7)])
+        since, wait = get_long_poll_parameters(request)
+        with ChangeSubscription(keys) as subscription:
+            last_schedule_time = self._get_last_schedule_time(keys, site)
+            if since is not None and last_schedule_time <= since and subscription.wait(wait):
+                last_schedule_time = self._get_last_schedule_time(keys, site)
 
         response_serializer = self.get_response_serializer({'last_schedule_time': last_schedule_time})
         return Response(response_serializer.data, status=status.HTTP_200_OK)
 
+    @staticmethod
+    def _get_last_schedule_time(keys, site):
+        return max(get_change_times(keys).values())
+
     def get_response_serializer(self, *args, **kwargs):
         return import_string(settings.SERIALIZERS['observations']['LastScheduled'])(*args, **kwargs)
 
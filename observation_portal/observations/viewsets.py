@@ -9,24 +9,35 @@ from django.views.decorators.cache import cache_page, never_cache
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.utils.module_loading import import_string
+from django.utils.http import parse_etags
 from django.conf import settings
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import DjangoFilterBackend
 
 from observation_portal.requestgroups.models import RequestGroup
+from observation_portal.proposals.models import Membership
 from observation_portal.observations.time_accounting import debit_realtime_time_allocation
 from observation_portal.observations.models import Observation, ConfigurationStatus
 from observation_portal.observations.filters import ObservationFilter, ConfigurationStatusFilter
 from observation_portal.observations.realtime import get_realtime_availability
 from observation_portal.common.mixins import ListAsDictMixin, CreateListModelMixin
+from observation_portal.common.pagination import LimitOffsetOrCursorPagination
 from observation_portal.accounts.permissions import IsAdminOrReadOnly, IsDirectUser
 from observation_portal.common.schema import ObservationPortalSchema
 from observation_portal.common.doc_examples import EXAMPLE_RESPONSES
 from observation_portal.common.downtimedb import DowntimeDB
+from observation_portal.common.change_notifications import (
+    bump_schedule_versions, get_schedule_version, notify_change
+)
 
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Sites poll their schedule every few seconds, so a snapshot only has to outlive a few polls
+SCHEDULE_SNAPSHOT_CACHE_DURATION = 60
+
 
 def get_sites_from_request(request):
     sites = set()
@@ -44,7 +55,9 @@ def observations_queryset(request):
         if request.user.profile.staff_view and request.user.is_staff:
             qs = Observation.objects.all()
         else:
-            qs = Observation.objects.filter(request__request_group__proposal__in=request.user.proposal_set.all())
+            qs = Observation.objects.filter(Exists(Membership.objects.filter(
+                user=request.user, proposal=OuterRef('request__request_group__proposal')
+            )))
             if request.user.profile.view_authored_requests_only:
                 qs = qs.filter(request__request_group__submitter=request.user)
     else:
@@ -56,7 +69,7 @@ def observations_queryset(request):
         'request__configurations__guiding_config', 'request__configurations__constraints',
         'request__configurations__instrument_configs__rois', 'configuration_statuses',
         'configuration_statuses__summary', 'configuration_statuses__configuration', 'request__request_group__submitter'
-    ).distinct()
+    )
 
 
 class RealTimeViewSet(CreateListModelMixin, viewsets.ModelViewSet):
@@ -137,6 +150,7 @@ class RealTimeViewSet(CreateListModelMixin, viewsets.ModelViewSet):
         sites = get_sites_from_request(request)
         for site in sites:
             cache.set(f"{cache_key}_{site}", timezone.now(), None)
+            notify_change(f"{cache_key}_{site}")
         return created_obs
 
     @method_decorator(never_cache)
@@ -167,6 +181,7 @@ class ScheduleViewSet(ListAsDictMixin, CreateListModelMixin, viewsets.ModelViewS
         DjangoFilterBackend
     )
     ordering = ('-id',)
+    pagination_class = LimitOffsetOrCursorPagination
 
     def perform_create(self, serializer):
         serializer.save(submitter=self.request.user, submitter_id=self.request.user.id)
@@ -182,8 +197,33 @@ class ScheduleViewSet(ListAsDictMixin, CreateListModelMixin, viewsets.ModelViewS
         sites = get_sites_from_request(request)
         for site in sites:
             cache.set(f"{cache_key}_{site}", timezone.now(), None)
+            notify_change(f"{cache_key}_{site}")
+        bump_schedule_versions(sites)
         return created_obs
 
+    def list(self, request, *args, **kwargs):
+        """ The schedule of a single site is served from a snapshot keyed on the version of the schedule of the site,
+            with a strong ETag so polling an unchanged schedule returns a 304 without serializing it again. The version
+            is replaced by every write to the observations of the site, their configuration statuses, summaries,
+            requests, request groups and windows.
+        """
+        sites = request.query_params.getlist('site')
+        if len(sites) != 1:
+            return super().list(request, *args, **kwargs)
+        version = get_schedule_version(sites[0])
+        snapshot_hash = hashlib.sha1('|'.join([
+            sites[0], version, str(request.user.id), request.query_params.urlencode()
+        ]).encode()).hexdigest()
+        etag = f'"{snapshot_hash}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        cache_key = f'schedule_snapshot_{snapshot_hash}'
+        schedule_data = cache.get(cache_key)
+        if schedule_data is None:
+            schedule_data = super().list(request, *args, **kwargs).data
+            cache.set(cache_key, schedule_data, SCHEDULE_SNAPSHOT_CACHE_DURATION)
+        return Response(schedule_data, headers={'ETag': etag})
+
     def get_example_response(self):
         return {'list': Response(EXAMPLE_RESPONSES['observations']['list_schedule'], status=200)}.get(self.action)
 
@@ -199,9 +239,10 @@ class ObservationViewSet(CreateListModelMixin, ListAsDictMixin, viewsets.ModelVi
         DjangoFilterBackend
     )
     ordering = ('-id',)
+    pagination_class = LimitOffsetOrCursorPagination
 
     def get_queryset(self):
-        return observations_queryset(self.request).prefetch_related('request__windows', 'request__location').distinct()
+        return observations_queryset(self.request).prefetch_related('request__windows', 'request__location')
 
     @action(detail=False, methods=['get'])
     def filters(self, request):
@@ -259,7 +300,7 @@ class ObservationViewSet(CreateListModelMixin, ListAsDictMixin, viewsets.ModelVi
                 observations = observations.filter(request__request_group__proposal__direct_submission=True)
             # First check if we have an in_progress observation that overlaps with the time range and resource.
             # If we do and preemption is not enabled in the call, return a 400 error without cancelling anything.
-            if observations.filter(state='IN_PROGRESS').count() > 0 and not request_serializer.data.get('preemption_enabled', False):
+            if observations.filter(state='IN_PROGRESS').exists() and not request_serializer.data.get('preemption_enabled', False):
                 return Response({'error': 'Cannot cancel IN_PROGRESS observations unless preemption_enabled is True'}, status=status.HTTP_400_BAD_REQUEST)
             observations = observations.filter(state__in=['PENDING', 'IN_PROGRESS'])
 
@@ -279,28 +320,20 @@ class ObservationViewSet(CreateListModelMixin, ListAsDictMixin, viewsets.ModelVi
             created_obs = super().create(request, args, kwargs)
             site = request.data['site']
             cache.set(cache_key + f"_{site}", timezone.now(), None)
+            notify_change(cache_key + f"_{site}")
+            bump_schedule_versions([site])
             return created_obs
         else:
+            # The list serializer keeps the errors of invalid observations by index and bulk creates the valid ones
             serializer = self.get_serializer(data=request.data)
-            errors = {}
-            try:
-                serializer.is_valid(raise_exception=True)
-                observations = serializer.save()
-            except ValidationError:
-                # fall back to individually serializing and saving requests if there are any with errors
-                observations = []
-                for i, error in enumerate(serializer.errors):
-                    if error:
-                        errors[i] = error
-                    else:
-                        individual_serializer = self.get_serializer(data=serializer.initial_data[i])
-                        if individual_serializer.is_valid():
-                            observations.append(individual_serializer.save())
-                        else:
-                            errors[i] = individual_serializer.error
+            serializer.is_valid(raise_exception=True)
+            observations = serializer.save()
+            errors = serializer.item_errors
             sites = get_sites_from_request(request)
             for site in sites:
                 cache.set(cache_key + f"_{site}", timezone.now(), None)
+                notify_change(cache_key + f"_{site}")
+            bump_schedule_versions(sites)
             return Response({'num_created': len(observations), 'errors': errors}, status=status.HTTP_201_CREATED)
 
     def get_request_serializer(self, *args, **kwargs):
@@ -323,7 +356,7 @@ class ObservationViewSet(CreateListModelMixin, ListAsDictMixin, viewsets.ModelVi
 
 class ConfigurationStatusViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAdminUser,)
-    http_method_names = ['get', 'patch']
+    http_method_names = ['get', 'patch', 'post']
     serializer_class = import_string(settings.SERIALIZERS['observations']['ConfigurationStatus'])
     filterset_class = ConfigurationStatusFilter
     schema = ObservationPortalSchema(tags=['Observations'])
@@ -333,3 +366,33 @@ class ConfigurationStatusViewSet(viewsets.ModelViewSet):
     )
     queryset = ConfigurationStatus.objects.all().prefetch_related('summary')
     ordering = ('-id',)
+
+    def create(self, request, *args, **kwargs):
+        # Configuration statuses are only created along with their Observation
+        return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    @action(detail=False, methods=['post'])
+    def bulk_update(self, request):
+        """ Applies a list of configuration status updates, each with the id of the configuration status and the fields
+            that a PATCH of it would have, in one transaction.
+        """
+        request_serializer = self.get_request_serializer(
+            ConfigurationStatus.objects.all(), data=request.data, many=True, partial=True
+        )
+        request_serializer.is_valid(raise_exception=True)
+        configuration_statuses = request_serializer.save()
+        response_serializer = self.get_response_serializer(configuration_statuses, many=True)
+        return Response(response_serializer.data, status=status.HTTP_200_OK)
+
+    def get_request_serializer(self, *args, **kwargs):
+        serializers = {'bulk_update': import_string(settings.SERIALIZERS['observations']['ConfigurationStatusBulkUpdate'])}
+
+        return serializers.get(self.action, self.serializer_class)(*args, context=self.get_serializer_context(), **kwargs)
+
+    def get_response_serializer(self, *args, **kwargs):
+        return self.serializer_class(*args, context=self.get_serializer_context(), **kwargs)
+
+    def get_endpoint_name(self):
+        endpoint_names = {'bulk_update': 'bulkUpdateConfigurationStatuses'}
+
+        return endpoint_names.get(self.action)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+import math
+
+from observation_portal.proposals.models import TimeUsedByUser
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the time used by users on proposals from their requestgroups, correcting any counters that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--proposal', type=str, default='',
+                            help='Proposal id to reconcile. Default empty string for all proposals.')
+        parser.add_argument('-s', '--semester', type=str, default='',
+                            help='Semester id to reconcile. Default empty string for all semesters.')
+
+    def handle(self, *args, **options):
+        times_used = TimeUsedByUser.objects.select_related('user', 'proposal', 'semester').order_by('id')
+        if options['proposal']:
+            times_used = times_used.filter(proposal=options['proposal'])
+        if options['semester']:
+            times_used = times_used.filter(semester=options['semester'])
+
+        num_corrected = 0
+        for time_used_by_user in times_used.iterator():
+            old_time_used, time_used = TimeUsedByUser.recompute(time_used_by_user)
+            if not math.isclose(old_time_used, time_used, abs_tol=0.001):
+                num_corrected += 1
+                print(f'{time_used_by_user}: corrected time used from {old_time_used} to {time_used} seconds',
+                      file=self.stderr)
+        print(f'Reconciled time used, {num_corrected} corrected', file=self.stdout)
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('proposals', '0011_proposalinvite_time_limit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeUsedByUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_used', models.FloatField(default=0)),
+                ('last_requestgroup_id', models.PositiveIntegerField(default=0)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('proposal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='proposals.proposal')),
+                ('semester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='proposals.semester')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'proposal', 'semester')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-19 12:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requestgroups', '0027_configuration_cached_duration'),
+        ('proposals', '0012_timeusedbyuser'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('request', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='requestgroups.request')),
+                ('request_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='requestgroups.requestgroup')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='queuednotification',
+            constraint=models.UniqueConstraint(fields=('request_group',), name='unique_queued_notification_request_group'),
+        ),
+        migrations.AddConstraint(
+            model_name='queuednotification',
+            constraint=models.UniqueConstraint(fields=('request',), name='unique_queued_notification_request'),
+        ),
+    ]
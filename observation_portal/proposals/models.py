@@ -2,7 +2,8 @@ from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
 from django.utils.functional import cached_property
 from django.forms import model_to_dict
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.template.loader import render_to_string
@@ -11,6 +12,7 @@ from django.utils.html import strip_tags
 from django.utils.module_loading import import_string
 from django.conf import settings
 from collections import namedtuple
+from datetime import timedelta
 
 from urllib.parse import urljoin
 import logging
@@ -369,3 +371,106 @@ class ProposalNotification(models.Model):
 
     class Meta:
         unique_together = ('proposal', 'user')
+
+
+class QueuedNotification(models.Model):
+    """ A completed requestgroup or a request that reached its failure limit, recorded when the state change is saved so
+        it is sent in the next notification digest. Queued notifications are deleted once the digest with them is sent.
+    """
+    request_group = models.ForeignKey('requestgroups.RequestGroup', null=True, blank=True, on_delete=models.CASCADE)
+    request = models.ForeignKey('requestgroups.Request', null=True, blank=True, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['request_group'], name='unique_queued_notification_request_group'),
+            models.UniqueConstraint(fields=['request'], name='unique_queued_notification_request')
+        ]
+
+    def __str__(self):
+        return 'RequestGroup {}'.format(self.request_group_id) if self.request_group_id else 'Request {}'.format(self.request_id)
+
+
+class TimeUsedByUser(models.Model):
+    """ The time a user has requested on a proposal since the start of a semester, in seconds. It counts the PENDING
+        and COMPLETED requests of the user's PENDING and COMPLETED requestgroups, so a time limit on a membership can be
+        checked without summing the user's whole history. Requestgroups up to last_requestgroup_id are included and
+        kept up to date as their states change. Newer requestgroups are summed up each time the time used is read, and
+        last_requestgroup_id only moves past requestgroups created more than WATERMARK_LAG ago, so a requestgroup whose
+        transaction commits after one with a higher id is never skipped.
+    """
+    TIME_USED_STATES = ('PENDING', 'COMPLETED')
+    WATERMARK_LAG = timedelta(minutes=10)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    proposal = models.ForeignKey(Proposal, on_delete=models.CASCADE)
+    semester = models.ForeignKey(Semester, on_delete=models.CASCADE)
+    time_used = models.FloatField(default=0)
+    last_requestgroup_id = models.PositiveIntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'proposal', 'semester')
+
+    def __str__(self):
+        return '{} - {} - {}'.format(self.user, self.proposal, self.semester)
+
+    @classmethod
+    def requestgroups_time_used(cls, requestgroups):
+        requestgroups = requestgroups.filter(state__in=cls.TIME_USED_STATES).prefetch_related('requests')
+        return sum(
+            request.duration for requestgroup in requestgroups for request in requestgroup.requests.all()
+            if request.state in cls.TIME_USED_STATES
+        )
+
+    @classmethod
+    def watermark(cls, requestgroups):
+        """ The highest id of the requestgroups created before WATERMARK_LAG ago, by when they have all been committed """
+        return requestgroups.filter(
+            created__lt=timezone.now() - cls.WATERMARK_LAG
+        ).order_by('-id').values_list('id', flat=True).first()
+
+    @classmethod
+    def get_time_used(cls, user, proposal, semester):
+        """ Returns the time used, first adding in any requestgroups submitted before WATERMARK_LAG ago since it was
+            last read, and then the ones submitted after """
+        time_used_by_user, _ = cls.objects.get_or_create(user=user, proposal=proposal, semester=semester)
+        requestgroups = user.requestgroup_set.filter(proposal=proposal, created__gte=semester.start)
+        last_requestgroup_id = cls.watermark(requestgroups.filter(id__gt=time_used_by_user.last_requestgroup_id))
+        if last_requestgroup_id is not None:
+            with transaction.atomic():
+                time_used_by_user = cls.objects.select_for_update().get(pk=time_used_by_user.pk)
+                if last_requestgroup_id > time_used_by_user.last_requestgroup_id:
+                    time_used_by_user.time_used += cls.requestgroups_time_used(requestgroups.filter(
+                        id__gt=time_used_by_user.last_requestgroup_id, id__lte=last_requestgroup_id
+                    ))
+                    time_used_by_user.last_requestgroup_id = last_requestgroup_id
+                    time_used_by_user.save()
+        return time_used_by_user.time_used + cls.requestgroups_time_used(
+            requestgroups.filter(id__gt=time_used_by_user.last_requestgroup_id)
+        )
+
+    @classmethod
+    def add_time_used(cls, requestgroup, time_used):
+        """ Adds time (negative to remove it) to the time used by the submitter of an already counted requestgroup """
+        if time_used:
+            cls.objects.filter(
+                user=requestgroup.submitter_id, proposal=requestgroup.proposal_id,
+                semester__start__lte=requestgroup.created, last_requestgroup_id__gte=requestgroup.id
+            ).update(time_used=F('time_used') + time_used)
+
+    @classmethod
+    def recompute(cls, time_used_by_user):
+        """ Recomputes the time used from all of the user's requestgroups up to the watermark, returning the old and new
+            time used """
+        with transaction.atomic():
+            time_used_by_user = cls.objects.select_for_update().get(pk=time_used_by_user.pk)
+            requestgroups = time_used_by_user.user.requestgroup_set.filter(
+                proposal=time_used_by_user.proposal, created__gte=time_used_by_user.semester.start
+            )
+            old_time_used = time_used_by_user.time_used
+            last_requestgroup_id = cls.watermark(requestgroups) or 0
+            time_used_by_user.time_used = cls.requestgroups_time_used(requestgroups.filter(id__lte=last_requestgroup_id))
+            time_used_by_user.last_requestgroup_id = last_requestgroup_id
+            time_used_by_user.save()
+        return old_time_used, time_used_by_user.time_used
@@ -1,8 +1,16 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import transaction
+from django.template.loader import render_to_string
 from django.utils import timezone
 import dramatiq
 import logging
 
-from observation_portal.proposals.models import Proposal
+from observation_portal.accounts.tasks import send_mass_mail
+from observation_portal.proposals.models import Proposal, Membership, ProposalNotification, QueuedNotification, Semester
+from observation_portal.requestgroups.models import Request, RequestGroup
 
 logger = logging.getLogger(__name__)
 
@@ -18,3 +26,123 @@ def time_allocation_reminder():
         ):
             logger.info('Sending time allocation reminder for {}'.format(proposal))
             proposal.send_time_allocation_reminder()
+
+
+@dramatiq.actor(time_limit=1800000)
+def reconcile_time_used():
+    # Correct any drift in the time used by users on proposals in the current semesters
+    for semester in Semester.current_semesters():
+        call_command('reconcile_time_used', semester=semester.id)
+
+
+def users_to_notify_by_requestgroup(requestgroups):
+    """Return the users to notify about each of the requestgroups by requestgroup id, with two queries in total"""
+    proposal_ids = {requestgroup.proposal_id for requestgroup in requestgroups}
+    users_by_proposal = defaultdict(dict)
+    memberships = Membership.objects.filter(
+        proposal__in=proposal_ids, user__profile__notifications_enabled=True
+    ).select_related('user__profile')
+    proposal_notifications = ProposalNotification.objects.filter(proposal__in=proposal_ids).select_related('user__profile')
+    for subscription in list(memberships) + list(proposal_notifications):
+        users_by_proposal[subscription.proposal_id][subscription.user_id] = subscription.user
+    return {
+        requestgroup.id: [
+            user for user in users_by_proposal[requestgroup.proposal_id].values()
+            if not user.profile.notifications_on_authored_only or requestgroup.submitter_id == user.id
+        ] for requestgroup in requestgroups
+    }
+
+
+def requestgroup_notification(requestgroup):
+    subject = 'Request {} has completed'.format(requestgroup.name)
+    message = render_to_string(
+        'proposals/requestgroupcomplete.txt',
+        {
+            'requestgroup': requestgroup,
+            'download_url': settings.REQUESTGROUP_DATA_DOWNLOAD_URL.format(requestgroup_id=requestgroup.id),
+            'observation_portal_base_url': settings.OBSERVATION_PORTAL_BASE_URL,
+            'organization_name': settings.ORGANIZATION_NAME
+        }
+    )
+    return subject, message
+
+
+def request_notification(request):
+    subject = f'Request #{request.id} has failed {settings.MAX_FAILURES_PER_REQUEST} times and will not be rescheduled'
+    message = render_to_string(
+        'proposals/requestfailurelimit.txt',
+        {
+            'request': request,
+            'detail_url': settings.REQUEST_DETAIL_URL.format(request_id=request.id),
+            'max_failure_limit': settings.MAX_FAILURES_PER_REQUEST,
+            'observation_portal_base_url': settings.OBSERVATION_PORTAL_BASE_URL,
+            'organization_name': settings.ORGANIZATION_NAME
+        }
+    )
+    return subject, message
+
+
+def notification_emails(requestgroups, requests, digest=False):
+    """Build the notification emails for the completed requestgroups and the requests that reached their failure limit.
+    Each notification is rendered once and sent to all of its users. With digest set, the notifications for each user
+    are combined into a single email."""
+    notifications = [(requestgroup, requestgroup_notification(requestgroup)) for requestgroup in requestgroups]
+    notifications.extend((request.request_group, request_notification(request)) for request in requests)
+    users_by_requestgroup = users_to_notify_by_requestgroup({requestgroup for requestgroup, _ in notifications})
+
+    notifications_by_user = defaultdict(list)
+    for requestgroup, notification in notifications:
+        for user in users_by_requestgroup[requestgroup.id]:
+            notifications_by_user[user.email].append(notification)
+
+    email_messages = []
+    for email, user_notifications in notifications_by_user.items():
+        if digest and len(user_notifications) > 1:
+            user_notifications = [(
+                f'{len(user_notifications)} of your observation requests have updates',
+                '\n\n'.join(f'{subject}\n\n{message}' for subject, message in user_notifications)
+            )]
+        for subject, message in user_notifications:
+            email_messages.append((subject, message, settings.ORGANIZATION_EMAIL, [email]))
+    return email_messages
+
+
+@dramatiq.actor()
+def send_notifications(requestgroup_ids=(), request_ids=()):
+    """Email the users following the completed requestgroups and the requests that reached their failure limit"""
+    requestgroups = RequestGroup.objects.filter(id__in=requestgroup_ids, state='COMPLETED').select_related('proposal')
+    requests = Request.objects.filter(
+        id__in=request_ids, state='FAILURE_LIMIT_REACHED'
+    ).select_related('request_group__proposal')
+    email_messages = notification_emails(list(requestgroups), list(requests))
+    if email_messages:
+        send_mass_mail(email_messages)
+
+
+@dramatiq.actor()
+def send_notification_digest():
+    """Email each user a single digest of the queued notifications of requestgroups that completed and requests that
+    reached their failure limit. The sent notifications are deleted in the same transaction, so each is sent once."""
+    with transaction.atomic():
+        # Notifications being sent by a concurrent digest are skipped rather than waited on
+        queued_notifications = list(
+            QueuedNotification.objects.select_for_update(skip_locked=True, of=('self',)).select_related(
+                'request_group__proposal', 'request__request_group__proposal'
+            )
+        )
+        if not queued_notifications:
+            return
+        # Only notify about the ones that are still in the state they were queued for
+        requestgroups = {
+            queued.request_group_id: queued.request_group for queued in queued_notifications
+            if queued.request_group_id and queued.request_group.state == 'COMPLETED'
+        }
+        requests = {
+            queued.request_id: queued.request for queued in queued_notifications
+            if queued.request_id and queued.request.state == 'FAILURE_LIMIT_REACHED'
+        }
+        email_messages = notification_emails(list(requestgroups.values()), list(requests.values()), digest=True)
+        if email_messages:
+            logger.info(f'Sending {len(email_messages)} notification digest emails')
+            send_mass_mail(email_messages)
+        QueuedNotification.objects.filter(id__in=[queued.id for queued in queued_notifications]).delete()
@@ -1,18 +1,23 @@
 from django.test import TestCase
 from django.core import mail
+from django.core.management import call_command
 from django.contrib.auth.models import User
 from django.db.utils import IntegrityError
 from django.urls import reverse
 from django.utils import timezone
 from mixer.backend.django import mixer
 import datetime
+from io import StringIO
 from django_dramatiq.test import DramatiqTestCase
 
-from observation_portal.proposals.models import ProposalInvite, Proposal, Membership, ProposalNotification, TimeAllocation, Semester
+from observation_portal.proposals.models import (
+    ProposalInvite, Proposal, Membership, ProposalNotification, TimeAllocation, Semester, TimeUsedByUser,
+    QueuedNotification
+)
 from observation_portal.requestgroups.models import RequestGroup, Configuration, InstrumentConfig, Window
 from observation_portal.accounts.test_utils import blend_user
 from observation_portal.common.test_helpers import create_simple_requestgroup
-from observation_portal.proposals.tasks import time_allocation_reminder
+from observation_portal.proposals.tasks import time_allocation_reminder, send_notification_digest
 from observation_portal.requestgroups.signals import handlers  # DO NOT DELETE, needed to active signals
 from observation_portal.proposals.forms import TimeAllocationForm
 
@@ -197,6 +202,34 @@ class TestProposalNotifications(DramatiqTestCase):
 
         self.assertEqual(len(mail.outbox), 0)
 
+    def test_notification_digest_combines_notifications_for_user(self):
+        self.user.profile.notifications_enabled = True
+        self.user.profile.save()
+        other_requestgroup = mixer.blend(RequestGroup, proposal=self.proposal, submitter=self.user, state='PENDING',
+                                         observation_type=RequestGroup.NORMAL)
+        with self.settings(NOTIFICATION_DIGEST=True):
+            for requestgroup in [self.requestgroup, other_requestgroup]:
+                requestgroup.state = 'COMPLETED'
+                requestgroup.save()
+
+            self.broker.join("default")
+            self.worker.join()
+            self.assertEqual(len(mail.outbox), 0)
+
+            send_notification_digest()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(self.requestgroup.name, str(mail.outbox[0].message()))
+        self.assertIn(other_requestgroup.name, str(mail.outbox[0].message()))
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertFalse(QueuedNotification.objects.exists())
+
+        # Later writes to a notified requestgroup don't put it in the next digest
+        RequestGroup.objects.filter(pk=self.requestgroup.pk).update(modified=timezone.now())
+        with self.settings(NOTIFICATION_DIGEST=True):
+            send_notification_digest()
+        self.assertEqual(len(mail.outbox), 1)
+
 
 class TestTimeAllocationEmail(DramatiqTestCase):
     def setUp(self):
@@ -260,7 +293,8 @@ class TestProposalUserLimits(TestCase):
     def setUp(self):
         super().setUp()
         self.proposal = mixer.blend(Proposal)
-        semester = mixer.blend(Semester, start=timezone.now(), end=timezone.now() + datetime.timedelta(days=180))
+        semester = mixer.blend(Semester, start=timezone.now() - datetime.timedelta(days=1),
+                               end=timezone.now() + datetime.timedelta(days=180))
         mixer.blend(TimeAllocation, proposal=self.proposal, semester=semester, instrument_types=['1M0-SCICAM-SBIG'])
         self.user = blend_user()
         mixer.blend(Membership, user=self.user, proposal=self.proposal, role=Membership.CI)
@@ -273,6 +307,49 @@ class TestProposalUserLimits(TestCase):
                                    instrument_config=instrument_config)
         self.assertGreater(self.user.profile.time_used_in_proposal(self.proposal), 0)
 
+    def test_time_used_for_user_is_removed_when_requestgroup_is_canceled(self):
+        configuration = mixer.blend(Configuration, type='EXPOSE', instrument_type='1M0-SCICAM-SBIG')
+        instrument_config = mixer.blend(InstrumentConfig, configuration=configuration, exposure_time=30)
+        requestgroup = create_simple_requestgroup(self.user, self.proposal, configuration=configuration,
+                                                  instrument_config=instrument_config)
+        # Old enough to be counted into the stored time used, so canceling has to remove it from there
+        RequestGroup.objects.filter(pk=requestgroup.pk).update(created=timezone.now() - TimeUsedByUser.WATERMARK_LAG)
+        self.assertGreater(self.user.profile.time_used_in_proposal(self.proposal), 0)
+        self.assertGreater(TimeUsedByUser.objects.get(user=self.user, proposal=self.proposal).time_used, 0)
+        requestgroup.state = 'CANCELED'
+        requestgroup.save()
+        self.assertEqual(self.user.profile.time_used_in_proposal(self.proposal), 0)
+        self.assertAlmostEqual(TimeUsedByUser.objects.get(user=self.user, proposal=self.proposal).time_used, 0)
+
+    def test_time_used_for_user_counts_requestgroup_committed_after_a_higher_id(self):
+        configuration = mixer.blend(Configuration, type='EXPOSE', instrument_type='1M0-SCICAM-SBIG')
+        instrument_config = mixer.blend(InstrumentConfig, configuration=configuration, exposure_time=30)
+        requestgroup = create_simple_requestgroup(self.user, self.proposal, configuration=configuration,
+                                                  instrument_config=instrument_config)
+        time_used = self.user.profile.time_used_in_proposal(self.proposal)
+        # Hide the requestgroup as if its transaction had not committed yet while a later one is counted
+        RequestGroup.objects.filter(pk=requestgroup.pk).update(submitter=blend_user())
+        configuration = mixer.blend(Configuration, type='EXPOSE', instrument_type='1M0-SCICAM-SBIG')
+        instrument_config = mixer.blend(InstrumentConfig, configuration=configuration, exposure_time=30)
+        create_simple_requestgroup(self.user, self.proposal, configuration=configuration,
+                                   instrument_config=instrument_config)
+        self.assertAlmostEqual(self.user.profile.time_used_in_proposal(self.proposal), time_used)
+        RequestGroup.objects.filter(pk=requestgroup.pk).update(submitter=self.user)
+        self.assertAlmostEqual(self.user.profile.time_used_in_proposal(self.proposal), 2 * time_used)
+
+    def test_reconcile_time_used_corrects_drifted_time_used(self):
+        configuration = mixer.blend(Configuration, type='EXPOSE', instrument_type='1M0-SCICAM-SBIG')
+        instrument_config = mixer.blend(InstrumentConfig, configuration=configuration, exposure_time=30)
+        requestgroup = create_simple_requestgroup(self.user, self.proposal, configuration=configuration,
+                                                  instrument_config=instrument_config)
+        # Old enough to be counted into the stored time used
+        RequestGroup.objects.filter(pk=requestgroup.pk).update(created=timezone.now() - TimeUsedByUser.WATERMARK_LAG)
+        time_used = self.user.profile.time_used_in_proposal(self.proposal)
+        self.assertAlmostEqual(TimeUsedByUser.objects.get(user=self.user, proposal=self.proposal).time_used, time_used)
+        TimeUsedByUser.objects.filter(user=self.user, proposal=self.proposal).update(time_used=0)
+        call_command('reconcile_time_used', stdout=StringIO(), stderr=StringIO())
+        self.assertAlmostEqual(self.user.profile.time_used_in_proposal(self.proposal), time_used)
+
 
 class TestDefaultIPP(TestCase):
     def setUp(self):
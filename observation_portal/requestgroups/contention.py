@@ -1,14 +1,23 @@
+from collections import defaultdict
 from datetime import timedelta
-import math
+import logging
 
+import numpy as np
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.db.models.functions import Floor
 from django.utils import timezone
 
-from observation_portal.requestgroups.models import Request
+from observation_portal.requestgroups.models import Request, Configuration
 from observation_portal.common.rise_set_utils import (
     get_filtered_rise_set_intervals_by_site, get_site_rise_set_intervals
 )
 from observation_portal.common.configdb import configdb
 
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_CACHE_DURATION = 60 * 10
+
 
 class Contention(object):
     def __init__(self, instrument_type, anonymous=True):
@@ -24,22 +33,32 @@ class Contention(object):
             state='PENDING',
             configurations__instrument_type=instrument_type,
             configurations__target__type='ICRS'
-        ).prefetch_related(
-            'configurations', 'windows', 'configurations__target', 'location', 'request_group',
-            'request_group__proposal', 'configurations__instrument_configs', 'configurations__acquisition_config',
-            'configurations__guiding_config', 'configurations__constraints'
-        ).distinct()
+        )
+
+    def _configurations(self):
+        return Configuration.objects.filter(request__in=self.requests.values('id'))
 
     def _binned_durations_by_proposal_and_ra(self):
         ra_bins = [{} for x in range(0, 24)]
-        for request in self.requests:
-            for conf in request.configurations.all():
-                ra = math.floor(conf.target.ra / 15)
-                proposal_id = request.request_group.proposal.id
-                if not ra_bins[ra].get(proposal_id):
-                    ra_bins[ra][proposal_id] = conf.duration
-                else:
-                    ra_bins[ra][proposal_id] += conf.duration
+        binned_durations = self._configurations().filter(cached_duration__isnull=False).annotate(
+            ra_bin=Floor(F('target__ra') / 15)
+        ).values(
+            'ra_bin', 'request__request_group__proposal'
+        ).annotate(
+            total_duration=Sum('cached_duration')
+        )
+        for binned_duration in binned_durations:
+            ra_bins[int(binned_duration['ra_bin'])][binned_duration['request__request_group__proposal']] = \
+                binned_duration['total_duration']
+        # Configurations created before their duration was stored have it computed here, and stored by the
+        # populate_cached_duration command rather than on this read path
+        missing_configurations = self._configurations().filter(cached_duration__isnull=True).select_related(
+            'request__request_group', 'target', 'constraints', 'acquisition_config', 'guiding_config'
+        ).prefetch_related('instrument_configs', 'instrument_configs__rois')
+        for configuration in missing_configurations:
+            ra_bin = ra_bins[int(configuration.target.ra // 15)]
+            proposal = configuration.request.request_group.proposal_id
+            ra_bin[proposal] = ra_bin.get(proposal, 0) + configuration.duration
         return ra_bins
 
     @staticmethod
@@ -70,6 +89,7 @@ class Pressure(object):
         self.instrument_type = instrument_type
         self.sites = self._sites()
         self.telescopes = {}
+        self.telescope_counts = {}
 
     def _requests(self, instrument_type, site):
         requests = Request.objects.filter(
@@ -93,6 +113,15 @@ class Pressure(object):
             self.telescopes[instrument_type] = telescopes
         return self.telescopes[instrument_type]
 
+    def _telescope_counts(self, instrument_type):
+        """Return the number of schedulable telescopes per lower cased site code for an instrument type"""
+        if instrument_type not in self.telescope_counts:
+            counts = defaultdict(int)
+            for telescope in self._telescopes(instrument_type):
+                counts[telescope.site.lower()] += 1
+            self.telescope_counts[instrument_type] = counts
+        return self.telescope_counts[instrument_type]
+
     def _sites(self):
         if self.site:
             return [{'code': self.site}]
@@ -119,27 +148,32 @@ class Pressure(object):
         return flattened
 
     def _n_possible_telescopes(self, time, site_intervals, instrument_type):
+        telescope_counts = self._telescope_counts(instrument_type)
         n_telescopes = 0
         for site in site_intervals:
             for interval in site_intervals[site]:
                 if interval[0] <= time < interval[1]:
-                    n_telescopes += sum([1 for t in self._telescopes(instrument_type) if t.site.lower() == site.lower()])
+                    n_telescopes += telescope_counts.get(site.lower(), 0)
         return n_telescopes
 
     def _visible_intervals(self, request):
         visible_intervals = {}
-        for site in self.sites:
-            if not request.location.site or request.location.site.lower() == site['code'].lower():
-                intervals = get_filtered_rise_set_intervals_by_site(
-                    request.as_dict(), site['code']
-                ).get(site['code'], [])
-                for r, s in intervals:
-                    effective_rise = max(r, self.now)
-                    if s > self.now and (s-effective_rise).seconds >= request.duration:
-                        if site['code'] in visible_intervals:
-                            visible_intervals[site['code']].append((effective_rise, s))
-                        else:
-                            visible_intervals[site['code']] = [(effective_rise, s)]
+        if request.location.site:
+            sites = [site['code'] for site in self.sites if site['code'].lower() == request.location.site.lower()]
+        else:
+            sites = [site['code'] for site in self.sites]
+        if not sites:
+            return visible_intervals
+        # A single call returns the intervals for every site the request may be observed at
+        intervals_by_site = get_filtered_rise_set_intervals_by_site(request.as_dict(), sites[0] if len(sites) == 1 else '')
+        for site in sites:
+            for r, s in intervals_by_site.get(site, []):
+                effective_rise = max(r, self.now)
+                if s > self.now and (s-effective_rise).seconds >= request.duration:
+                    if site in visible_intervals:
+                        visible_intervals[site].append((effective_rise, s))
+                    else:
+                        visible_intervals[site] = [(effective_rise, s)]
         return visible_intervals
 
     def _time_visible(self, site_intervals):
@@ -148,34 +182,56 @@ class Pressure(object):
     def _time_bins(self):
         return [self.now + timedelta(minutes=15 * x) for x in range(0, 24 * 4)]
 
+    def _n_possible_telescopes_per_bin(self, bin_start_times, site_intervals, instrument_type):
+        """Return an array with the number of telescopes the request could be observed on at the start of each bin"""
+        telescope_counts = self._telescope_counts(instrument_type)
+        n_telescopes = np.zeros(len(bin_start_times), dtype=int)
+        for site, intervals in site_intervals.items():
+            n_site_telescopes = telescope_counts.get(site.lower(), 0)
+            if not n_site_telescopes:
+                continue
+            for start, end in intervals:
+                visible = (bin_start_times >= start.timestamp()) & (bin_start_times < end.timestamp())
+                n_telescopes += visible * n_site_telescopes
+        return n_telescopes
+
     def _binned_pressure_by_hours_from_now(self):
-        quarter_hour_bins = [{} for x in range(0, 24 * 4)]
-        bin_start_times = self._time_bins()
+        bin_start_times = np.array([bin_start.timestamp() for bin_start in self._time_bins()])
+        proposal_rows = {}
+        pressure = []
+        has_pressure = []
 
         for request in self.requests:
             site_intervals = self._visible_intervals(request)
             total_time_visible = self._time_visible(site_intervals)
-            instrument_type = request.configurations.all()[0].instrument_type
 
             if total_time_visible < 1:
                 continue
 
+            instrument_type = request.configurations.all()[0].instrument_type
+            n_telescopes = self._n_possible_telescopes_per_bin(bin_start_times, site_intervals, instrument_type)
+            possible = n_telescopes > 0
+            if not possible.any():
+                continue
+
+            proposal = request.request_group.proposal.id
+            if proposal not in proposal_rows:
+                proposal_rows[proposal] = len(pressure)
+                pressure.append(np.zeros(len(bin_start_times)))
+                has_pressure.append(np.zeros(len(bin_start_times), dtype=bool))
+            row = proposal_rows[proposal]
             base_pressure = request.duration / total_time_visible
-            for i, bin_start in enumerate(bin_start_times):
-                n_telescopes = self._n_possible_telescopes(bin_start, site_intervals, instrument_type)
-
-                if n_telescopes < 1:
-                    continue
-
-                pressure = base_pressure / n_telescopes
-                proposal = request.request_group.proposal.id
-                if not quarter_hour_bins[i].get(proposal):
-                    quarter_hour_bins[i][proposal] = pressure
-                else:
-                    quarter_hour_bins[i][proposal] += pressure
+            pressure[row][possible] += base_pressure / n_telescopes[possible]
+            has_pressure[row] |= possible
+
+        quarter_hour_bins = [{} for x in range(0, 24 * 4)]
+        for proposal, row in proposal_rows.items():
+            for i in np.flatnonzero(has_pressure[row]):
+                quarter_hour_bins[i][proposal] = float(pressure[row][i])
         return quarter_hour_bins
 
-    def _anonymize(self, data):
+    @staticmethod
+    def _anonymize(data):
         for index, time in enumerate(data):
             data[index] = {'All Proposals': sum(time.values())}
         return data
@@ -193,3 +249,69 @@ class Pressure(object):
         else:
             p_data['pressure_data'] = self._binned_pressure_by_hours_from_now()
         return p_data
+
+
+def _pressure_snapshot_cache_key(instrument_type=None, site=None):
+    return f'pressure_snapshot_{instrument_type or "all"}_{site or "all"}'
+
+
+def _contention_snapshot_cache_key(instrument_type):
+    return f'contention_snapshot_{instrument_type}'
+
+
+def refresh_pressure_snapshot(instrument_type=None, site=None):
+    """Compute the full pressure for an instrument type and site and store it in the shared cache"""
+    pressure_data = Pressure(instrument_type, site, anonymous=False).data()
+    cache.set(_pressure_snapshot_cache_key(instrument_type, site), pressure_data, SNAPSHOT_CACHE_DURATION)
+    return pressure_data
+
+
+def refresh_contention_snapshot(instrument_type):
+    """Compute the full contention for an instrument type and store it in the shared cache"""
+    contention_data = Contention(instrument_type, anonymous=False).data()
+    cache.set(_contention_snapshot_cache_key(instrument_type), contention_data, SNAPSHOT_CACHE_DURATION)
+    return contention_data
+
+
+def refresh_snapshots():
+    """Refresh the pressure for all instrument types and all sites, and the contention for every instrument type.
+    Pressure for a combination of instrument type and site is only computed when it is first requested. A snapshot that
+    fails to refresh keeps its previous value, and the others are still refreshed.
+    """
+    instrument_types = configdb.get_instrument_types().keys()
+    refreshes = [(refresh_pressure_snapshot, {})]
+    refreshes.extend((refresh_pressure_snapshot, {'site': site['code']}) for site in configdb.get_site_data())
+    for instrument_type in instrument_types:
+        refreshes.append((refresh_pressure_snapshot, {'instrument_type': instrument_type}))
+        refreshes.append((refresh_contention_snapshot, {'instrument_type': instrument_type}))
+    for refresh, kwargs in refreshes:
+        try:
+            refresh(**kwargs)
+        except Exception:
+            logger.exception(f'Failed to run {refresh.__name__} with {kwargs}')
+
+
+def get_pressure_data(instrument_type=None, site=None, anonymous=True):
+    """Return the latest pressure snapshot, computing it if there is none yet. The snapshot keeps the time it was
+    calculated in `time_calculated`.
+    """
+    pressure_data = cache.get(_pressure_snapshot_cache_key(instrument_type, site))
+    if pressure_data is None:
+        pressure_data = refresh_pressure_snapshot(instrument_type, site)
+    if anonymous:
+        pressure_data = dict(pressure_data, pressure_data=Pressure._anonymize(list(pressure_data['pressure_data'])))
+    return pressure_data
+
+
+def get_contention_data(instrument_type, anonymous=True):
+    """Return the latest contention snapshot, computing it if there is none yet. The snapshot keeps the time it was
+    calculated in `time_calculated`.
+    """
+    contention_data = cache.get(_contention_snapshot_cache_key(instrument_type))
+    if contention_data is None:
+        contention_data = refresh_contention_snapshot(instrument_type)
+    if anonymous:
+        contention_data = dict(
+            contention_data, contention_data=Contention._anonymize(list(contention_data['contention_data']))
+        )
+    return contention_data
@@ -106,16 +106,26 @@ def get_max_ipp_for_requestgroup(requestgroup_dict):
     return ipp_dict
 
 
-def get_requestgroup_duration(requestgroup_dict):
-    duration_sum = {}
+def get_request_durations_by_tak(requestgroup_dict):
+    """Return the duration of each request of the requestgroup by TimeAllocationKey, in the order of the requests"""
+    request_durations_by_tak = []
     for req in requestgroup_dict['requests']:
-        duration_by_instrument_type = get_request_duration_by_instrument_type(req)
-        for instrument_type, duration in duration_by_instrument_type.items():
-            tak = get_time_allocation_key(
-                instrument_type=instrument_type,
-                min_window_time=min([w['start'] for w in req['windows']]),
-                max_window_time=max([w['end'] for w in req['windows']])
-            )
+        min_window_time = min([w['start'] for w in req['windows']])
+        max_window_time = max([w['end'] for w in req['windows']])
+        durations_by_tak = {}
+        for instrument_type, duration in get_request_duration_by_instrument_type(req).items():
+            tak = get_time_allocation_key(instrument_type, min_window_time, max_window_time)
+            durations_by_tak[tak] = durations_by_tak.get(tak, 0) + duration
+        request_durations_by_tak.append(durations_by_tak)
+    return request_durations_by_tak
+
+
+def get_requestgroup_duration(requestgroup_dict, request_durations_by_tak=None):
+    if request_durations_by_tak is None:
+        request_durations_by_tak = get_request_durations_by_tak(requestgroup_dict)
+    duration_sum = {}
+    for durations_by_tak in request_durations_by_tak:
+        for tak, duration in durations_by_tak.items():
             if tak not in duration_sum:
                 duration_sum[tak] = 0
             duration_sum[tak] += duration
@@ -288,26 +298,19 @@ def get_time_allocation_key(instrument_type, min_window_time, max_window_time):
     return TimeAllocationKey(semester.id, instrument_type)
 
 
-def get_total_duration_dict(requestgroup_dict):
+def get_total_duration_dict(requestgroup_dict, request_durations_by_tak=None):
+    if request_durations_by_tak is None:
+        request_durations_by_tak = get_request_durations_by_tak(requestgroup_dict)
     # In the case of a SINGLE request requestgroup, we can just return the requestgroup duration dict (tak -> duration)
     if requestgroup_dict['operator'] == 'SINGLE':
-        return get_requestgroup_duration(requestgroup_dict)
+        return get_requestgroup_duration(requestgroup_dict, request_durations_by_tak)
     else:
         # This will contain each duration for a request for a tak in the requestgroup
         # This is needed to decide if we pick the max or sum them later depending on requestgroup operator
         all_durations_by_tak = {}
         total_duration = {}
-        for request in requestgroup_dict['requests']:
-            min_window_time = min([window['start'] for window in request['windows']])
-            max_window_time = max([window['end'] for window in request['windows']])
-
-            duration_by_instrument_type = get_request_duration_by_instrument_type(request)
-            for instrument_type, duration in duration_by_instrument_type.items():
-                tak = get_time_allocation_key(
-                    instrument_type,
-                    min_window_time,
-                    max_window_time
-                )
+        for durations_by_tak in request_durations_by_tak:
+            for tak, duration in durations_by_tak.items():
                 if tak not in all_durations_by_tak:
                     all_durations_by_tak[tak] = []
                 all_durations_by_tak[tak].append(ceil(duration))
@@ -1,4 +1,5 @@
 import django_filters
+from django.db.models import Exists, OuterRef
 from observation_portal.requestgroups.models import RequestGroup, Request
 from observation_portal.common.configdb import configdb
 
@@ -10,14 +11,14 @@ class RequestGroupFilter(django_filters.FilterSet):
     user = django_filters.CharFilter(field_name='submitter__username', lookup_expr='icontains', label='Username contains')
     exclude_state = django_filters.MultipleChoiceFilter(field_name='state', choices=RequestGroup.STATE_CHOICES, label='Exclude State', exclude=True)
     telescope_class = django_filters.MultipleChoiceFilter(
-        choices=lambda: configdb.get_telescope_class_tuples(), field_name='requests__location__telescope_class', distinct=True,
+        choices=lambda: configdb.get_telescope_class_tuples(), field_name='location__telescope_class__in',
+        method='filter_requests'
     )
     target = django_filters.CharFilter(
-        field_name='requests__configurations__target__name', lookup_expr='icontains', label='Target name contains',
-        distinct=True
+        field_name='configurations__target__name__icontains', label='Target name contains', method='filter_requests'
     )
-    modified_after = django_filters.DateTimeFilter(field_name='requests__modified', lookup_expr='gte', label='Modified After', distinct=True)
-    modified_before = django_filters.DateTimeFilter(field_name='requests__modified', lookup_expr='lte', label='Modified Before', distinct=True)
+    modified_after = django_filters.DateTimeFilter(field_name='modified__gte', label='Modified After', method='filter_requests')
+    modified_before = django_filters.DateTimeFilter(field_name='modified__lte', label='Modified Before', method='filter_requests')
     order = django_filters.OrderingFilter(
         fields=(
             ('name', 'name'),
@@ -40,10 +41,14 @@ class RequestGroupFilter(django_filters.FilterSet):
             'state', 'created_after', 'created_before', 'user', 'modified_after', 'modified_before', 'request_id'
         )
 
+    def filter_requests(self, queryset, name, value):
+        # Use EXISTS rather than joining the requests, which would duplicate requestgroups
+        return queryset.filter(Exists(Request.objects.filter(request_group=OuterRef('pk'), **{name: value})))
+
 
 class RequestFilter(django_filters.FilterSet):
     telescope_class = django_filters.MultipleChoiceFilter(
-        choices=lambda: configdb.get_telescope_class_tuples(), field_name='location__telescope_class', distinct=True,
+        choices=lambda: configdb.get_telescope_class_tuples(), field_name='location__telescope_class'
     )
     class Meta:
         model = Request
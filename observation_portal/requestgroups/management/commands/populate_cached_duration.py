@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from observation_portal.requestgroups.models import Configuration
+
+import logging
+import time
+logger = logging.getLogger()
+
+
+class Command(BaseCommand):
+    help = ('Fills in the cached_duration of configurations that were created before it was stored on creation. The '
+            'contention computes the duration of those configurations every time until this has been run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pending-only', dest='pending_only', action='store_true', default=False,
+                            help='Only fill in the configurations of PENDING requests, which are the ones the contention uses.')
+        parser.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=1000,
+                            help='Number of configurations to update at a time.')
+
+    def handle(self, *args, **options):
+        configurations = Configuration.objects.filter(cached_duration__isnull=True).prefetch_related(
+            'instrument_configs', 'instrument_configs__rois', 'acquisition_config', 'guiding_config', 'target',
+            'constraints'
+        ).order_by('id')
+        if options['pending_only']:
+            configurations = configurations.filter(request__state='PENDING')
+        started = time.monotonic()
+        total_updated = 0
+        last_id = 0
+        while True:
+            batch = list(configurations.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            updated = []
+            for configuration in batch:
+                try:
+                    configuration.cached_duration = configuration.duration
+                    updated.append(configuration)
+                except Exception as ex:
+                    logger.warning(f"Failed to compute the duration of configuration {configuration.id}: {repr(ex)}")
+            Configuration.objects.bulk_update(updated, ['cached_duration'])
+            total_updated += len(updated)
+            elapsed = time.monotonic() - started
+            print(f'Updated cached_duration for {total_updated} configurations '
+                  f'({total_updated / elapsed if elapsed else 0:.1f} per second)', file=self.stdout)
+
+        print(f'Finished updating cached_duration for {total_updated} configurations in {time.monotonic() - started:.1f} seconds',
+              file=self.stdout)
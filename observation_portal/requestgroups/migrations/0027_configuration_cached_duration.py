@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requestgroups', '0026_alter_configuration_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuration',
+            name='cached_duration',
+            field=models.FloatField(blank=True, editable=False, help_text='The duration of this Configuration in seconds, including its front padding', null=True),
+        ),
+    ]
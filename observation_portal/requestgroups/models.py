@@ -480,7 +480,7 @@ class Configuration(models.Model):
         ('DARK', 'DARK')
     )
 
-    SERIALIZER_EXCLUDE = ('request',)
+    SERIALIZER_EXCLUDE = ('request', 'cached_duration')
 
     request = models.ForeignKey(
         Request, related_name='configurations', on_delete=models.CASCADE,
@@ -521,6 +521,12 @@ class Configuration(models.Model):
         help_text='The order that the Configurations within a Request will be observed. Configurations with priorities '
                   'that are lower numbers are executed first.'
     )
+    # Stored on creation so durations can be aggregated in the database. Only contention and the rapid response time
+    # accounting read it, everything else computes the duration from the live configuration and overheads.
+    cached_duration = models.FloatField(
+        null=True, blank=True, editable=False,
+        help_text='The duration of this Configuration in seconds, including its front padding'
+    )
 
     class Meta:
         ordering = ('id',)
@@ -1,10 +1,12 @@
 from datetime import timedelta
 from rise_set.angle import Angle
 from rise_set.astrometry import calculate_airmass_at_times
-import requests
 import json
 
 from observation_portal.common.configdb import configdb, ConfigDB
+from observation_portal.common.downtimedb import DowntimeDB
+from observation_portal.common.utils import run_concurrently
+from observation_portal.common.upstream import external_client
 from observation_portal.common.telescope_states import TelescopeStates, filter_telescope_states_by_intervals
 from observation_portal.common.rise_set_utils import get_rise_set_target, get_filtered_rise_set_intervals_by_site
 from observation_portal.requestgroups.target_helpers import TARGET_TYPE_HELPER_MAP
@@ -13,36 +15,42 @@ from observation_portal.requestgroups.target_helpers import TARGET_TYPE_HELPER_M
 def get_telescope_states_for_request(request_dict, is_staff=False):
     # TODO: update to support multiple instruments in a list
     instrument_type = request_dict['configurations'][0]['instrument_type']
-    site_intervals = {}
     only_schedulable = not (is_staff and ConfigDB.is_location_fully_set(request_dict.get('location', {})))
-    # Build up the list of telescopes and their rise set intervals for the target on this request
-    site_data = configdb.get_sites_with_instrument_type_and_location(
-        instrument_type=instrument_type,
-        site_code=request_dict['location']['site'] if 'site' in request_dict['location'] else '',
-        enclosure_code=request_dict['location']['enclosure'] if 'enclosure' in request_dict['location'] else '',
-        telescope_code=request_dict['location']['telescope'] if 'telescope' in request_dict['location'] else '',
-        only_schedulable=only_schedulable
+    # Build up the list of telescopes for this request, fetching the downtimes from DowntimeDB at the same time
+    site_data, downtime_intervals = run_concurrently(
+        lambda: configdb.get_sites_with_instrument_type_and_location(
+            instrument_type=instrument_type,
+            site_code=request_dict['location']['site'] if 'site' in request_dict['location'] else '',
+            enclosure_code=request_dict['location']['enclosure'] if 'enclosure' in request_dict['location'] else '',
+            telescope_code=request_dict['location']['telescope'] if 'telescope' in request_dict['location'] else '',
+            only_schedulable=only_schedulable
+        ),
+        DowntimeDB.get_downtime_intervals
     )
 
-    for site, details in site_data.items():
-        if site not in site_intervals:
-            site_intervals[site] = get_filtered_rise_set_intervals_by_site(request_dict, site=site, is_staff=is_staff).get(site, [])
-
     # If you have no sites, return the empty dict here
-    if not site_intervals:
+    if not site_data:
         return {}
 
-    # Retrieve the telescope states for that set of sites
+    # Retrieve the telescope states for that set of sites while computing the rise set intervals for the target
     min_window_time = min([window['start'] for window in request_dict['windows']])
     max_window_time = max([window['end'] for window in request_dict['windows']])
-    telescope_states = TelescopeStates(
-        start=min_window_time,
-        end=max_window_time,
-        sites=list(site_intervals.keys()),
-        instrument_types=[instrument_type],
-        location_dict=request_dict.get('location', {}),
-        only_schedulable=only_schedulable
-    ).get()
+    telescope_states, site_intervals = run_concurrently(
+        lambda: TelescopeStates(
+            start=min_window_time,
+            end=max_window_time,
+            sites=list(site_data.keys()),
+            instrument_types=[instrument_type],
+            location_dict=request_dict.get('location', {}),
+            only_schedulable=only_schedulable
+        ).get(),
+        lambda: {
+            site: get_filtered_rise_set_intervals_by_site(
+                request_dict, site=site, is_staff=is_staff, downtime_intervals=downtime_intervals
+            ).get(site, [])
+            for site in site_data
+        }
+    )
     # Remove the empty intervals from the dictionary
     site_intervals = {site: intervals for site, intervals in site_intervals.items() if intervals}
 
@@ -147,7 +155,7 @@ def exposure_completion_percentage(configuration_statuses):
 
 
 def return_paginated_results(collection, url):
-    response = requests.get(url)
+    response = external_client.get(url)
     response.raise_for_status()
     collection += response.json()['results']
     if not response.json()['next']:
@@ -15,23 +15,24 @@ from django.utils.module_loading import import_string
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-from observation_portal.proposals.models import TimeAllocation, Membership
+from observation_portal.proposals.models import Membership
 from observation_portal.requestgroups.models import (
     Request, Target, Window, RequestGroup, Location, Configuration, Constraints, InstrumentConfig,
     AcquisitionConfig, GuidingConfig, RegionOfInterest
 )
 from observation_portal.requestgroups.models import DraftRequestGroup
 from observation_portal.common.state_changes import debit_ipp_time, TimeAllocationError, validate_ipp
+from observation_portal.requestgroups.submission import SubmissionContext
 from observation_portal.requestgroups.target_helpers import TARGET_TYPE_HELPER_MAP
 from observation_portal.common.mixins import ExtraParamsFormatter
 from observation_portal.common.configdb import configdb, ConfigDB
 from observation_portal.common.utils import OCSValidator
 from observation_portal.requestgroups.duration_utils import (
-    get_total_request_duration, get_requestgroup_duration, get_total_duration_dict,
-    get_instrument_configuration_duration, get_semester_in
+    get_total_request_duration, get_instrument_configuration_duration, get_configuration_duration, get_semester_in
 )
 from datetime import timedelta
 from observation_portal.common.rise_set_utils import get_filtered_rise_set_intervals_by_site, get_largest_interval
+from observation_portal.common.change_notifications import notify_change
 
 logger = logging.getLogger(__name__)
 
@@ -825,6 +826,8 @@ class RequestGroupSerializer(serializers.ModelSerializer):
         }
 
     def create(self, validated_data):
+        # The submission is set by validate, unless validation was overridden
+        submission = getattr(self, 'submission', None)
         request_data = validated_data.pop('requests')
         now = timezone.now()
         with transaction.atomic():
@@ -843,6 +846,10 @@ class RequestGroupSerializer(serializers.ModelSerializer):
                         Window.objects.create(request=request, **window_data)
 
                 for configuration_data in configurations_data:
+                    if validated_data['observation_type'] not in RequestGroup.NON_SCHEDULED_TYPES:
+                        configuration_data['cached_duration'] = get_configuration_duration(
+                            configuration_data, configdb.get_request_overheads(configuration_data['instrument_type'])
+                        )['duration']
                     instrument_configs_data = configuration_data.pop('instrument_configs')
                     acquisition_config_data = configuration_data.pop('acquisition_config')
                     guiding_config_data = configuration_data.pop('guiding_config')
@@ -866,9 +873,10 @@ class RequestGroupSerializer(serializers.ModelSerializer):
                 telescope_class = location_data.get('telescope_class')
                 if telescope_class:
                     cache.set(f"observation_portal_last_change_time_{telescope_class}", now, None)
+                    notify_change(f"observation_portal_last_change_time_{telescope_class}")
 
         if validated_data['observation_type'] == RequestGroup.NORMAL:
-            debit_ipp_time(request_group)
+            debit_ipp_time(request_group, submission)
 
         logger.info('RequestGroup created', extra={'tags': {
             'user': request_group.submitter.username,
@@ -876,6 +884,7 @@ class RequestGroupSerializer(serializers.ModelSerializer):
             'name': request_group.name
         }})
         cache.set('observation_portal_last_change_time_all', now, None)
+        notify_change('observation_portal_last_change_time_all')
 
         return request_group
 
@@ -908,10 +917,13 @@ class RequestGroupSerializer(serializers.ModelSerializer):
                 _("'{}' type requestgroups must have more than one child request.".format(data['operator'].title()))
             )
 
+        # The durations and time allocations of this submission, shared with create
+        submission = SubmissionContext(data)
+
         # Check that the user has not exceeded the time limit on this membership
         membership = Membership.objects.get(user=user, proposal=data['proposal'])
         if membership.time_limit >= 0:
-            duration = sum(d for i, d in get_requestgroup_duration(data).items())
+            duration = sum(d for i, d in submission.duration_by_tak.items())
             time_to_be_used = user.profile.time_used_in_proposal(data['proposal']) + duration
             if membership.time_limit < time_to_be_used:
                 raise serializers.ValidationError(
@@ -929,18 +941,13 @@ class RequestGroupSerializer(serializers.ModelSerializer):
                         raise serializers.ValidationError(_('HOUR_ANGLE Target type not supported in scheduled observations'))
 
         try:
-            total_duration_dict = get_total_duration_dict(data)
-            for tak, duration in total_duration_dict.items():
-                time_allocation = TimeAllocation.objects.get(
-                    semester=tak.semester,
-                    instrument_types__contains=[tak.instrument_type],
-                    proposal=data['proposal'],
-                )
+            for tak, duration in submission.total_duration_by_tak.items():
+                time_allocation = submission.get_time_allocation(tak)
                 time_available = 0
                 if data['observation_type'] == RequestGroup.NORMAL:
-                    time_available = time_allocation.std_allocation - time_allocation.std_time_used
+                    time_available = time_allocation.std_allocation - submission.get_time_used(time_allocation, RequestGroup.NORMAL)
                 elif data['observation_type'] == RequestGroup.RAPID_RESPONSE:
-                    time_available = time_allocation.rr_allocation - time_allocation.rr_time_used
+                    time_available = time_allocation.rr_allocation - submission.get_time_used(time_allocation, RequestGroup.RAPID_RESPONSE)
                     # For Rapid Response observations, check if the end time of the window is within
                     # 24 hours + the duration of the observation
                     for request in data['requests']:
@@ -959,7 +966,7 @@ class RequestGroupSerializer(serializers.ModelSerializer):
                                 )
                 elif data['observation_type'] == RequestGroup.TIME_CRITICAL:
                     # Time critical time
-                    time_available = time_allocation.tc_allocation - time_allocation.tc_time_used
+                    time_available = time_allocation.tc_allocation - submission.get_time_used(time_allocation, RequestGroup.TIME_CRITICAL)
 
                 if time_available <= 0.0:
                     raise serializers.ValidationError(
@@ -973,7 +980,7 @@ class RequestGroupSerializer(serializers.ModelSerializer):
                     )
             # validate the ipp debitting that will take place later
             if data['observation_type'] == RequestGroup.NORMAL:
-                validate_ipp(data, total_duration_dict)
+                validate_ipp(data, submission)
         except ObjectDoesNotExist:
             raise serializers.ValidationError(
                 _("You do not have sufficient {} time allocated on the instrument you're requesting for this proposal.".format(
@@ -983,6 +990,7 @@ class RequestGroupSerializer(serializers.ModelSerializer):
         except TimeAllocationError as e:
             raise serializers.ValidationError(repr(e))
 
+        self.submission = submission
         return data
 
     def validate_requests(self, value):
@@ -1,7 +1,9 @@
 from django.dispatch import receiver
 from django.db.models.signals import pre_save, post_save
 
-from observation_portal.requestgroups.models import RequestGroup, Request
+from observation_portal.requestgroups.models import RequestGroup, Request, Window
+from observation_portal.observations.models import Observation
+from observation_portal.common.change_notifications import bump_schedule_versions
 from observation_portal.common.state_changes import on_request_state_change, on_requestgroup_state_change
 from observation_portal.proposals.notifications import requestgroup_notifications, request_notifications
 
@@ -33,3 +35,12 @@ def cb_requestgroup_send_notifications(sender, instance, *args, **kwargs):
 @receiver(post_save, sender=Request)
 def cb_request_send_notifications(sender, instance, *args, **kwargs):
     request_notifications(instance)
+
+
+@receiver(post_save, sender=Window)
+def cb_window_post_save(sender, instance, created, *args, **kwargs):
+    # The windows of a request are listed with its observations, so a changed window changes their schedules
+    if not created:
+        bump_schedule_versions(
+            Observation.objects.filter(request_id=instance.request_id).values_list('site', flat=True).distinct()
+        )
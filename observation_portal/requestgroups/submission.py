@@ -0,0 +1,66 @@
+"""
+submission.py - State shared by the validation and creation of a single requestgroup submission
+"""
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils.functional import cached_property
+
+from observation_portal.proposals.models import TimeAllocation, TimeAllocationKey
+from observation_portal.observations.time_accounting import TIME_USED_FIELDS
+from observation_portal.requestgroups.duration_utils import (
+    get_request_durations_by_tak, get_requestgroup_duration, get_total_duration_dict
+)
+
+
+class SubmissionContext(object):
+    """The durations and TimeAllocations of a requestgroup being submitted. The durations are computed from the
+    requestgroup dict once, and the TimeAllocations of the proposal are loaded with a single query, so they can be
+    shared by the serializer validation, the ipp validation, the creation and the ipp debit of the requestgroup.
+    """
+    def __init__(self, requestgroup_dict):
+        self.requestgroup_dict = requestgroup_dict
+
+    @cached_property
+    def request_durations_by_tak(self):
+        return get_request_durations_by_tak(self.requestgroup_dict)
+
+    @cached_property
+    def duration_by_tak(self):
+        """The summed duration of the requests by TimeAllocationKey"""
+        return get_requestgroup_duration(self.requestgroup_dict, self.request_durations_by_tak)
+
+    @cached_property
+    def total_duration_by_tak(self):
+        """The duration by TimeAllocationKey that the requestgroup operator will use"""
+        return get_total_duration_dict(self.requestgroup_dict, self.request_durations_by_tak)
+
+    @cached_property
+    def time_allocations(self):
+        """The proposal's TimeAllocations by TimeAllocationKey for the semesters of the requestgroup"""
+        semesters = {tak.semester for tak in self.duration_by_tak}
+        queryset = TimeAllocation.objects.filter(proposal=self.requestgroup_dict['proposal'], semester__in=semesters)
+        if settings.DEFER_TIME_ACCOUNTING:
+            # Sum the hours of the time accounting entries that the apply_time_accounting worker hasn't added yet
+            queryset = queryset.annotate(**{
+                f'unapplied_{time_used_field}': Sum('time_accounting_entries__hours', filter=Q(
+                    time_accounting_entries__applied=False, time_accounting_entries__observation_type=observation_type
+                )) for observation_type, time_used_field in TIME_USED_FIELDS.items()
+            })
+        time_allocations = {}
+        for time_allocation in queryset:
+            for instrument_type in time_allocation.instrument_types:
+                time_allocations[TimeAllocationKey(time_allocation.semester_id, instrument_type)] = time_allocation
+        return time_allocations
+
+    def get_time_allocation(self, tak):
+        try:
+            return self.time_allocations[tak]
+        except KeyError:
+            raise TimeAllocation.DoesNotExist(f'No TimeAllocation for {tak.instrument_type} in semester {tak.semester}')
+
+    @staticmethod
+    def get_time_used(time_allocation, observation_type):
+        """The hours of the TimeAllocation used by the observation type, including the time charged to it that has not
+        been applied to it yet"""
+        time_used_field = TIME_USED_FIELDS[observation_type]
+        return getattr(time_allocation, time_used_field) + (getattr(time_allocation, f'unapplied_{time_used_field}', None) or 0)
@@ -2,6 +2,7 @@ import dramatiq
 import logging
 
 from observation_portal.common.state_changes import update_request_states_for_window_expiration
+from observation_portal.requestgroups.contention import refresh_snapshots
 
 logger = logging.getLogger(__name__)
 
@@ -10,3 +11,9 @@ logger = logging.getLogger(__name__)
 def expire_requests():
     logger.info('Expiring requests')
     update_request_states_for_window_expiration()
+
+
+@dramatiq.actor()
+def refresh_pressure_and_contention():
+    logger.info('Refreshing pressure and contention snapshots')
+    refresh_snapshots()
@@ -15,6 +15,7 @@ from observation_portal.proposals.models import Proposal, TimeAllocation, Semest
 from observation_portal.common.configdb import ConfigDBException, configdb
 from observation_portal.common.test_helpers import SetTimeMixin
 from observation_portal.requestgroups.duration_utils import PER_CONFIGURATION_STARTUP_TIME
+from observation_portal.requestgroups.submission import SubmissionContext
 from observation_portal.requestgroups.serializers import ConfigurationTypeValidationHelper, InstrumentTypeValidationHelper, ModeValidationHelper
 from observation_portal.requestgroups.test.test_api import generic_payload
 from observation_portal.observations.models import Observation
@@ -102,6 +103,17 @@ class TestRequestGroupTotalDuration(SetTimeMixin, TestCase):
         taks = self.requests[0].time_allocation_keys
         self.assertEqual(sum_duration, total_duration[taks[0]])
 
+    def test_submission_context_loads_time_allocations_once(self):
+        self.rg_many.operator = 'AND'
+        self.rg_many.save()
+
+        submission = SubmissionContext(self.rg_many.as_dict())
+        self.assertEqual(submission.total_duration_by_tak, self.rg_many.total_duration)
+        with self.assertNumQueries(1):
+            for tak in submission.total_duration_by_tak:
+                self.assertEqual(submission.get_time_allocation(tak), self.time_allocation_1m0)
+                self.assertEqual(submission.get_time_allocation(tak), self.time_allocation_1m0)
+
 
 class TestRequestDuration(SetTimeMixin, TestCase):
     def setUp(self):
@@ -2,31 +2,35 @@ from observation_portal.requestgroups.models import (RequestGroup, Request, Draf
                                                      Configuration, Location, Constraints, InstrumentConfig,
                                                      AcquisitionConfig, GuidingConfig, Location)
 from observation_portal.proposals.models import Proposal, Membership, TimeAllocation, Semester
-from observation_portal.observations.models import Observation, ConfigurationStatus
+from observation_portal.observations.models import Observation, ConfigurationStatus, TimeAccountingEntry
 from observation_portal.common.test_helpers import SetTimeMixin, create_simple_requestgroup
 import observation_portal.requestgroups.signals.handlers  # noqa
 
 # imports for cache based tests
 import observation_portal.observations.signals.handlers  # noqa
 from observation_portal.requestgroups import serializers
-from observation_portal.requestgroups import views
 from observation_portal.common import state_changes
+from observation_portal.common import change_notifications
 from observation_portal.common.test_helpers import create_simple_configuration
 from observation_portal.common.configdb import configdb
+from observation_portal.requestgroups.duration_utils import get_configuration_duration
 
+from observation_portal.requestgroups import contention
 from observation_portal.requestgroups.contention import Pressure
 from observation_portal.accounts.test_utils import blend_user
 
 from django.urls import reverse
 from django.core.cache import caches
 from django.conf import settings
+from django.core.management import call_command
 from dateutil.parser import parse as datetime_parser
 from rest_framework.test import APITestCase
 from rest_framework.exceptions import ValidationError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from mixer.backend.django import mixer
 from django.utils import timezone
 from datetime import datetime, timedelta
+from io import StringIO
 import copy
 import random
 from math import ceil, cos, sin, radians
@@ -254,6 +258,14 @@ class TestUserPostRequestApi(SetTimeMixin, APITestCase):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.json()['name'], self.generic_payload['name'])
 
+    def test_post_requestgroup_stores_configuration_duration(self):
+        response = self.client.post(reverse('api:request_groups-list'), data=self.generic_payload)
+        self.assertEqual(response.status_code, 201)
+        configuration = Configuration.objects.get(id=response.json()['requests'][0]['configurations'][0]['id'])
+        request_overheads = configdb.get_request_overheads(configuration.instrument_type)
+        expected_duration = get_configuration_duration(configuration.as_dict(), request_overheads)['duration']
+        self.assertEqual(configuration.cached_duration, expected_duration)
+
     def test_post_requestgroup_wrong_proposal(self):
         bad_data = self.generic_payload.copy()
         bad_data['proposal'] = 'DoesNotExist'
@@ -383,6 +395,23 @@ class TestUserPostRequestApi(SetTimeMixin, APITestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('does not have enough NORMAL time allocated', str(response.content))
 
+    @override_settings(DEFER_TIME_ACCOUNTING=True)
+    def test_post_requestgroup_not_enough_time_allocation_with_unapplied_time_accounting(self):
+        bad_data = self.generic_payload.copy()
+        self.time_allocation_1m0_sbig.std_time_used = 50
+        self.time_allocation_1m0_sbig.save()
+        TimeAccountingEntry.objects.create(
+            time_allocation=self.time_allocation_1m0_sbig, configuration_status_id=1,
+            observation_type=RequestGroup.NORMAL, entry_type=TimeAccountingEntry.SUMMARY, hours=49.99
+        )
+        TimeAccountingEntry.objects.create(
+            time_allocation=self.time_allocation_1m0_sbig, configuration_status_id=2,
+            observation_type=RequestGroup.NORMAL, entry_type=TimeAccountingEntry.SUMMARY, hours=40, applied=True
+        )
+        response = self.client.post(reverse('api:request_groups-list'), data=bad_data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('does not have enough NORMAL time allocated', str(response.content))
+
     def test_post_requestgroup_not_enough_rr_time_allocation_for_instrument(self):
         bad_data = self.generic_payload.copy()
         bad_data['observation_type'] = RequestGroup.RAPID_RESPONSE
@@ -3148,6 +3177,51 @@ class TestContention(APITestCase):
         self.assertNotEqual(response.json()['contention_data'][1]['All Proposals'], 0)
         self.assertEqual(response.json()['contention_data'][2]['All Proposals'], 0)
 
+    def test_contention_does_not_store_missing_configuration_durations(self):
+        configuration = self.request.configurations.first()
+        self.assertIsNone(configuration.cached_duration)
+        response = self.client.get(reverse('api:contention', kwargs={'instrument_type': '1M0-SCICAM-SBIG'}))
+        self.assertNotEqual(response.json()['contention_data'][1]['All Proposals'], 0)
+        configuration.refresh_from_db()
+        self.assertIsNone(configuration.cached_duration)
+
+    def test_populate_cached_duration_stores_missing_configuration_durations(self):
+        configuration = self.request.configurations.first()
+        self.assertIsNone(configuration.cached_duration)
+        call_command('populate_cached_duration', stdout=StringIO())
+        configuration.refresh_from_db()
+        self.assertEqual(configuration.cached_duration, configuration.duration)
+
+    def test_configuration_duration_ignores_stored_duration(self):
+        configuration = self.request.configurations.first()
+        live_duration = configuration.duration
+        configuration.cached_duration = live_duration + 1000
+        configuration.save()
+        configuration = Configuration.objects.get(id=configuration.id)
+        self.assertEqual(configuration.duration, live_duration)
+
+    def test_contention_is_served_from_snapshot(self):
+        locmem_cache = caches.create_connection('testlocmem')
+        locmem_cache.clear()
+        with patch.object(contention, 'cache', locmem_cache):
+            contention.refresh_snapshots()
+            with patch.object(contention, 'Contention') as mock_contention:
+                response = self.client.get(
+                    reverse('api:contention', kwargs={'instrument_type': '1M0-SCICAM-SBIG'})
+                )
+                mock_contention.assert_not_called()
+        self.assertNotEqual(response.json()['contention_data'][1]['All Proposals'], 0)
+        self.assertIn('time_calculated', response.json())
+
+    def test_failed_snapshot_refresh_does_not_stop_the_others(self):
+        locmem_cache = caches.create_connection('testlocmem')
+        locmem_cache.clear()
+        with patch.object(contention, 'cache', locmem_cache):
+            with patch.object(contention.Pressure, 'data', side_effect=Exception('pressure failed')):
+                contention.refresh_snapshots()
+            self.assertIsNone(locmem_cache.get(contention._pressure_snapshot_cache_key()))
+            self.assertIsNotNone(locmem_cache.get(contention._contention_snapshot_cache_key('1M0-SCICAM-SBIG')))
+
     def test_contention_staff(self):
         user = blend_user(user_params={'is_staff': True})
         self.client.force_login(user)
@@ -3207,6 +3281,17 @@ class TestPressure(APITestCase):
         response = self.client.get(reverse('api:pressure'))
         self.assertNotIn('All Proposals', response.json()['pressure_data'][0])
 
+    def test_pressure_is_computed_on_cold_start_then_served_from_snapshot(self):
+        locmem_cache = caches.create_connection('testlocmem')
+        locmem_cache.clear()
+        with patch.object(contention, 'cache', locmem_cache):
+            first_response = self.client.get(reverse('api:pressure'))
+            with patch.object(contention, 'Pressure') as mock_pressure:
+                second_response = self.client.get(reverse('api:pressure'))
+                mock_pressure.assert_not_called()
+        self.assertEqual(first_response.json()['time_calculated'], second_response.json()['time_calculated'])
+        self.assertIn('All Proposals', second_response.json()['pressure_data'][0])
+
     def test_get_site_data_should_get_one_site(self):
         pressure = Pressure(site='tst')
         self.assertEqual(len(pressure.sites), 1)
@@ -3370,6 +3455,34 @@ class TestPressure(APITestCase):
         sum_of_pressure = sum(sum(time.values()) for i, time in enumerate(p._binned_pressure_by_hours_from_now()))
         self.assertGreater(sum_of_pressure, 0)
 
+    @patch('observation_portal.requestgroups.contention.get_filtered_rise_set_intervals_by_site')
+    def test_binned_pressure_by_hours_from_now_spreads_pressure_over_visible_bins(self, mock_intervals):
+        requestgroup = mixer.blend(RequestGroup, observation_type=RequestGroup.NORMAL)
+        request = mixer.blend(Request, request_group=requestgroup, state='PENDING', duration=120*60)  # 2 hour duration.
+        mixer.blend(Window, request=request)
+        mixer.blend(Location, request=request, site='tst')
+        conf = mixer.blend(Configuration, request=request, type='EXPOSE', instrument_type='1M0-SCICAM-SBIG')
+        mixer.blend(InstrumentConfig, configuration=conf)
+        mixer.blend(AcquisitionConfig, configuration=conf)
+        mixer.blend(GuidingConfig, configuration=conf)
+        mixer.blend(Constraints, configuration=conf)
+        mixer.blend(Target, configuration=conf)
+
+        mock_intervals.return_value = {'tst': [
+            [self.now + timedelta(hours=2), self.now + timedelta(hours=6)],
+        ]}
+        p = Pressure()
+        p.requests = [request]
+        binned = p._binned_pressure_by_hours_from_now()
+        proposal = requestgroup.proposal.id
+        # The 2 hours of pressure are spread over 4 visible hours and the 2 telescopes at tst
+        for i, time in enumerate(binned):
+            if 8 <= i < 24:
+                self.assertAlmostEqual(time[proposal], 0.25)
+            else:
+                self.assertNotIn(proposal, time)
+        self.assertEqual(mock_intervals.call_count, 1)
+
     def test_binned_pressure_by_hours_from_now_should_be_zero_pressure(self):
         p = Pressure()
         p.requests = []
@@ -3485,7 +3598,7 @@ class TestLastChanged(SetTimeMixin, APITestCase):
         # Mock the cache with a real one for these tests
         self.locmem_cache = caches.create_connection('testlocmem')
         self.locmem_cache.clear()
-        self.patch1 = patch.object(views, 'cache', self.locmem_cache)
+        self.patch1 = patch.object(change_notifications, 'cache', self.locmem_cache)
         self.patch1.start()
         self.patch2 = patch.object(state_changes, 'cache', self.locmem_cache)
         self.patch2.start()
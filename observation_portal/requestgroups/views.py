@@ -1,5 +1,4 @@
 from django.core.exceptions import ValidationError
-from django.core.cache import cache
 from django_filters.rest_framework.backends import DjangoFilterBackend
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAdminUser
@@ -15,12 +14,15 @@ from http import HTTPStatus
 
 from observation_portal import settings
 from observation_portal.common.configdb import configdb
+from observation_portal.common.change_notifications import (
+    ChangeSubscription, get_change_times, get_long_poll_parameters
+)
 from observation_portal.common.telescope_states import (
     TelescopeStates, get_telescope_availability_per_day, combine_telescope_availabilities_by_site_and_class,
     OpenSearchException
 )
 from observation_portal.requestgroups.request_utils import get_airmasses_for_request_at_sites
-from observation_portal.requestgroups.contention import Contention, Pressure
+from observation_portal.requestgroups.contention import get_contention_data, get_pressure_data
 from observation_portal.requestgroups.filters import InstrumentsInformationFilter, LastChangedFilter
 from observation_portal.common.doc_examples import EXAMPLE_RESPONSES, QUERY_PARAMETERS
 from observation_portal.common.schema import ObservationPortalSchema
@@ -182,11 +184,7 @@ class ContentionView(APIView):
     schema = ObservationPortalSchema(tags=['Utility'])
 
     def get(self, request, instrument_type):
-        if request.user.is_staff:
-            contention = Contention(instrument_type, anonymous=False)
-        else:
-            contention = Contention(instrument_type)
-        return Response(contention.data())
+        return Response(get_contention_data(instrument_type, anonymous=not request.user.is_staff))
 
     def get_example_response(self):
         return Response(data=EXAMPLE_RESPONSES['requestgroups']['contention'], status=status.HTTP_200_OK)
@@ -205,11 +203,7 @@ class PressureView(APIView):
     def get(self, request):
         instrument_type = request.GET.get('instrument')
         site = request.GET.get('site')
-        if request.user.is_staff:
-            pressure = Pressure(instrument_type, site, anonymous=False)
-        else:
-            pressure = Pressure(instrument_type, site)
-        return Response(pressure.data())
+        return Response(get_pressure_data(instrument_type, site, anonymous=not request.user.is_staff))
 
     def get_example_response(self):
         return Response(data=EXAMPLE_RESPONSES['requestgroups']['pressure'])
@@ -222,7 +216,8 @@ class PressureView(APIView):
 
 
 class ObservationPortalLastChangedView(APIView):
-    """Returns the datetime of the last status of requests change or new requests addition
+    """Returns the datetime of the last status of requests change or new requests addition. A client can pass the last
+    change time it saw as `since` to have the response held back until there is a change or `wait` seconds have passed.
     """
     permission_classes = (IsAdminUser,)
     schema = ObservationPortalSchema(tags=['RequestGroups'], is_list_view=False)
@@ -231,9 +226,12 @@ class ObservationPortalLastChangedView(APIView):
 
     def get(self, request):
         telescope_classes = request.GET.getlist('telescope_class', ['all'])
-        most_recent_change_time = timezone.now() - timedelta(days=7)
-        for telescope_class in telescope_classes:
-            most_recent_change_time = max(most_recent_change_time, cache.get(f"observation_portal_last_change_time_{telescope_class}", timezone.now() - timedelta(days=7)))
+        keys = [f"observation_portal_last_change_time_{telescope_class}" for telescope_class in telescope_classes]
+        since, wait = get_long_poll_parameters(request)
+        with ChangeSubscription(keys) as subscription:
+            most_recent_change_time = self._get_most_recent_change_time(keys)
+            if since is not None and most_recent_change_time <= since and subscription.wait(wait):
+                most_recent_change_time = self._get_most_recent_change_time(keys)
 
         response_serializer = self.get_response_serializer(data={'last_change_time': most_recent_change_time})
         if response_serializer.is_valid():
@@ -241,6 +239,10 @@ class ObservationPortalLastChangedView(APIView):
         else:
             raise ValidationError(response_serializer.errors)
 
+    @staticmethod
+    def _get_most_recent_change_time(keys):
+        return max(get_change_times(keys).values())
+
     def get_response_serializer(self, *args, **kwargs):
         return import_string(settings.SERIALIZERS['requestgroups']['LastChanged'])(*args, **kwargs)
 
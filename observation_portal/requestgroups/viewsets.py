@@ -7,14 +7,14 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAdminUser, IsAuthenticated
 from rest_framework import status
 from django.utils import timezone
-from django.db.models import Prefetch
+from django.db.models import Prefetch, Exists, OuterRef
 from django_filters.rest_framework import DjangoFilterBackend
 from dateutil.parser import parse
 from django.contrib.auth.models import User
 from django.utils.module_loading import import_string
 from django.conf import settings
 
-from observation_portal.proposals.models import Proposal, Semester, TimeAllocation
+from observation_portal.proposals.models import Proposal, Semester, TimeAllocation, Membership
 from observation_portal.requestgroups.models import (RequestGroup, Request, DraftRequestGroup, InstrumentConfig,
                                                      Configuration)
 from observation_portal.requestgroups.filters import RequestGroupFilter, RequestFilter
@@ -29,6 +29,7 @@ from observation_portal.requestgroups.request_utils import (
     get_airmasses_for_request_at_sites, get_telescope_states_for_request
 )
 from observation_portal.common.mixins import ListAsDictMixin
+from observation_portal.common.pagination import LimitOffsetOrCursorPagination
 from observation_portal.common.schema import ObservationPortalSchema
 from observation_portal.common.doc_examples import EXAMPLE_RESPONSES, QUERY_PARAMETERS
 
@@ -46,6 +47,7 @@ class RequestGroupViewSet(ListAsDictMixin, viewsets.ModelViewSet):
         DjangoFilterBackend
     )
     ordering = ('-id',)
+    pagination_class = LimitOffsetOrCursorPagination
 
     def get_throttles(self):
         actions_to_throttle = ['cancel', 'validate', 'create']
@@ -58,18 +60,20 @@ class RequestGroupViewSet(ListAsDictMixin, viewsets.ModelViewSet):
             if self.request.user.profile.staff_view and self.request.user.is_staff:
                 qs = RequestGroup.objects.all()
             else:
-                qs = RequestGroup.objects.filter(proposal__in=self.request.user.proposal_set.all())
+                qs = RequestGroup.objects.filter(
+                    Exists(Membership.objects.filter(user=self.request.user, proposal=OuterRef('proposal')))
+                )
                 if self.request.user.profile.view_authored_requests_only:
                     qs = qs.filter(submitter=self.request.user)
         else:
-            qs = RequestGroup.objects.filter(proposal__in=Proposal.objects.filter(public=True))
+            qs = RequestGroup.objects.filter(proposal__public=True)
         return qs.prefetch_related(
             'requests', 'requests__windows', 'requests__configurations', 'requests__location',
             'requests__configurations__instrument_configs', 'requests__configurations__target',
             'requests__configurations__acquisition_config', 'submitter', 'proposal',
             'requests__configurations__guiding_config', 'requests__configurations__constraints',
             'requests__configurations__instrument_configs__rois'
-        ).distinct()
+        )
 
     def perform_create(self, serializer):
         serializer.save(submitter=self.request.user)
@@ -262,6 +266,7 @@ class RequestViewSet(ListAsDictMixin, viewsets.ModelViewSet):
     )
     ordering = ('-id',)
     ordering_fields = ('id', 'state')
+    pagination_class = LimitOffsetOrCursorPagination
     undocumented_actions = ['telescope_states']
 
     def get_permissions(self):
@@ -280,16 +285,18 @@ class RequestViewSet(ListAsDictMixin, viewsets.ModelViewSet):
             if self.request.user.profile.staff_view and self.request.user.is_staff:
                 qs = Request.objects.all()
             else:
-                qs = Request.objects.filter(request_group__proposal__in=self.request.user.proposal_set.all())
+                qs = Request.objects.filter(Exists(Membership.objects.filter(
+                    user=self.request.user, proposal=OuterRef('request_group__proposal')
+                )))
                 if self.request.user.profile.view_authored_requests_only:
                     qs = qs.filter(request_group__submitter=self.request.user)
         else:
-            qs = Request.objects.filter(request_group__proposal__in=Proposal.objects.filter(public=True))
+            qs = Request.objects.filter(request_group__proposal__public=True)
         return qs.prefetch_related(
             'windows', 'configurations', 'location', 'configurations__instrument_configs', 'configurations__target',
             'configurations__acquisition_config', 'configurations__guiding_config', 'configurations__constraints',
             'configurations__instrument_configs__rois'
-        ).distinct()
+        )
 
     def create(self, request, *args, **kwargs):
         """
@@ -270,6 +270,40 @@ OPENSEARCH_URL = os.getenv('OPENSEARCH_URL', 'http://localhost')
 CONFIGDB_URL = os.getenv('CONFIGDB_URL', 'http://localhost')
 DOWNTIMEDB_URL = os.getenv('DOWNTIMEDB_URL', 'http://localhost')
 
+# Connection settings shared by the clients for upstream services (ConfigDB, DowntimeDB, client applications)
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 30))
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', 2))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv('UPSTREAM_RETRY_BACKOFF', 0.25))
+UPSTREAM_POOL_MAXSIZE = int(os.getenv('UPSTREAM_POOL_MAXSIZE', 10))
+# Number of consecutive failures before an upstream is no longer called, and seconds before trying it again
+UPSTREAM_CIRCUIT_BREAKER_THRESHOLD = int(os.getenv('UPSTREAM_CIRCUIT_BREAKER_THRESHOLD', 5))
+UPSTREAM_CIRCUIT_BREAKER_RESET = float(os.getenv('UPSTREAM_CIRCUIT_BREAKER_RESET', 30))
+
+# Redis used to push changes of the last scheduled and last changed times to long-polling clients. Leave empty to
+# disable long-polling, in which case those endpoints always answer straight away.
+NOTIFICATIONS_REDIS_URL = os.getenv('NOTIFICATIONS_REDIS_URL', '')
+# Longest time in seconds a long-polling client is kept waiting for a change
+LONG_POLL_MAX_WAIT = float(os.getenv('LONG_POLL_MAX_WAIT', 55))
+
+# Seconds to wait before propagating configuration status updates to their observation, request and request group.
+# Updates to the same observation within that time are propagated together by a worker. 0 propagates them immediately.
+# A delay requires a CACHE_BACKEND shared by the web and worker processes, such as redis or memcached.
+STATE_PROPAGATION_DELAY = float(os.getenv('STATE_PROPAGATION_DELAY', 0))
+
+# Time charged to TimeAllocations is recorded in a ledger first. When deferred, the ledger is applied to the
+# TimeAllocations every minute by a worker instead of straight away, and the time allocation checks of new
+# submissions add the entries that have not been applied yet.
+DEFER_TIME_ACCOUNTING = os.getenv('DEFER_TIME_ACCOUNTING', 'no').lower() in {'yes', 'true', 'y'}
+
+# Notification emails are sent by a worker once the state change is committed. With a digest, they are instead
+# collected every hour into a single email per user.
+NOTIFICATION_DIGEST = os.getenv('NOTIFICATION_DIGEST', 'no').lower() in {'yes', 'true', 'y'}
+
+# Old CANCELED observations are deleted by id in batches of this size, up to a maximum number each run
+DELETE_OLD_OBSERVATIONS_BATCH_SIZE = int(os.getenv('DELETE_OLD_OBSERVATIONS_BATCH_SIZE', 1000))
+DELETE_OLD_OBSERVATIONS_MAX_PER_RUN = int(os.getenv('DELETE_OLD_OBSERVATIONS_MAX_PER_RUN', 100000))
+
 # Real time session booking variables for availability
 # Availability from (current time + minutes in) to (current time + minutes in + days out)
 REAL_TIME_AVAILABILITY_DAYS_OUT = int(os.getenv('REAL_TIME_AVAILABILITY_DAYS_OUT', 7))
@@ -335,6 +369,10 @@ LOGGING = {
         'portal_request': {
             'level': 'INFO',
             'propogate': False
+        },
+        'upstream_request': {
+            'level': 'INFO',
+            'propogate': False
         }
     }
 }
@@ -360,6 +398,7 @@ SERIALIZERS = {
     'observations': {
         'Summary': os.getenv('OBSERVATIONS_SUMMARY_SERIALIZER', 'observation_portal.observations.serializers.SummarySerializer'),
         'ConfigurationStatus': os.getenv('OBSERVATIONS_CONFIGURATIONSTATUS_SERIALIZER', 'observation_portal.observations.serializers.ConfigurationStatusSerializer'),
+        'ConfigurationStatusBulkUpdate': os.getenv('OBSERVATIONS_CONFIGURATIONSTATUS_BULK_UPDATE_SERIALIZER', 'observation_portal.observations.serializers.ConfigurationStatusBulkUpdateSerializer'),
         'Target': os.getenv('OBSERVATIONS_TARGET_SERIALIZER', 'observation_portal.observations.serializers.ObservationTargetSerializer'),
         'Configuration': os.getenv('OBSERVATIONS_CONFIGURATION_SERIALIZER', 'observation_portal.observations.serializers.ObservationConfigurationSerializer'),
         'Request': os.getenv('OBSERVATIONS_REQUEST_SERIALIZER', 'observation_portal.observations.serializers.ObserveRequestSerializer'),
@@ -1,10 +1,10 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
 
-from observation_portal.requestgroups.tasks import expire_requests
-from observation_portal.observations.tasks import delete_old_observations
+from observation_portal.requestgroups.tasks import expire_requests, refresh_pressure_and_contention
+from observation_portal.observations.tasks import delete_old_observations, apply_time_accounting
 from observation_portal.accounts.tasks import expire_access_tokens
-from observation_portal.proposals.tasks import time_allocation_reminder
+from observation_portal.proposals.tasks import time_allocation_reminder, send_notification_digest, reconcile_time_used
 
 
 def run():
@@ -13,14 +13,30 @@ def run():
         expire_requests.send,
         CronTrigger.from_crontab('*/5 * * * *')
     )
+    scheduler.add_job(
+        refresh_pressure_and_contention.send,
+        CronTrigger.from_crontab('*/5 * * * *')
+    )
     scheduler.add_job(
         delete_old_observations.send,
         CronTrigger.from_crontab('0 * * * *')
     )
+    scheduler.add_job(
+        apply_time_accounting.send,
+        CronTrigger.from_crontab('* * * * *')
+    )
     scheduler.add_job(
         expire_access_tokens.send,
         CronTrigger.from_crontab('0 15 * * *')
     )
+    scheduler.add_job(
+        send_notification_digest.send,
+        CronTrigger.from_crontab('0 * * * *')
+    )
+    scheduler.add_job(
+        reconcile_time_used.send,
+        CronTrigger.from_crontab('30 3 * * *')
+    )
     scheduler.add_job(
         time_allocation_reminder.send,
         CronTrigger.from_crontab('0 0 1 * *')  # monthly
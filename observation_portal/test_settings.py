@@ -23,6 +23,9 @@ ORGANIZATION_ADMIN_EMAIL = 'test@example.com'
 OPENSEARCH_URL = os.getenv('OPENSEARCH_URL', 'http://opensearchdevfake')
 CONFIGDB_URL = os.getenv('CONFIGDB_URL', 'http://configdbfake')
 DOWNTIMEDB_URL = os.getenv('DOWNTIMEDB_URL', 'http://downtimedbfake')
+UPSTREAM_RETRIES = 0
+STATE_PROPAGATION_DELAY = 0
+DEFER_TIME_ACCOUNTING = False
 
 CACHES = {
     'default': {